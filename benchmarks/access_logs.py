@@ -0,0 +1,69 @@
+"""
+Requests per second on a trivial endpoint with access logging, written to stdout and the log file by the event loop
+thread (before), and put on the queue of the listener thread (after) in the text and json formats, and with 10% of
+the successful requests logged
+
+Usage (from the repository root):
+
+    python -m benchmarks.access_logs
+
+Stdout is `os.devnull` and the log file is written to a temporary folder. The listener thread writes the records
+still queued once the requests are over, that time is reported as "drain".
+"""
+import asyncio
+import logging
+import os
+import tempfile
+import time
+
+from benchmarks.middleware import create_app
+from benchmarks.utils import request, measure
+from core import venom
+from core.configurations import Configuration
+from core.logs import Logger
+
+REQUESTS = 20000
+CONCURRENCY = 20
+SCENARIOS = [
+    ("direct handlers", dict(), False),
+    ("queue text", dict(), True),
+    ("queue json", {"core.logs.format": "json"}, True),
+    ("queue text 10% sampled", {"core.logs.access.sample_rate": 0.1}, True)
+]
+
+
+def configure(logs_folder_path, overrides, use_queue):
+    venom.cfg = Configuration()
+    venom.cfg.cfg.update({"core.logs.folder_path": logs_folder_path}, **overrides)
+
+    logs = Logger()
+    logs.stream_handler.setStream(open(os.devnull, "w"))
+    if use_queue:
+        return logs.configure()
+
+    # the handlers as they were attached to the root logger by `logging.basicConfig`
+    root = logging.getLogger()
+    root.handlers = list(logs.handlers)
+    root.setLevel(logs.level)
+    return logs
+
+
+def main():
+    with tempfile.TemporaryDirectory() as logs_folder_path:
+        for name, overrides, use_queue in SCENARIOS:
+            logs = configure(logs_folder_path, overrides, use_queue)
+            app = create_app(pure_asgi=True)
+            result = asyncio.run(measure(lambda: request(app, "GET", "/ping"), total=REQUESTS, concurrency=CONCURRENCY))
+
+            start = time.perf_counter()
+            logs.stop()
+            drain = round((time.perf_counter() - start) * 1000)
+            for handler in logs.handlers:
+                handler.close()
+
+            print(f"{name:<24} {result['rps']:>8} req/s  p50 {result['p50']} ms  p99 {result['p99']} ms  "
+                  f"drain {drain} ms")
+
+
+if __name__ == "__main__":
+    main()
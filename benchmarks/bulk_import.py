@@ -0,0 +1,61 @@
+"""
+Time to onboard users one `POST /core/api/users/` request at a time (before)
+and with a single `POST /core/api/users/import` request (after)
+
+Usage (from the repository root):
+
+    python -m benchmarks.bulk_import [users] [url]
+
+Defaults to 200 users in a SQLite file. Password hashing dominates both, so the import scales with the number
+of CPUs of the password hashing pool while the one at a time requests hash a single password at a time.
+"""
+import asyncio
+import json
+import os
+import sys
+import time
+
+from benchmarks.utils import bootstrap, request, form, FORM_HEADERS
+
+DEFAULT_URL = "sqlite:///benchmark_bulk_import.db"
+DEFAULT_USERS = 200
+
+
+async def run_benchmark(app, count):
+    from core.api.oauth2.schemes import oauth2
+
+    await app.router.startup()
+    app.dependency_overrides[oauth2] = lambda: True
+
+    start = time.perf_counter()
+    for i in range(count):
+        status, body = await request(app, "POST", "/core/api/users/", headers=FORM_HEADERS, body=form(
+            username=f"single{i}", email=f"single{i}@example.com", password="benchmark"
+        ))
+        assert status == 200, body
+    single = time.perf_counter() - start
+
+    users = [dict(username=f"bulk{i}", email=f"bulk{i}@example.com", password="benchmark") for i in range(count)]
+    start = time.perf_counter()
+    status, body = await request(app, "POST", "/core/api/users/import", headers={"content-type": "application/json"},
+                                 body=json.dumps(users).encode())
+    assert status == 200 and json.loads(body)["created"] == count, body
+    bulk = time.perf_counter() - start
+
+    await app.router.shutdown()
+    return dict(single=single, bulk=bulk)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_USERS
+    url = sys.argv[2] if len(sys.argv) > 2 else DEFAULT_URL
+    app = bootstrap({"core.database.url": url})
+
+    results = asyncio.run(run_benchmark(app, count))
+    print(f"{os.cpu_count()} CPUs, {count} users")
+    for name, elapsed in results.items():
+        print(f"{name:<8} {round(elapsed, 2):>8} s  {round(count / elapsed, 1):>8} users/s")
+
+
+if __name__ == "__main__":
+    main()
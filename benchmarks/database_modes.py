@@ -0,0 +1,79 @@
+"""
+Throughput of the login and user read endpoints with the synchronous and the asyncio database engines
+
+Usage (from the repository root):
+
+    python -m benchmarks.database_modes [sync_url async_url]
+
+Each url is benchmarked in its own process, since the venom globals and routers are bound once per process.
+Defaults to a pair of SQLite files; pass e.g. `postgresql+psycopg2://...` and `postgresql+asyncpg://...`
+to compare the engines against a real server.
+"""
+import asyncio
+import json
+import subprocess
+import sys
+from collections import Counter
+
+from benchmarks.utils import bootstrap, request, measure, form, FORM_HEADERS
+
+DEFAULT_URLS = ["sqlite:///benchmark_sync.db", "sqlite+aiosqlite:///benchmark_async.db"]
+LOGINS = 40
+READS = 2000
+CONCURRENCY = 20
+
+
+async def run_benchmark(app):
+    await app.router.startup()
+
+    status, body = await request(app, "POST", "/core/api/users/", headers=FORM_HEADERS, body=form(
+        username="benchmark", email="benchmark@example.com", password="benchmark"
+    ))
+    assert status == 200, body
+    user_id = json.loads(body)["id"]
+
+    login_body = form(username="benchmark", password="benchmark")
+    status, body = await request(app, "POST", "/core/api/oauth2/token", headers=FORM_HEADERS, body=login_body)
+    assert status == 200, body
+    headers = {"authorization": f"Bearer {json.loads(body)['access_token']}"}
+
+    # the responses other than 200, e.g. 401 or 503, counted apart rather than as served requests
+    errors = Counter()
+
+    async def login():
+        status, _ = await request(app, "POST", "/core/api/oauth2/token", headers=FORM_HEADERS, body=login_body)
+        if status != 200:
+            errors["login", status] += 1
+
+    async def read_user():
+        status, _ = await request(app, "GET", f"/core/api/users/{user_id}", headers=headers)
+        if status != 200:
+            errors["read_user", status] += 1
+
+    results = dict(
+        login=await measure(login, total=LOGINS, concurrency=CONCURRENCY),
+        read_user=await measure(read_user, total=READS, concurrency=CONCURRENCY)
+    )
+    for (endpoint, status), count in errors.items():
+        results[endpoint].setdefault("errors", {})[status] = count
+    return results
+
+
+def main():
+    if len(sys.argv) == 2:
+        app = bootstrap({"core.database.url": sys.argv[1]})
+        print(json.dumps(asyncio.run(run_benchmark(app))))
+        return
+
+    urls = sys.argv[1:] if len(sys.argv) > 2 else DEFAULT_URLS
+    for url in urls:
+        output = subprocess.run([sys.executable, "-m", __spec__.name, url], capture_output=True, check=True)
+        results = json.loads(output.stdout.decode().strip().splitlines()[-1])
+        for endpoint, result in results.items():
+            errors = ", ".join(f"{count} x {status}" for status, count in result.get("errors", {}).items()) or "none"
+            print(f"{url:<45} {endpoint:<10} {result['rps']:>8} req/s  p50 {result['p50']} ms  p99 {result['p99']} ms  "
+                  f"errors {errors}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Time to find the configurations, messages, tests configuration, API routers and templates of the application with
+a walk of the whole working directory per file type (before), a single walk of the application folders (after)
+and the discovery manifest of a previous startup (after, manifest)
+
+Usage (from the repository root):
+
+    python -m benchmarks.discovery [files]
+
+The application folders are copied to a temporary working directory next to `files` files spread over logs,
+a virtualenv and node_modules folders, like the working directory of a deployment. Defaults to 20000 files.
+"""
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+from core.discovery import Discovery
+
+DEFAULT_FILES = 20000
+REPEATS = 20
+PACKAGES = [os.path.join("core", "api"), "api"]
+
+
+def walk_working_directory():
+    """ The discovery as it was done by `Configuration`, `Messages`, `TestRunner` and the package walks """
+    found = []
+    for name in ["configs.yml", "messages.ini", "pytest.ini"]:
+        for root, dirs, files in os.walk("."):
+            found.extend(os.path.join(root, filename) for filename in files if filename == name)
+
+    for package in PACKAGES:
+        for root, dirs, files in os.walk(package):
+            found.extend(os.path.join(root, filename) for filename in files if filename == "api.py")
+        for root, dirs, files in os.walk(package):
+            found.extend(os.path.join(root, directory) for directory in dirs if directory == "templates")
+    return found
+
+
+def create_working_directory(path, files):
+    for folder in ["core", "api", "conf"]:
+        shutil.copytree(folder, os.path.join(path, folder), ignore=shutil.ignore_patterns("__pycache__"))
+
+    # a third of the files in each of the folders, 100 files per sub folder
+    for folder in ["logs", os.path.join("venv", "lib"), "node_modules"]:
+        for i in range(files // 3):
+            sub_folder = os.path.join(path, folder, f"package{i // 100}")
+            os.makedirs(sub_folder, exist_ok=True)
+            open(os.path.join(sub_folder, f"file{i}.txt"), "w").close()
+
+
+def measure(call):
+    latencies = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        call()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return round(statistics.median(latencies), 2)
+
+
+def main():
+    files = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_FILES
+    cwd = os.getcwd()
+
+    with tempfile.TemporaryDirectory() as path:
+        create_working_directory(path, files)
+        os.chdir(path)
+        try:
+            manifest_path = os.path.join(path, "discovery.json")
+            Discovery(manifest_path=manifest_path)
+
+            print(f"working directory walks {measure(walk_working_directory):>8} ms")
+            print(f"discovery               {measure(Discovery):>8} ms")
+            print(f"discovery manifest      {measure(lambda: Discovery(manifest_path=manifest_path)):>8} ms")
+        finally:
+            os.chdir(cwd)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Delivery throughput of scheduled emails by 1, 2 and 4 `python -m core.api.emails.worker` processes
+
+Usage (from the repository root):
+
+    python -m benchmarks.email_outbox [emails] [url] [latency ms]
+
+Defaults to 1000 emails sent to a local SMTP sink that waits 20 ms before every reply, to stand in for a remote
+SMTP server. The workers claim emails with `SELECT ... FOR UPDATE SKIP LOCKED`, so the database must support it,
+e.g. PostgreSQL. Every run checks that each email was delivered exactly once.
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from email.mime.text import MIMEText
+
+import yaml
+from sqlalchemy import insert, delete, select, func
+
+from benchmarks.smtp_sink import SMTPSink
+from benchmarks.utils import bootstrap
+from core import venom
+
+DEFAULT_URL = "postgresql+psycopg2://postgres@localhost/postgres"
+DEFAULT_EMAILS = 1000
+DEFAULT_LATENCY = 20
+WORKERS = [1, 2, 4]
+CONFIG_FILENAME = "benchmark_email_outbox.yml"
+TIMEOUT = 600
+
+
+def schedule(connection, emails):
+    from core.api.emails.models import Email
+
+    message = MIMEText("<p>Benchmark message</p>" * 50, "html")
+    message["Subject"] = "Benchmark"
+    payload = message.as_bytes()
+    now = datetime.utcnow()
+
+    connection.execute(delete(Email.__table__))
+    connection.execute(insert(Email.__table__), [
+        dict(sender="venom@example.com", recipients=f"user{i}@example.com", subject="Benchmark", payload=payload,
+             payload_type="html", status=Email.SCHEDULED, attempts=0, next_attempt_on=now)
+        for i in range(emails)
+    ])
+
+
+def count_delivered(connection):
+    from core.api.emails.models import Email
+
+    query = select(func.count(Email.id)).filter(Email.status == Email.DELIVERED).filter(Email.attempts == 1)
+    return connection.execute(query).scalar()
+
+
+def run_benchmark(sink, emails, workers):
+    venom.database.run_sync(lambda connection: schedule(connection, emails))
+    sink.messages = 0
+
+    args = [sys.executable, "-m", "core.api.emails.worker", CONFIG_FILENAME]
+    processes = [subprocess.Popen(args, stdout=subprocess.DEVNULL) for _ in range(workers)]
+    try:
+        # measured from the first delivery, so that the startup of the processes is left out
+        deadline = time.perf_counter() + TIMEOUT
+        while not sink.messages and time.perf_counter() < deadline:
+            time.sleep(0.001)
+        start = time.perf_counter()
+        while sink.messages < emails and time.perf_counter() < deadline:
+            time.sleep(0.001)
+        elapsed = time.perf_counter() - start
+
+        # the outcomes of the last batch are recorded once all of its emails are sent
+        while venom.database.run_sync(count_delivered) < emails and time.perf_counter() < deadline:
+            time.sleep(0.1)
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+    delivered = venom.database.run_sync(count_delivered)
+    assert sink.messages == emails and delivered == emails, (sink.messages, delivered)
+    return round(emails / elapsed, 1)
+
+
+def main():
+    emails = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_EMAILS
+    url = sys.argv[2] if len(sys.argv) > 2 else DEFAULT_URL
+    latency = float(sys.argv[3]) if len(sys.argv) > 3 else DEFAULT_LATENCY
+    bootstrap({"core.database.url": url})
+
+    config_path = os.path.join("conf", CONFIG_FILENAME)
+    with SMTPSink(latency=latency / 1000) as sink, tempfile.TemporaryDirectory() as logs_folder_path:
+        with open(config_path, "w") as f:
+            yaml.safe_dump({
+                "core.database.url": url,
+                "core.logs.folder_path": logs_folder_path,
+                "core.api.emails.smtp_host": sink.host,
+                "core.api.emails.smtp_port": sink.port,
+                "core.api.emails.smtp_security": "none"
+            }, f)
+
+        try:
+            for workers in WORKERS:
+                rate = run_benchmark(sink, emails, workers)
+                print(f"{workers} worker(s) {rate:>8} emails/s")
+        finally:
+            os.remove(config_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Statements and latency of a page of user groups with their users and roles, loaded lazily (before)
+and with the `members` loading profile (after)
+
+Usage (from the repository root):
+
+    python -m benchmarks.loading_profiles [groups] [url]
+
+Defaults to 1000 user groups of 5 users and 2 roles each in a SQLite file, listed 100, 500 and 1000 at a time.
+Only synchronous database urls are supported, since `QueryExecutor` runs legacy `Query` objects.
+"""
+import sys
+import time
+from urllib.parse import urlencode
+
+from sqlalchemy import event, insert
+from starlette.requests import Request
+
+from benchmarks.utils import bootstrap
+from core import venom
+from core.models import QueryExecutor
+
+DEFAULT_URL = "sqlite:///benchmark_loading_profiles.db"
+DEFAULT_GROUPS = 1000
+GROUP_USERS = 5
+GROUP_ROLES = 2
+LIMITS = [100, 500, 1000]
+
+
+def get_request(**params):
+    scope = {"type": "http", "method": "GET", "path": "/", "query_string": urlencode(params).encode(), "headers": []}
+    return Request(scope)
+
+
+def populate(connection, groups):
+    from core.api.users.models import User, Role, UserGroup, UserGroupUser, UserGroupRole
+
+    users = groups * GROUP_USERS
+    connection.execute(insert(Role.__table__), [dict(id=i, name=f"role {i}") for i in range(1, GROUP_ROLES + 1)])
+    connection.execute(insert(User.__table__), [
+        dict(id=i, username=f"user{i}", email=f"user{i}@example.com", password="") for i in range(1, users + 1)
+    ])
+    connection.execute(insert(UserGroup.__table__), [dict(id=i, name=f"group {i}") for i in range(1, groups + 1)])
+    connection.execute(insert(UserGroupUser.__table__), [
+        dict(user_group_id=i // GROUP_USERS + 1, user_id=i + 1) for i in range(users)
+    ])
+    connection.execute(insert(UserGroupRole.__table__), [
+        dict(user_group_id=i, role_id=j) for i in range(1, groups + 1) for j in range(1, GROUP_ROLES + 1)
+    ])
+
+
+def list_groups(session, limit, profile):
+    from core.api.users.models import UserGroup
+
+    executor = QueryExecutor(request=get_request(limit=limit), query=session.query(UserGroup), profile=profile)
+    return [
+        dict(id=group.id, users=[user.username for user in group.users], roles=[role.name for role in group.roles])
+        for group in executor.all()
+    ]
+
+
+def run_benchmark(groups):
+    venom.database.run_sync(lambda connection: populate(connection, groups))
+
+    statements = 0
+
+    @event.listens_for(venom.database.engine, "before_cursor_execute")
+    def on_execute(*args):
+        nonlocal statements
+        statements += 1
+
+    results = []
+    for limit in LIMITS:
+        for profile in (None, "members"):
+            session = venom.database.Session()
+            statements = 0
+            start = time.perf_counter()
+            rows = list_groups(session, limit=limit, profile=profile)
+            elapsed = round((time.perf_counter() - start) * 1000, 1)
+            session.close()
+
+            assert len(rows) == min(limit, groups) and all(len(row["users"]) == GROUP_USERS for row in rows)
+            results.append((limit, profile or "lazy", statements, elapsed))
+    return results
+
+
+def main():
+    groups = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_GROUPS
+    url = sys.argv[2] if len(sys.argv) > 2 else DEFAULT_URL
+    bootstrap({"core.database.url": url})
+    if venom.database.is_async:
+        raise SystemExit(f"{url} is not a synchronous database url")
+
+    for limit, profile, statements, elapsed in run_benchmark(groups):
+        print(f"{limit:>5} groups {profile:<8} {statements:>5} statements {elapsed:>8} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Cost of recording the metrics, per call and per request of a trivial endpoint with the metrics disabled (before)
+and enabled (after), and time to expose the metrics merged over worker processes
+
+Usage (from the repository root):
+
+    python -m benchmarks.metrics [workers]
+
+Access logs are enabled and written to `os.devnull`, as in `benchmarks.middleware`. The merge reads the snapshots
+of `workers` processes (defaults to 8) with the metrics of 20 routes.
+"""
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import time
+import timeit
+
+from benchmarks.middleware import create_app
+from benchmarks.utils import request, measure
+from core import metrics, venom
+from core.configurations import Configuration
+
+REQUESTS = 5000
+CONCURRENCY = 20
+CALLS = 1000000
+DEFAULT_WORKERS = 8
+ROUTES = 20
+
+
+def measure_call(stmt):
+    """ Returns the nanoseconds per call of `stmt` """
+    return round(timeit.timeit(stmt, number=CALLS) / CALLS * 1e9)
+
+
+async def run_requests_benchmark():
+    results = {}
+    for name, enabled in [("metrics disabled", False), ("metrics enabled", True)]:
+        venom.cfg.cfg["core.metrics.enabled"] = enabled
+        app = create_app(pure_asgi=True)
+        results[name] = await measure(lambda: request(app, "GET", "/ping"), total=REQUESTS, concurrency=CONCURRENCY)
+    return results
+
+
+def measure_merge(workers):
+    histogram = metrics.http_request_duration_seconds
+    for i in range(ROUTES):
+        for status in ["200", "400", "404"]:
+            histogram.labels("GET", f"/route{i}", status).observe(0.01)
+
+    with tempfile.TemporaryDirectory() as folder_path:
+        snapshot = metrics.REGISTRY.collect()
+        for pid in range(workers):
+            metrics.write_snapshot(folder_path, snapshot=snapshot)
+            os.rename(os.path.join(folder_path, f"{os.getpid()}.json"), os.path.join(folder_path, f"{pid + 1}.json"))
+
+        start = time.perf_counter()
+        content = asyncio.run(metrics.generate(folder_path=folder_path))
+        return round((time.perf_counter() - start) * 1000, 2), len(content)
+
+
+def main():
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_WORKERS
+    logging.basicConfig(level=logging.INFO, handlers=[logging.FileHandler(os.devnull)])
+    venom.cfg = Configuration()
+
+    histogram = metrics.http_request_duration_seconds
+    child = histogram.labels("GET", "/ping", "200")
+    print(f"gauge inc                {measure_call(lambda: metrics.http_requests_in_flight.inc()):>8} ns")
+    print(f"histogram observe        {measure_call(lambda: child.observe(0.042)):>8} ns")
+    labels_observe = measure_call(lambda: histogram.labels("GET", "/ping", "200").observe(0.042))
+    print(f"histogram labels/observe {labels_observe:>8} ns")
+
+    for name, result in asyncio.run(run_requests_benchmark()).items():
+        print(f"{name:<24} {result['rps']:>8} req/s  p50 {result['p50']} ms  p99 {result['p99']} ms")
+
+    elapsed, size = measure_merge(workers)
+    print(f"/metrics of {workers} workers   {elapsed:>8} ms ({size} bytes)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Requests per second on a trivial endpoint with the `@app.middleware("http")` request handler (before)
+and the pure ASGI `HTTPMiddleware` (after)
+
+Usage (from the repository root):
+
+    python -m benchmarks.middleware
+
+Access logs are enabled and written to `os.devnull`, so formatting costs are part of the measurement.
+"""
+import asyncio
+import logging
+import os
+from datetime import datetime
+
+from fastapi import FastAPI, Request
+
+from benchmarks.utils import request, measure
+from core import venom
+from core.configurations import Configuration
+from core.database import LazySession
+
+REQUESTS = 5000
+CONCURRENCY = 20
+
+logger = logging.getLogger("core.venom")
+
+
+async def handle_http_middleware(request, call_next):
+    """ The request handler as it was registered through `@app.middleware("http")` """
+    start_request_on = datetime.now()
+
+    lazy_session = LazySession(factory=venom.database.Session.session_factory if hasattr(venom.database, "Session") else None)
+    request.state.lazy_session = lazy_session
+
+    try:
+        response = await call_next(request)
+    except Exception:
+        await lazy_session.close(commit=False)
+        raise
+
+    await lazy_session.close()
+
+    end_request_on = datetime.now()
+    request_time = round((end_request_on - start_request_on).total_seconds() * 1000)
+    remote_addr = request.url.hostname
+    method = request.method
+    path = request.url.path
+    http_version = request.scope.get("http_version")
+    server_protocol = f"{request.url.scheme.upper()}/{http_version}"
+    status_code = response.status_code
+
+    logger.info(f"{remote_addr} [{server_protocol}] \"{method} {path}\" {status_code} ({request_time} ms)")
+    return response
+
+
+def create_app(pure_asgi):
+    app = FastAPI()
+
+    @app.get("/ping")
+    async def ping():
+        return dict(pong=True)
+
+    if pure_asgi:
+        app.add_middleware(venom.HTTPMiddleware)
+    else:
+        @app.middleware("http")
+        async def handle_request(request: Request, call_next):
+            return await handle_http_middleware(request=request, call_next=call_next)
+
+    return app
+
+
+async def run_benchmark():
+    results = {}
+    for name, pure_asgi in [("@app.middleware(\"http\")", False), ("HTTPMiddleware", True)]:
+        app = create_app(pure_asgi=pure_asgi)
+        results[name] = await measure(lambda: request(app, "GET", "/ping"), total=REQUESTS, concurrency=CONCURRENCY)
+    return results
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, handlers=[logging.FileHandler(os.devnull)])
+    venom.cfg = Configuration()
+
+    for name, result in asyncio.run(run_benchmark()).items():
+        print(f"{name:<26} {result['rps']:>8} req/s  p50 {result['p50']} ms  p99 {result['p99']} ms")
+
+
+if __name__ == "__main__":
+    main()
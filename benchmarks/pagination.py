@@ -0,0 +1,113 @@
+"""
+Latency of a deep page of `QueryExecutor` results with `limit`/`offset` (before) and with a `cursor` (after)
+
+Usage (from the repository root):
+
+    python -m benchmarks.pagination [rows] [url]
+
+Defaults to 200000 user groups in a SQLite file, read 100 at a time, and measures page 1000.
+Only synchronous database urls are supported, since `QueryExecutor` runs legacy `Query` objects.
+The sort by name is backed by an index, as a deployment would add one for a column that is sorted on.
+"""
+import json
+import sys
+import time
+from urllib.parse import urlencode
+
+from sqlalchemy import Index, insert
+from starlette.requests import Request
+
+from benchmarks.utils import bootstrap
+from core import venom
+from core.models import QueryExecutor
+
+DEFAULT_URL = "sqlite:///benchmark_pagination.db"
+DEFAULT_ROWS = 200000
+BATCH_SIZE = 10000
+LIMIT = 100
+PAGE = 1000
+REPEAT = 20
+
+
+def get_request(**params):
+    scope = {"type": "http", "method": "GET", "path": "/", "query_string": urlencode(params).encode(), "headers": []}
+    return Request(scope)
+
+
+def populate(connection, rows):
+    from core.api.users.models import UserGroup
+
+    Index("i_benchmark_user_groups_name_id", UserGroup.__table__.c.name, UserGroup.__table__.c.id).create(connection)
+    for start in range(0, rows, BATCH_SIZE):
+        connection.execute(insert(UserGroup.__table__), [
+            dict(name=f"group {i * 7919 % rows:0>8}", description=f"group {i}")
+            for i in range(start, min(start + BATCH_SIZE, rows))
+        ])
+
+
+def timed(fn):
+    latencies = []
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        fn()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return round(sorted(latencies)[len(latencies) // 2], 2)
+
+
+def run_benchmark(rows):
+    from core.api.users.models import UserGroup
+
+    start = time.perf_counter()
+    venom.database.run_sync(lambda connection: populate(connection, rows))
+    print(f"{'setup':<16} {rows} rows in {round(time.perf_counter() - start, 1)} s")
+
+    session = venom.database.Session()
+    results = {}
+    for name, sort in [("id", None), ("name, id", [{"field": "name", "dir": "asc"}])]:
+        params = {"limit": LIMIT}
+        if sort:
+            params["sort"] = json.dumps(sort)
+
+        # walk the pages before the measured one to get its cursor
+        cursor = ""
+        for _ in range(PAGE - 1):
+            executor = QueryExecutor(request=get_request(cursor=cursor, **params), query=session.query(UserGroup))
+            executor.all()
+            cursor = executor.next_cursor
+
+        offset_page = QueryExecutor(
+            request=get_request(offset=(PAGE - 1) * LIMIT, **params),
+            query=session.query(UserGroup)
+        ).all()
+        cursor_page = QueryExecutor(request=get_request(cursor=cursor, **params), query=session.query(UserGroup)).all()
+        assert [g.id for g in offset_page] == [g.id for g in cursor_page]
+
+        results[name] = dict(
+            offset=timed(lambda: QueryExecutor(
+                request=get_request(offset=(PAGE - 1) * LIMIT, **params),
+                query=session.query(UserGroup)
+            ).all()),
+            cursor=timed(lambda: QueryExecutor(
+                request=get_request(cursor=cursor, **params),
+                query=session.query(UserGroup)
+            ).all())
+        )
+        session.expunge_all()
+
+    session.close()
+    return results
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_ROWS
+    url = sys.argv[2] if len(sys.argv) > 2 else DEFAULT_URL
+    bootstrap({"core.database.url": url})
+    if venom.database.is_async:
+        raise SystemExit(f"{url} is not a synchronous database url")
+
+    for name, result in run_benchmark(rows).items():
+        print(f"sort by {name:<8} page {PAGE}: offset {result['offset']} ms, cursor {result['cursor']} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Latency of the roles with their users count by loading every user role (before), by a single aggregate query
+and by the counter maintained on the roles (after)
+
+Usage (from the repository root):
+
+    python -m benchmarks.roles_count [users] [url]
+
+Defaults to 100000 users with the built-in USER role in a SQLite file.
+Only synchronous database urls are supported, since the queries are timed one at a time without an event loop.
+"""
+import asyncio
+import sys
+import time
+
+from sqlalchemy import insert
+
+from benchmarks.utils import bootstrap
+from core import venom
+
+DEFAULT_URL = "sqlite:///benchmark_roles_count.db"
+DEFAULT_USERS = 100000
+BATCH_SIZE = 10000
+REPEAT = 10
+
+
+def populate(connection, users):
+    from core.api.users.models import User, Role, UserRole
+
+    connection.execute(insert(Role.__table__), [dict(id=1, name="USER")])
+    for start in range(0, users, BATCH_SIZE):
+        ids = range(start + 1, min(start + BATCH_SIZE, users) + 1)
+        connection.execute(insert(User.__table__), [
+            dict(id=i, username=f"user{i}", email=f"user{i}@example.com", password="") for i in ids
+        ])
+        connection.execute(insert(UserRole.__table__), [dict(user_id=i, role_id=1) for i in ids])
+
+
+def get_roles_loaded(session):
+    # as the endpoint used to, with a lazy load of the user of every user role
+    from core.api.users.models import Role
+
+    roles = session.query(Role).outerjoin(Role._users).order_by(Role.id).all()
+    return [dict(id=role.id, users_count=len(role.users)) for role in roles]
+
+
+async def timed(fn):
+    latencies = []
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        result = await fn()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return result, round(sorted(latencies)[len(latencies) // 2], 2)
+
+
+async def run_benchmark(users):
+    from core.api.users.models import Role
+
+    start = time.perf_counter()
+    venom.database.run_sync(lambda connection: populate(connection, users))
+    print(f"{'setup':<10} {users} users in {round(time.perf_counter() - start, 1)} s")
+
+    session = venom.database.Session()
+    await Role.count_users(db=session)
+    session.commit()
+
+    async def loaded():
+        result = get_roles_loaded(session)
+        session.expunge_all()
+        return result[0]["users_count"]
+
+    async def counted(mode):
+        venom.cfg.cfg["core.api.users.roles_users_count"] = mode
+        return (await Role.get_all_with_users_count(db=session))[0]["users_count"]
+
+    results = {}
+    for name, fn in [("loaded", loaded), ("aggregate", lambda: counted("aggregate")),
+                     ("counter", lambda: counted("counter"))]:
+        count, latency = await timed(fn)
+        assert count == users, count
+        results[name] = latency
+
+    session.close()
+    return results
+
+
+def main():
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_USERS
+    url = sys.argv[2] if len(sys.argv) > 2 else DEFAULT_URL
+    bootstrap({"core.database.url": url})
+    if venom.database.is_async:
+        raise SystemExit(f"{url} is not a synchronous database url")
+
+    for name, latency in asyncio.run(run_benchmark(users)).items():
+        print(f"{name:<10} {latency} ms")
+
+
+if __name__ == "__main__":
+    main()
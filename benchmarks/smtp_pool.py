@@ -0,0 +1,64 @@
+"""
+Messages per second sent to a local SMTP sink over implicit TLS, opening a connection per message (before)
+and over the connection pool (after)
+
+Usage (from the repository root):
+
+    python -m benchmarks.smtp_pool [messages] [latency ms]
+
+Defaults to 200 messages, sent one at a time and from 4 threads, with no added latency. A latency, e.g. 5,
+delays every reply of the sink to stand in for the round trips to a remote SMTP server.
+"""
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.mime.text import MIMEText
+
+from benchmarks.smtp_sink import SMTPSink, create_contexts
+from core.api.emails.pool import SMTPConnectionPool
+
+DEFAULT_MESSAGES = 200
+THREADS = 4
+
+
+def get_message(i):
+    message = MIMEText(f"<p>Benchmark message {i}</p>" * 50, "html")
+    message["Subject"] = f"Benchmark {i}"
+    message["From"] = "venom@example.com"
+    message["To"] = "user@example.com"
+    return message.as_string()
+
+
+def run_benchmark(sink, client_context, messages, size, threads):
+    pool = SMTPConnectionPool(
+        host="localhost", port=sink.port, user="venom", password="venom", security="ssl", size=size,
+        context=client_context
+    )
+    sink.connections = 0
+
+    def send(i):
+        pool.sendmail(from_addr="venom@example.com", to_addrs=["user@example.com"], msg=get_message(i))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(send, range(messages)))
+    elapsed = time.perf_counter() - start
+
+    pool.close()
+    return round(messages / elapsed, 1), sink.connections
+
+
+def main():
+    messages = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_MESSAGES
+    latency = float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0
+
+    server_context, client_context = create_contexts()
+    with SMTPSink(context=server_context, latency=latency) as sink:
+        for threads in (1, THREADS):
+            for name, size in (("unpooled", 0), ("pooled", threads)):
+                rate, connections = run_benchmark(sink, client_context, messages, size=size, threads=threads)
+                print(f"{threads} thread(s) {name:<9} {rate:>8} messages/s  {connections:>4} connections")
+
+
+if __name__ == "__main__":
+    main()
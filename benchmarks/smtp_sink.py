@@ -0,0 +1,135 @@
+"""
+Local SMTP server that accepts and discards every message, for the email benchmarks
+
+It answers EHLO, AUTH PLAIN, MAIL, RCPT, DATA, NOOP, RSET and QUIT from a background thread, optionally over
+implicit TLS and after a fixed delay per reply, to stand in for the round trip to a real SMTP server.
+"""
+import asyncio
+import os
+import subprocess
+import ssl
+import tempfile
+import threading
+
+
+class SMTPSink(object):
+
+    def __init__(self, host="127.0.0.1", port=0, context=None, latency=0, reject=None):
+        """ Construct a new :class: `SMTPSink`
+
+        :param host: The host to listen on
+        :param port: The port to listen on, any free port when 0
+        :param context: The server SSL context for implicit TLS, plain text when None
+        :param latency: The number of seconds to wait before every reply
+        :param reject: A callable of the recipient address returning the reply refusing it, e.g. "550 5.1.1 Unknown",
+                       or None to accept it
+        """
+        self.host = host
+        self.port = port
+        self.context = context
+        self.latency = latency
+        self.reject = reject
+        self.connections = 0
+        self.messages = 0
+        self._loop = None
+        self._server = None
+        self._thread = None
+        self._writers = set()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def start(self):
+        started = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            self._server = self._loop.run_until_complete(
+                asyncio.start_server(self._handle, host=self.host, port=self.port, ssl=self.context)
+            )
+            self.port = self._server.sockets[0].getsockname()[1]
+            started.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+        started.wait()
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self._close(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+    async def _close(self):
+        # the open connections are dropped, like a server restart would
+        self._server.close()
+        for writer in list(self._writers):
+            writer.close()
+        await self._server.wait_closed()
+
+    async def _reply(self, writer, *lines):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        writer.write("".join(f"{line}\r\n" for line in lines).encode())
+        await writer.drain()
+
+    async def _handle(self, reader, writer):
+        self.connections += 1
+        self._writers.add(writer)
+        try:
+            await self._reply(writer, "220 sink ESMTP")
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+
+                command = line.decode().strip().split(" ", 1)[0].upper()
+                if command == "EHLO":
+                    await self._reply(writer, "250-sink", "250-AUTH PLAIN", "250 8BITMIME")
+                elif command == "AUTH":
+                    await self._reply(writer, "235 2.7.0 Authentication successful")
+                elif command == "DATA":
+                    await self._reply(writer, "354 End data with <CR><LF>.<CR><LF>")
+                    while await reader.readline() not in (b".\r\n", b""):
+                        pass
+                    self.messages += 1
+                    await self._reply(writer, "250 2.0.0 Ok: queued")
+                elif command == "RCPT":
+                    # RCPT TO:<address>
+                    reply = self.reject(line.decode().strip()[8:].strip("<>")) if self.reject else None
+                    await self._reply(writer, reply or "250 2.1.5 Ok")
+                elif command == "QUIT":
+                    await self._reply(writer, "221 2.0.0 Bye")
+                    break
+                else:
+                    await self._reply(writer, "250 2.0.0 Ok")
+        except (ConnectionError, ssl.SSLError):
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+
+def create_certificate(directory):
+    """ Creates a self-signed certificate for `localhost` and returns the paths of the certificate and key """
+    certfile = os.path.join(directory, "sink.crt")
+    keyfile = os.path.join(directory, "sink.key")
+    subprocess.run([
+        "openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1", "-subj", "/CN=localhost",
+        "-addext", "subjectAltName=DNS:localhost", "-keyout", keyfile, "-out", certfile
+    ], check=True, capture_output=True)
+    return certfile, keyfile
+
+
+def create_contexts():
+    """ Returns the server and client SSL contexts of a new self-signed certificate """
+    with tempfile.TemporaryDirectory() as directory:
+        certfile, keyfile = create_certificate(directory)
+        server_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        server_context.load_cert_chain(certfile=certfile, keyfile=keyfile)
+        client_context = ssl.create_default_context(cafile=certfile)
+    return server_context, client_context
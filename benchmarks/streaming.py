@@ -0,0 +1,102 @@
+"""
+Peak memory, time to first byte and total time of listing every user group as a JSON list (before)
+and as a stream of newline delimited JSON (after)
+
+Usage (from the repository root):
+
+    python -m benchmarks.streaming [rows] [url]
+
+Defaults to 200000 user groups in a SQLite file. Each mode is measured in its own process, so that the peak
+resident memory of one does not hide the other.
+"""
+import asyncio
+import json
+import resource
+import subprocess
+import sys
+import time
+
+from benchmarks.utils import bootstrap
+
+DEFAULT_URL = "sqlite:///benchmark_streaming.db"
+DEFAULT_ROWS = 200000
+BATCH_SIZE = 10000
+MODES = {"list": {}, "ndjson": {"stream": "ndjson"}}
+
+
+def populate(connection, rows):
+    from sqlalchemy import insert
+    from core.api.users.models import UserGroup
+
+    for start in range(0, rows, BATCH_SIZE):
+        connection.execute(insert(UserGroup.__table__), [
+            dict(name=f"group {i}", description=f"description of group {i}")
+            for i in range(start, min(start + BATCH_SIZE, rows))
+        ])
+
+
+async def run_benchmark(app, params):
+    from urllib.parse import urlencode
+    from core.api.oauth2.schemes import oauth2
+
+    await app.router.startup()
+    app.dependency_overrides[oauth2] = lambda: True
+
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http",
+        "path": "/core/api/users/groups", "raw_path": b"/core/api/users/groups", "root_path": "",
+        "query_string": urlencode(params).encode(), "headers": [], "client": ("127.0.0.1", 50000),
+        "server": ("testserver", 80)
+    }
+    measured = dict(first_byte=None, size=0)
+
+    async def receive():
+        await asyncio.sleep(3600)
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.body" and message.get("body"):
+            if measured["first_byte"] is None:
+                measured["first_byte"] = time.perf_counter()
+            # the body is not kept, like a socket would not keep it
+            measured["size"] += len(message["body"])
+
+    start = time.perf_counter()
+    await app(scope, receive, send)
+    end = time.perf_counter()
+
+    return dict(
+        first_byte=round((measured["first_byte"] - start) * 1000),
+        total=round((end - start) * 1000),
+        size=measured["size"],
+        max_rss=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024
+    )
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_ROWS
+    url = sys.argv[2] if len(sys.argv) > 2 else DEFAULT_URL
+
+    if len(sys.argv) > 3:
+        app = bootstrap({"core.database.url": url})
+        from core import venom
+        venom.database.run_sync(lambda connection: populate(connection, rows))
+        baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024
+
+        result = asyncio.run(run_benchmark(app, MODES[sys.argv[3]]))
+        result["baseline_rss"] = baseline
+        print(json.dumps(result))
+        return
+
+    for mode in MODES:
+        args = [sys.executable, "-m", __spec__.name, str(rows), url, mode]
+        output = subprocess.run(args, capture_output=True, check=True)
+        result = json.loads(output.stdout.decode().strip().splitlines()[-1])
+        print(
+            f"{mode:<8} first byte {result['first_byte']:>6} ms  total {result['total']:>6} ms  "
+            f"{result['size'] // 1024} KiB  peak rss +{result['max_rss'] - result['baseline_rss']} MiB"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Render latency of the email templates with the default templates environment (before) and the production
+settings of `core.templates.*` (after)
+
+Usage (from the repository root):
+
+    python -m benchmarks.templates
+
+"first render" is the latency of the first email rendered by a new process, including the startup precompilation
+when enabled, "render" the latency of the following emails (p50 in milliseconds).
+"""
+import asyncio
+import statistics
+import tempfile
+import time
+
+from core import venom
+from core.configurations import Configuration
+
+RENDERS = 2000
+PROCESSES = 50
+
+EMAILS = [
+    ("inquiry.html", dict(
+        product_name="Venom", user="John Doe", inquiry_type="Support", inquiry="Benchmark",
+        message="Benchmark message<br />" * 20
+    )),
+    ("reset_password.html", dict(
+        product_name="Venom", user="john.doe", token_expires_in=2, referrer="https://example.com/reset",
+        device="Other", operating_system="Linux", browser_name="Firefox", token="t" * 120,
+        support_address="support@example.com"
+    ))
+]
+
+
+def create_templates(**settings):
+    venom.cfg.cfg.update({f"core.templates.{k}": v for k, v in settings.items()})
+    return venom.create_templates(packages=venom.API_PACKAGES)
+
+
+async def render(templates):
+    """ Renders the email templates the way `send_email` does """
+    for name, payload_data in EMAILS:
+        template = templates.get_template(name=name)
+        if templates.is_async:
+            await template.render_async(**payload_data)
+        else:
+            template.render(**payload_data)
+
+
+async def measure_first_render(settings):
+    latencies = []
+    for _ in range(PROCESSES):
+        start = time.perf_counter()
+        await render(create_templates(**settings))
+        latencies.append((time.perf_counter() - start) * 1000)
+    return round(statistics.median(latencies), 2)
+
+
+async def measure_render(settings):
+    templates = create_templates(**settings)
+    await render(templates)
+
+    latencies = []
+    for _ in range(RENDERS):
+        start = time.perf_counter()
+        await render(templates)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return round(statistics.median(latencies), 3)
+
+
+def main():
+    venom.cfg = Configuration()
+
+    with tempfile.TemporaryDirectory() as bytecode_cache_folder_path:
+        default = dict(auto_reload=True, precompile=False, bytecode_cache_folder_path=None, enable_async=False)
+        production = dict(auto_reload=False, precompile=True, bytecode_cache_folder_path=bytecode_cache_folder_path)
+        modes = [
+            ("default", default),
+            ("production", dict(default, **production)),
+            ("production async", dict(default, **production, enable_async=True))
+        ]
+
+        for name, settings in modes:
+            first_render = asyncio.run(measure_first_render(settings))
+            latency = asyncio.run(measure_render(settings))
+            print(f"{name:<17} first render {first_render:>7} ms  render {latency:>6} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+Blacklisted token checks against a large blacklist: the unindexed full token column (before),
+the indexed token hash (after) and the in-memory filter that skips the query for tokens never blacklisted
+
+Usage (from the repository root):
+
+    python -m benchmarks.token_blacklist [rows] [url]
+
+Defaults to a million rows in a SQLite file. The rows are inserted once per run, so expect the setup to take a while.
+Only synchronous database urls are supported, since the queries are timed one at a time without an event loop.
+"""
+import asyncio
+import hashlib
+import sys
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import MetaData, Table, Column, Integer, Text, select, insert
+
+from benchmarks.utils import bootstrap
+from core import venom
+
+DEFAULT_URL = "sqlite:///benchmark_blacklist.db"
+DEFAULT_ROWS = 1000000
+BATCH_SIZE = 10000
+CHECKS = 200
+
+# the table as it was before tokens were hashed: the full token in an unindexed text column
+legacy_metadata = MetaData()
+legacy_table = Table(
+    "benchmark_legacy_blacklisted_tokens", legacy_metadata,
+    Column("id", Integer, primary_key=True),
+    Column("token", Text),
+    Column("user_id", Integer)
+)
+
+
+def get_token(i):
+    # about the size of an encoded access token
+    return f"eyJhbGciOiJIUzI1NiJ9.{i:0>64}.{'x' * 150}"
+
+
+def populate(connection, rows):
+    from core.api.users.models import User, UserBlacklistedToken
+
+    legacy_metadata.drop_all(connection)
+    legacy_metadata.create_all(connection)
+    connection.execute(insert(User.__table__).values(
+        id=1, username="benchmark", email="benchmark@example.com", password=""
+    ))
+
+    expires_at = datetime.utcnow() + timedelta(days=1)
+    for start in range(0, rows, BATCH_SIZE):
+        tokens = [get_token(i) for i in range(start, min(start + BATCH_SIZE, rows))]
+        connection.execute(insert(legacy_table), [dict(token=t, user_id=1) for t in tokens])
+        connection.execute(insert(UserBlacklistedToken.__table__), [
+            dict(token_hash=hashlib.sha256(t.encode()).hexdigest(), expires_at=expires_at, user_id=1)
+            for t in tokens
+        ])
+
+
+def timed(fn, count):
+    start = time.perf_counter()
+    for i in range(count):
+        fn(i)
+    return round((time.perf_counter() - start) * 1000 / count, 3)
+
+
+async def run_benchmark(rows):
+    # the models read the configuration on import, so they are imported once the globals are bootstrapped
+    from core.api.users.blacklist import TokenBlacklist
+    from core.api.users.models import UserBlacklistedToken
+
+    start = time.perf_counter()
+    venom.database.run_sync(lambda connection: populate(connection, rows))
+    print(f"{'setup':<26} {rows} rows in {round(time.perf_counter() - start, 1)} s")
+
+    session = venom.database.Session()
+    run = session.connection().execute
+
+    # tokens that were never blacklisted are the common case for the verify endpoint
+    unknown = [get_token(rows + i) for i in range(CHECKS)]
+
+    legacy = timed(lambda i: run(select(legacy_table.c.id).filter(legacy_table.c.token == unknown[i])).first(),
+                   count=min(CHECKS, 10))
+    indexed = timed(lambda i: run(select(UserBlacklistedToken.id).filter(
+        UserBlacklistedToken.token_hash == hashlib.sha256(unknown[i].encode()).hexdigest()
+    )).first(), count=CHECKS)
+
+    start = time.perf_counter()
+    blacklist = await TokenBlacklist(max_staleness=3600).load(session)
+    load = round((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    for token in unknown:
+        assert not await blacklist.contains(token_hash=hashlib.sha256(token.encode()).hexdigest(), db=session)
+    filtered = round((time.perf_counter() - start) * 1000 / CHECKS, 3)
+
+    session.close()
+    return {
+        "unindexed token": f"{legacy} ms per check",
+        "indexed token hash": f"{indexed} ms per check",
+        "filter": f"{filtered} ms per check",
+        "filter load": f"{load} ms, {blacklist.filter.size // 8 // 1024} KiB"
+    }
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_ROWS
+    url = sys.argv[2] if len(sys.argv) > 2 else DEFAULT_URL
+    bootstrap({"core.database.url": url})
+    if venom.database.is_async:
+        raise SystemExit(f"{url} is not a synchronous database url")
+
+    for name, result in asyncio.run(run_benchmark(rows)).items():
+        print(f"{name:<26} {result}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+import asyncio
+import statistics
+import time
+from urllib.parse import urlencode
+
+from core import venom
+from core.configurations import Configuration
+from core.database import Database
+from core.messages import Messages
+from core.models import Model
+
+
+def bootstrap(overrides=None):
+    """ Initializes the venom globals the way `venom.run` does and returns a new application
+
+    Benchmarks are executed from the repository root so that `configs.yml` and `messages.ini` are discovered.
+    Tables are created from the models metadata instead of the migrations so that any database url works.
+    """
+    venom.cfg = Configuration()
+    venom.cfg.cfg.update({"core.api.oauth2.secret_key": "benchmark"})
+    venom.cfg.cfg.update(overrides or {})
+    venom.server_mode = venom.cfg["core.server.mode"]
+    venom.messages = Messages()
+
+    venom.templates = venom.create_templates(packages=venom.API_PACKAGES)
+
+    venom.database = Database(
+        url=venom.cfg["core.database.url"],
+        pool_size=venom.cfg["core.database.pool_size"],
+        max_overflow=venom.cfg["core.database.max_overflow"],
+        slow_query_threshold=venom.cfg["core.database.slow_query_threshold"],
+        replicas=venom.cfg["core.database.replicas.urls"],
+        replicas_balancing=venom.cfg["core.database.replicas.balancing"],
+        replicas_retry_interval=venom.cfg["core.database.replicas.health_check_interval"]
+    )
+
+    app = venom.create_app(disable_logging=True)
+    venom.database.run_sync(Model.metadata.drop_all)
+    venom.database.run_sync(Model.metadata.create_all)
+    return app
+
+
+async def request(app, method, path, params=None, headers=None, body=b""):
+    """ Calls the ASGI application in-process and returns the response status code and body """
+    headers = dict(headers or {})
+    if body:
+        headers.setdefault("content-length", str(len(body)))
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": urlencode(params or {}).encode(),
+        "root_path": "",
+        "headers": [(k.lower().encode(), v.encode()) for k, v in headers.items()],
+        "client": ("127.0.0.1", 50000),
+        "server": ("testserver", 80)
+    }
+    response = dict(status=None, body=b"")
+    request_sent = False
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        await asyncio.sleep(3600)
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+        elif message["type"] == "http.response.body":
+            response["body"] += message.get("body", b"")
+
+    await app(scope, receive, send)
+    return response["status"], response["body"]
+
+
+async def measure(call, total, concurrency):
+    """ Awaits `call()` `total` times with at most `concurrency` calls in flight
+
+    :return: dict with the requests per second and the p50/p99 latencies in milliseconds
+    """
+    latencies = []
+    remaining = iter(range(total))
+
+    async def worker():
+        for _ in remaining:
+            start = time.perf_counter()
+            await call()
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return dict(
+        rps=round(total / elapsed, 1),
+        p50=round(statistics.median(latencies), 2),
+        p99=round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))], 2)
+    )
+
+
+def form(**fields):
+    """ Encodes the given fields as an urlencoded form body """
+    return urlencode(fields).encode()
+
+
+FORM_HEADERS = {"content-type": "application/x-www-form-urlencoded"}
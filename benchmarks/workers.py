@@ -0,0 +1,141 @@
+"""
+Requests per second of the server run with 1, 2 and 4 worker processes, and with one worker per CPU
+
+Usage (from the repository root):
+
+    python -m benchmarks.workers [seconds] [url]
+
+Starts `python -m core.server` for every worker count and loads it for `seconds` (defaults to 10) with 32
+keep-alive connections, all getting the same user with a bearer token, i.e. decoding the token, checking the
+blacklist and loading the user. The load is generated by this process, on the same machine, so it competes with
+the workers for the CPUs. Defaults to `postgresql+psycopg2://postgres@localhost/postgres`.
+"""
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import yaml
+
+from benchmarks.utils import bootstrap, request, form, FORM_HEADERS
+from core import venom
+
+DEFAULT_URL = "postgresql+psycopg2://postgres@localhost/postgres"
+DEFAULT_SECONDS = 10
+CONNECTIONS = 32
+CONFIG_FILENAME = "benchmark_workers.yml"
+HOST = "127.0.0.1"
+CREDENTIALS = form(username="benchmark", email="benchmark@example.com", password="benchmark")
+
+
+def get_free_port():
+    with socket.socket() as s:
+        s.bind((HOST, 0))
+        return s.getsockname()[1]
+
+
+async def call(reader, writer, method, path, headers=None, body=b""):
+    """ Sends an HTTP/1.1 request over a keep-alive connection and returns the status code and the body """
+    headers = dict(headers or {}, host=HOST, **{"content-length": str(len(body))})
+    head = "".join(f"{k}: {v}\r\n" for k, v in headers.items())
+    writer.write(f"{method} {path} HTTP/1.1\r\n{head}\r\n".encode() + body)
+
+    status_code = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line == b"\r\n":
+            break
+        name, _, value = line.decode().partition(":")
+        if name.lower() == "content-length":
+            length = int(value)
+    return status_code, await reader.readexactly(length)
+
+
+async def wait_for_server(port, timeout=60):
+    deadline = time.perf_counter() + timeout
+    while True:
+        try:
+            return await asyncio.open_connection(HOST, port)
+        except OSError:
+            if time.perf_counter() > deadline:
+                raise
+            await asyncio.sleep(0.1)
+
+
+async def create_user(app):
+    status_code, body = await request(app, "POST", "/core/api/users/", headers=FORM_HEADERS, body=CREDENTIALS)
+    assert status_code == 200, body
+    if venom.database.is_async:
+        await venom.database.engine.dispose()
+    return json.loads(body)["id"]
+
+
+async def load(port, user_id, seconds):
+    reader, writer = await wait_for_server(port)
+    status_code, body = await call(reader, writer, "POST", "/core/api/oauth2/token", FORM_HEADERS, CREDENTIALS)
+    assert status_code == 200, body
+    writer.close()
+    headers = {"authorization": f"Bearer {json.loads(body)['access_token']}"}
+
+    responses = []
+    deadline = time.perf_counter() + seconds
+
+    async def client():
+        reader, writer = await asyncio.open_connection(HOST, port)
+        while time.perf_counter() < deadline:
+            status_code, _ = await call(reader, writer, "GET", f"/core/api/users/{user_id}", headers)
+            responses.append(status_code)
+        writer.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*[client() for _ in range(CONNECTIONS)])
+    elapsed = time.perf_counter() - start
+
+    assert set(responses) == {200}, set(responses)
+    return round(len(responses) / elapsed, 1)
+
+
+def run_benchmark(url, user_id, workers, seconds, logs_folder_path):
+    port = get_free_port()
+    config_path = os.path.join("conf", CONFIG_FILENAME)
+    with open(config_path, "w") as f:
+        yaml.safe_dump({
+            "core.server.mode": "prod",
+            "core.server.host": HOST,
+            "core.server.port": port,
+            "core.server.workers": workers,
+            "core.database.url": url,
+            "core.logs.folder_path": logs_folder_path,
+            "core.api.oauth2.secret_key": "benchmark",
+            "core.api.emails.worker.in_process": False
+        }, f)
+
+    process = subprocess.Popen([sys.executable, "-m", "core.server", CONFIG_FILENAME], stdout=subprocess.DEVNULL)
+    try:
+        return asyncio.run(load(port, user_id, seconds))
+    finally:
+        process.terminate()
+        process.wait()
+        os.remove(config_path)
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_SECONDS
+    url = sys.argv[2] if len(sys.argv) > 2 else DEFAULT_URL
+    app = bootstrap({"core.database.url": url, "core.api.oauth2.secret_key": "benchmark"})
+    user_id = asyncio.run(create_user(app))
+    print(f"{os.cpu_count()} CPU(s)")
+
+    with tempfile.TemporaryDirectory() as logs_folder_path:
+        for workers in sorted({1, 2, 4, os.cpu_count() or 1}):
+            rate = run_benchmark(url, user_id, workers, seconds, logs_folder_path)
+            print(f"{workers} worker(s) {rate:>8} requests/s")
+
+
+if __name__ == "__main__":
+    main()
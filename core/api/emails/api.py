@@ -1,3 +1,56 @@
+import asyncio
+
 from fastapi import APIRouter
+from sqlalchemy import text
+
+from core import metrics
+from core.api.emails import pool
+from core.api.emails.models import Email
+from core.api.emails.worker import get_worker
+from core.caches import TTLCache
+from core.context_managers import session_scope
+from core.database import resolve
+from core.venom import cfg
 
 app = APIRouter(prefix="/core/api/emails", tags=["Emails"])
+
+delivery_worker_task = None
+
+
+# the pending emails counts of the metrics, so that frequent scrapes do not repeat the count
+emails_counts = TTLCache(max_size=1, ttl=cfg["core.metrics.sync_interval"])
+
+
+@metrics.REGISTRY.add_collector
+async def collect_emails_metrics(db):
+    """ The pending emails of the outbox by status, counted once for all the processes by the process exposing the
+    metrics. The delivered and not sent emails, the bulk of the table, are not counted
+    """
+    counts = emails_counts.get("pending")
+    if counts is None:
+        counts = await Email.count_by_status(db=db, statuses=[Email.SCHEDULED, Email.PROCESSING])
+        emails_counts.set("pending", counts)
+
+    gauge = metrics.Gauge("venom_emails", "Pending emails of the outbox by status", labels=["status"], registry=None)
+    for email_status, count in counts.items():
+        gauge.labels(email_status).set(count)
+    return [gauge]
+
+
+@app.on_event("startup")
+async def startup_event():
+    if cfg["core.api.emails.worker.in_process"]:
+        # the first connection of an asyncio engine must not be raced by the worker task, it blocks the event loop
+        async with session_scope() as db:
+            await resolve(db.execute(text("SELECT 1")))
+
+        global delivery_worker_task
+        delivery_worker_task = asyncio.create_task(get_worker().run())
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    if delivery_worker_task:
+        delivery_worker_task.cancel()
+
+    pool.shutdown()
@@ -0,0 +1,61 @@
+import logging
+import sys
+
+from sqlalchemy import select, bindparam, type_coerce, LargeBinary
+
+from core.api.emails.models import Email
+from core.types import is_compressed
+
+logger = logging.getLogger(__name__)
+
+
+def compress_payloads(batch_size=500):
+    """ Compresses the payloads stored uncompressed, in batches of emails committed one at a time
+
+    Payloads are read back whether they are compressed or not, so this runs alongside the application and may be
+    interrupted and run again. Returns the number of compressed payloads.
+
+    :param batch_size: The number of emails read and updated per transaction
+    """
+    from core import venom
+
+    table = Email.__table__
+    # the stored bytes, rather than the payloads decompressed by the column type
+    stored_payload = type_coerce(table.c.payload, LargeBinary).label("payload")
+    query = select(table.c.id, stored_payload).where(table.c.id > bindparam("last_id")).order_by(table.c.id)\
+        .limit(batch_size)
+    statement = table.update().where(table.c.id == bindparam("email_id")).values(payload=bindparam("payload"))
+
+    def compress_batch(connection, last_id):
+        rows = connection.execute(query, dict(last_id=last_id)).all()
+        values = [
+            dict(email_id=row.id, payload=bytes(row.payload))
+            for row in rows if row.payload is not None and not is_compressed(bytes(row.payload))
+        ]
+        if values:
+            # the column type compresses the bound payloads
+            connection.execute(statement, values)
+        return rows[-1].id if rows else None, len(values)
+
+    last_id, compressed = 0, 0
+    while last_id is not None:
+        last_id, count = venom.database.run_sync(lambda connection: compress_batch(connection, last_id))
+        compressed += count
+        if count:
+            logger.info(f"Compressed {compressed} email payloads, up to email {last_id}")
+
+    return compressed
+
+
+def main():
+    """ Compresses the stored email payloads, with the configuration file and batch size as optional arguments """
+    from core import venom
+
+    venom.initialize(filename=sys.argv[1] if len(sys.argv) > 1 else None)
+    compressed = compress_payloads(batch_size=int(sys.argv[2]) if len(sys.argv) > 2 else 500)
+    logger.info(f"Compressed {compressed} email payloads, the freed space is reused by the database for new rows "
+                f"and returned to the file system by a full vacuum of `venom_emails`")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,22 @@
-from sqlalchemy import Column, String, Text, Enum, Integer, DateTime, LargeBinary
+from datetime import datetime, timedelta
 
+from sqlalchemy import Column, String, Text, Enum, Integer, DateTime, Index, select, func
+from sqlalchemy.orm import Session, deferred, undefer
+
+from core.database import resolve
 from core.models import Model
+from core.types import CompressedBinary
+
+
+def get_payload_compression():
+    from core import venom
+
+    return venom.cfg["core.api.emails.payload_compression"]
 
 
 class Email(Model):
     __tablename__ = "venom_emails"
+    __table_args__ = (Index("i_venom_emails_status_next_attempt_on", "status", "next_attempt_on"),)
 
     SCHEDULED = "Scheduled"
     PROCESSING = "Processing"
@@ -16,7 +28,8 @@ class Email(Model):
     recipients_cc = Column(Text)
     recipients_bcc = Column(Text)
     subject = Column(String(128))
-    payload = Column(LargeBinary)
+    # compressed, and only loaded by the delivery worker, status updates and listings never read it
+    payload = deferred(Column(CompressedBinary(compression=get_payload_compression)))
     payload_type = Column(String(50))
     status = Column(
         Enum(SCHEDULED, PROCESSING, DELIVERED, NOT_SENT, name="venom_emails_status"), server_default=SCHEDULED
@@ -24,6 +37,58 @@ class Email(Model):
     smtp_code = Column(Integer)
     smtp_error = Column(Text)
     date = Column(DateTime)
+    # delivery attempts so far, and when the email is due for the next one
+    attempts = Column(Integer, nullable=False, default=0, server_default="0")
+    next_attempt_on = Column(DateTime, default=datetime.utcnow)
 
     def __init__(self, **kwargs):
         super(Email, self).__init__(**kwargs)
+
+    @property
+    def recipients_addrs(self):
+        addrs = [self.recipients, self.recipients_cc, self.recipients_bcc]
+        return [addr for value in addrs if value for addr in value.split("; ") if addr]
+
+    @classmethod
+    async def claim(cls, db: Session, limit: int, lease: int):
+        """ Claims the emails due for delivery, the earliest due first
+
+        The claimed emails are locked until the session commits, and are skipped by the concurrent claims of other
+        workers meanwhile. Once committed they are in the `Processing` status for `lease` seconds, after which they
+        are due again in case their worker never records the outcome of the delivery.
+
+        :param db: The session to claim with, committed by the caller to release the locks
+        :param limit: The maximum number of emails to claim
+        :param lease: The number of seconds the emails are reserved to the claiming worker
+        """
+        now = datetime.utcnow()
+        query = select(cls)\
+            .options(undefer(cls.payload))\
+            .filter(cls.status.in_([cls.SCHEDULED, cls.PROCESSING]))\
+            .filter(cls.next_attempt_on <= now)\
+            .order_by(cls.next_attempt_on)\
+            .limit(limit)\
+            .with_for_update(skip_locked=True)
+        emails = (await resolve(db.execute(query))).scalars().all()
+
+        for email in emails:
+            email.status = cls.PROCESSING
+            email.attempts += 1
+            email.next_attempt_on = now + timedelta(seconds=lease)
+
+        await resolve(db.flush())
+        return emails
+
+    @classmethod
+    async def count_by_status(cls, db: Session, statuses=None):
+        """ Returns the number of emails of every status, statuses without emails included
+
+        :param db: Current database session object
+        :param statuses: The statuses to count, every status when None. The emails of the given statuses only are
+                         counted over the status index, e.g. the pending emails rather than the whole outbox
+        """
+        statuses = statuses if statuses else [cls.SCHEDULED, cls.PROCESSING, cls.DELIVERED, cls.NOT_SENT]
+        counts = dict.fromkeys(statuses, 0)
+        query = select(cls.status, func.count()).filter(cls.status.in_(statuses)).group_by(cls.status)
+        counts.update((await resolve(db.execute(query))).all())
+        return counts
@@ -0,0 +1,249 @@
+import logging
+import socket
+import ssl
+import threading
+import time
+from collections import deque
+from smtplib import SMTP, SMTP_SSL, SMTPException, SMTPServerDisconnected, SMTPResponseException, \
+    SMTPRecipientsRefused
+
+logger = logging.getLogger(__name__)
+
+SECURITY_MODES = ("ssl", "starttls", "none")
+
+
+class SMTPPoolTimeoutException(Exception):
+
+    def __init__(self, detail):
+        self.detail = detail
+        super(SMTPPoolTimeoutException, self).__init__(self.detail)
+
+
+class SMTPConnectionPool(object):
+
+    def __init__(
+            self,
+            host,
+            port=None,
+            user=None,
+            password=None,
+            security="ssl",
+            size=4,
+            idle_timeout=60,
+            health_check_interval=10,
+            timeout=30,
+            context=None
+    ):
+        """ Construct a new :class: `SMTPConnectionPool`
+
+        Keeps up to `size` connections to the SMTP server open and logged in, so that consecutive emails reuse
+        the same TLS session instead of opening, greeting and authenticating a connection each. Connections are
+        reused most recently returned first, which lets the least used ones expire when the load drops.
+
+        :param host: The SMTP server host
+        :param port: The SMTP server port, defaults to the port of the security mode
+        :param user: The user to login with, no login when None
+        :param password: The password to login with
+        :param security: Either "ssl" for implicit TLS, "starttls" to upgrade a plain connection or "none"
+        :param size: The maximum number of open connections. With 0 a connection is opened per email
+        :param idle_timeout: The number of seconds an idle connection is kept open
+        :param health_check_interval: The number of seconds after which an idle connection is checked with NOOP
+                                      before it is reused
+        :param timeout: The socket timeout, and the number of seconds to wait for a free connection,
+                        unlimited when None
+        :param context: The SSL context of the TLS connections, defaults to the system trusted certificates
+        """
+        if security not in SECURITY_MODES:
+            raise ValueError(f"SMTP security must be one of {', '.join(SECURITY_MODES)}, not `{security}`")
+
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.security = security
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        self.timeout = timeout
+        self.context = context if context else ssl.create_default_context()
+        # connections open, either borrowed or idle
+        self.opened = 0
+        # idle connections with the time they were returned, the most recently returned last
+        self._idle = deque()
+        self._condition = threading.Condition()
+
+    def sendmail(self, from_addr, to_addrs, msg, timeout=None):
+        """ Sends the message over a pooled connection and returns the refused recipients, like `SMTP.sendmail`
+
+        A reused connection the server has dropped since it was returned is discarded and the message is sent
+        over another one, while errors of a newly opened connection are raised.
+
+        :param timeout: The socket timeout of the send, after which the send fails with `socket.timeout`,
+                        defaults to the timeout of the pool
+        :raises SMTPPoolTimeoutException: When no connection is returned to the pool in time
+        """
+        while True:
+            server, reused = self._acquire()
+            if timeout is not None:
+                server.sock.settimeout(timeout)
+            try:
+                refused = server.sendmail(from_addr=from_addr, to_addrs=to_addrs, msg=msg)
+            except SMTPServerDisconnected as e:
+                self._release(server, healthy=False)
+                # timed out, rather than dropped by the server while idle, the message may have been accepted
+                if isinstance(e.__context__, socket.timeout):
+                    raise socket.timeout("The SMTP server did not reply in time") from e
+                if reused:
+                    continue
+                raise
+            except (SMTPResponseException, SMTPRecipientsRefused):
+                # the message was refused, the connection is still usable once its transaction is reset
+                self._release(server, healthy=self._reset(server))
+                raise
+            except BaseException:
+                self._release(server, healthy=False)
+                raise
+
+            self._release(server, healthy=True)
+            return refused
+
+    def close(self):
+        """ Closes the idle connections, borrowed connections are closed as they are returned """
+        with self._condition:
+            idle = [server for server, _ in self._idle]
+            self._idle.clear()
+
+        for server in idle:
+            self._discard(server)
+
+    def _acquire(self):
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+
+        while True:
+            server = None
+            with self._condition:
+                while self.size and not self._idle and self.opened >= self.size:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        raise SMTPPoolTimeoutException(
+                            f"No SMTP connection was returned to the pool within {self.timeout} seconds"
+                        )
+                    self._condition.wait(remaining)
+
+                if self._idle:
+                    server, returned_on = self._idle.pop()
+                else:
+                    self.opened += 1
+
+            if server is None:
+                try:
+                    return self._connect(), False
+                except BaseException:
+                    self._discard(None)
+                    raise
+
+            idle = time.monotonic() - returned_on
+            if idle < self.idle_timeout and (idle < self.health_check_interval or self._is_healthy(server)):
+                return server, True
+
+            self._discard(server)
+
+    def _release(self, server, healthy):
+        if not healthy or not self.size:
+            self._discard(server)
+            return
+
+        # the timeout of a send is not kept for the next one
+        server.sock.settimeout(self.timeout)
+
+        now = time.monotonic()
+        expired = []
+        with self._condition:
+            self._idle.append((server, now))
+            # the least recently returned connections are the first to expire
+            while self._idle and now - self._idle[0][1] >= self.idle_timeout:
+                expired.append(self._idle.popleft()[0])
+            self._condition.notify()
+
+        for server in expired:
+            self._discard(server)
+
+    def _discard(self, server):
+        if server is not None:
+            try:
+                server.quit()
+            except (SMTPException, OSError):
+                server.close()
+
+        with self._condition:
+            self.opened -= 1
+            self._condition.notify()
+
+    def _connect(self):
+        timeout = {} if self.timeout is None else dict(timeout=self.timeout)
+        if self.security == "ssl":
+            server = SMTP_SSL(host=self.host, port=self.port, context=self.context, **timeout)
+        else:
+            server = SMTP(host=self.host, port=self.port, **timeout)
+
+        try:
+            server.ehlo()
+            if self.security == "starttls":
+                server.starttls(context=self.context)
+                server.ehlo()
+
+            if self.user:
+                server.login(user=self.user, password=self.password)
+        except BaseException:
+            server.close()
+            raise
+
+        logger.debug(f"Opened SMTP connection to {self.host}")
+        return server
+
+    @staticmethod
+    def _is_healthy(server):
+        try:
+            return server.noop()[0] == 250
+        except (SMTPException, OSError):
+            return False
+
+    @staticmethod
+    def _reset(server):
+        try:
+            return server.rset()[0] == 250
+        except (SMTPException, OSError):
+            return False
+
+
+pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """ Returns the SMTP connection pool of the current process, created on first use """
+    global pool
+    with _pool_lock:
+        if pool is None:
+            from core.venom import cfg
+
+            pool = SMTPConnectionPool(
+                host=cfg["core.api.emails.smtp_host"],
+                port=cfg["core.api.emails.smtp_port"],
+                user=cfg["core.api.emails.user"],
+                password=cfg["core.api.emails.password"],
+                security=cfg["core.api.emails.smtp_security"],
+                size=cfg["core.api.emails.pool.size"],
+                idle_timeout=cfg["core.api.emails.pool.idle_timeout"],
+                health_check_interval=cfg["core.api.emails.pool.health_check_interval"],
+                timeout=cfg["core.api.emails.pool.timeout"]
+            )
+        return pool
+
+
+def shutdown():
+    global pool
+    with _pool_lock:
+        if pool is not None:
+            pool.close()
+            pool = None
@@ -1,16 +1,14 @@
 import logging
-import ssl
 from datetime import datetime
 
-from fastapi import status
-
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
-from smtplib import SMTP_SSL, SMTPAuthenticationError, SMTPResponseException, SMTPHeloError, SMTPRecipientsRefused, \
-    SMTPSenderRefused
+from sqlalchemy.orm import Session
 
 from core.api.emails.models import Email
+from core.api.emails.pool import get_pool
 from core.context_managers import session_scope
+from core.database import resolve
 from core.venom import cfg, templates
 
 logger = logging.getLogger(__name__)
@@ -23,8 +21,14 @@ async def send_email(
         recipients_cc=None,
         recipients_bcc=None,
         payload_data=None,
-        payload_type="html"
+        payload_type="html",
+        db: Session = None
 ):
+    """ Renders the email and schedules it for delivery by the email delivery worker
+
+    With `db` the email is added to that session, so that it is only scheduled if the changes it is sent for
+    are committed too, otherwise it is committed on a session of its own.
+    """
     recipients_cc = recipients_cc if recipients_cc else list()
     recipients_bcc = recipients_bcc if recipients_bcc else list()
     payload_data = payload_data if payload_data else dict()
@@ -32,12 +36,8 @@ async def send_email(
 
     # configuration parameters
     from_mask = cfg["core.api.emails.from_mask"]
-    smtp_host = cfg["core.api.emails.smtp_host"]
-    smtp_port = cfg["core.api.emails.smtp_port"]
     from_addr = cfg["core.api.emails.user"]
-    password = cfg["core.api.emails.password"]
 
-    recipients_addrs = recipients + recipients_cc + recipients_bcc
     to_addrs = "; ".join(recipients)
     cc_addrs = "; ".join(recipients_cc)
     bcc_addrs = "; ".join(recipients_bcc)
@@ -52,51 +52,49 @@ async def send_email(
 
     # render templates
     template = templates.get_template(name=template)
-    rendered_template = template.render(**payload_data)
+    if templates.is_async:
+        rendered_template = await template.render_async(**payload_data)
+    else:
+        rendered_template = template.render(**payload_data)
     multipart.attach(MIMEText(rendered_template, payload_type))
 
-    # print email on mock smtp host
-    if smtp_host is None or smtp_host.strip() == "mock":
-        print(multipart.as_string())
-        return
-
-    try:
-        # create email entity
-        with session_scope() as session:
-            email = Email(
-                sender=from_addr,
-                recipients=to_addrs,
-                recipients_cc=cc_addrs,
-                recipients_bcc=bcc_addrs,
-                subject=subject,
-                payload=multipart.as_bytes(),
-                payload_type=payload_type,
-                status=Email.PROCESSING
-            )
+    email = Email(
+        sender=from_addr,
+        recipients=to_addrs,
+        recipients_cc=cc_addrs,
+        recipients_bcc=bcc_addrs,
+        subject=subject,
+        payload=multipart.as_bytes(),
+        payload_type=payload_type,
+        status=Email.SCHEDULED,
+        next_attempt_on=datetime.utcnow()
+    )
+
+    if db is not None:
+        db.add(email)
+        await resolve(db.flush())
+    else:
+        async with session_scope() as session:
             session.add(email)
 
-        # create ssl context and send email
-        context = ssl.create_default_context()
-        with SMTP_SSL(host=smtp_host, port=smtp_port, context=context) as server:
-            server.ehlo()
-            server.login(user=from_addr, password=password)
-            server.sendmail(from_addr=from_addr, to_addrs=recipients_addrs, msg=multipart.as_string())
-
-        email.status = Email.DELIVERED
-    except (SMTPAuthenticationError, SMTPResponseException, SMTPHeloError, SMTPRecipientsRefused, SMTPSenderRefused) as e:
-        logger.exception(e)
-        email.smtp_code = e.smtp_code
-        email.smtp_error = str(e.smtp_error)
-        email.status = Email.NOT_SENT
-    except Exception as e:
-        email.smtp_code = status.HTTP_500_INTERNAL_SERVER_ERROR
-        email.smtp_error = str(e)
-        email.status = Email.NOT_SENT
-    finally:
-        email.date = datetime.utcnow()
-
-    # update email entity
-    with session_scope() as session:
-        session.add(email)
-
     return email
+
+
+def deliver_email(email: Email, timeout=None):
+    """ Sends a scheduled email over a pooled SMTP connection and returns its refused recipients
+
+    Blocks the calling thread until the SMTP server accepts the email. On the mock SMTP host the email is printed.
+
+    :param timeout: The socket timeout of the send, defaults to `core.api.emails.pool.timeout`
+    """
+    smtp_host = cfg["core.api.emails.smtp_host"]
+
+    # print email on mock smtp host
+    if smtp_host is None or smtp_host.strip() == "mock":
+        print(email.payload.decode())
+        return dict()
+
+    # send email over a pooled, already authenticated connection
+    return get_pool().sendmail(
+        from_addr=email.sender, to_addrs=email.recipients_addrs, msg=email.payload, timeout=timeout
+    )
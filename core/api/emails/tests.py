@@ -0,0 +1,331 @@
+import asyncio
+import socket
+from datetime import datetime, timedelta
+from smtplib import SMTPServerDisconnected, SMTPResponseException, SMTPRecipientsRefused, SMTPAuthenticationError
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from core.api.emails.models import Email
+from core.api.emails.pool import SMTPConnectionPool, SMTPPoolTimeoutException
+from core.api.emails.worker import EmailDeliveryWorker, EmailDeliveryTimeoutException
+
+
+class FakeSocket(object):
+
+    def __init__(self):
+        self.timeout = None
+
+    def settimeout(self, timeout):
+        self.timeout = timeout
+
+
+class FakeSMTP(object):
+    """ SMTP connection recording the messages sent over it, raising the given errors on the first sends """
+
+    def __init__(self, errors=None):
+        self.sock = FakeSocket()
+        self.errors = list(errors or [])
+        self.sent = []
+        # the socket timeout of every send
+        self.timeouts = []
+        self.healthy = True
+        self.closed = False
+
+    def sendmail(self, from_addr, to_addrs, msg):
+        self.timeouts.append(self.sock.timeout)
+        if self.errors:
+            raise self.errors.pop(0)
+        self.sent.append(msg)
+        return dict()
+
+    def noop(self):
+        return (250 if self.healthy else 421), b""
+
+    def rset(self):
+        return 250, b""
+
+    def quit(self):
+        self.closed = True
+
+    def close(self):
+        self.closed = True
+
+
+def create_pool(errors=None, **kwargs):
+    """ Returns a pool of fake connections, the connections it opened in `pool.connections` """
+    pool = SMTPConnectionPool(host="smtp.example.com", **kwargs)
+    pool.connections = []
+    # the errors of every connection in order, e.g. [[error], []] for a first connection failing once
+    connections_errors = list(errors or [])
+
+    def connect():
+        server = FakeSMTP(errors=connections_errors.pop(0) if connections_errors else None)
+        pool.connections.append(server)
+        return server
+
+    pool._connect = connect
+    return pool
+
+
+def create_timed_out_error():
+    """ Returns the error of `SMTP.sendmail` when the socket times out, the timeout as its context """
+    try:
+        raise socket.timeout("timed out")
+    except socket.timeout:
+        try:
+            raise SMTPServerDisconnected("Connection unexpectedly closed: timed out")
+        except SMTPServerDisconnected as e:
+            return e
+
+
+def age_idle_connections(pool, seconds):
+    pool._idle = type(pool._idle)((server, returned_on - seconds) for server, returned_on in pool._idle)
+
+
+def test_pool_reuses_connection():
+    pool = create_pool(size=2)
+    for index in range(3):
+        pool.sendmail("from@example.com", ["to@example.com"], f"message {index}")
+
+    assert len(pool.connections) == 1
+    assert pool.connections[0].sent == ["message 0", "message 1", "message 2"]
+    assert pool.opened == 1
+
+
+def test_pool_without_size_connects_per_message():
+    pool = create_pool(size=0)
+    for index in range(2):
+        pool.sendmail("from@example.com", ["to@example.com"], f"message {index}")
+
+    assert len(pool.connections) == 2
+    assert all(server.closed for server in pool.connections)
+    assert pool.opened == 0
+
+
+def test_pool_expires_idle_connections():
+    pool = create_pool(size=2, idle_timeout=60)
+    pool.sendmail("from@example.com", ["to@example.com"], "message 0")
+    age_idle_connections(pool, seconds=60)
+    pool.sendmail("from@example.com", ["to@example.com"], "message 1")
+
+    assert len(pool.connections) == 2
+    assert pool.connections[0].closed
+    assert pool.opened == 1
+
+
+def test_pool_checks_idle_connections_health():
+    pool = create_pool(size=2, idle_timeout=60, health_check_interval=10)
+    pool.sendmail("from@example.com", ["to@example.com"], "message 0")
+
+    age_idle_connections(pool, seconds=10)
+    pool.sendmail("from@example.com", ["to@example.com"], "message 1")
+    assert len(pool.connections) == 1
+
+    pool.connections[0].healthy = False
+    age_idle_connections(pool, seconds=10)
+    pool.sendmail("from@example.com", ["to@example.com"], "message 2")
+    assert len(pool.connections) == 2
+    assert pool.connections[1].sent == ["message 2"]
+
+
+def test_pool_resends_over_new_connection_when_reused_one_was_dropped():
+    pool = create_pool(size=2)
+    pool.sendmail("from@example.com", ["to@example.com"], "message 0")
+    pool.connections[0].errors.append(SMTPServerDisconnected("Connection unexpectedly closed"))
+    pool.sendmail("from@example.com", ["to@example.com"], "message 1")
+
+    assert pool.connections[0].closed
+    assert pool.connections[1].sent == ["message 1"]
+    assert pool.opened == 1
+
+
+def test_pool_raises_errors_of_new_connection():
+    pool = create_pool(size=2, errors=[[SMTPServerDisconnected("Connection unexpectedly closed")]])
+
+    with pytest.raises(SMTPServerDisconnected):
+        pool.sendmail("from@example.com", ["to@example.com"], "message")
+    assert len(pool.connections) == 1
+    assert pool.opened == 0
+
+
+def test_pool_keeps_connection_of_refused_message():
+    pool = create_pool(size=2, errors=[[SMTPResponseException(550, b"Mailbox unavailable")]])
+
+    with pytest.raises(SMTPResponseException):
+        pool.sendmail("from@example.com", ["to@example.com"], "message 0")
+    pool.sendmail("from@example.com", ["to@example.com"], "message 1")
+
+    assert len(pool.connections) == 1
+    assert pool.connections[0].sent == ["message 1"]
+
+
+def test_pool_waits_for_connection_within_timeout():
+    pool = create_pool(size=1, timeout=0.1)
+    server, _ = pool._acquire()
+
+    with pytest.raises(SMTPPoolTimeoutException):
+        pool._acquire()
+
+    pool._release(server, healthy=True)
+    assert pool._acquire() == (server, True)
+
+
+@pytest.fixture
+def session():
+    engine = create_engine("sqlite://")
+    Email.__table__.create(bind=engine)
+    with Session(bind=engine) as session:
+        yield session
+
+
+def schedule(session, subject, status=Email.SCHEDULED, due_in=-60, attempts=0):
+    email = Email(
+        sender="from@example.com",
+        recipients="to@example.com",
+        subject=subject,
+        payload=b"message",
+        status=status,
+        attempts=attempts,
+        next_attempt_on=datetime.utcnow() + timedelta(seconds=due_in)
+    )
+    session.add(email)
+    session.commit()
+    return email
+
+
+def test_claim_due_emails_earliest_first(session):
+    schedule(session, "later", due_in=-10)
+    schedule(session, "earliest", due_in=-30)
+    schedule(session, "not due", due_in=60)
+    schedule(session, "delivered", status=Email.DELIVERED)
+    schedule(session, "earlier", due_in=-20)
+
+    emails = asyncio.run(Email.claim(db=session, limit=2, lease=300))
+
+    assert [email.subject for email in emails] == ["earliest", "earlier"]
+    assert all(email.status == Email.PROCESSING and email.attempts == 1 for email in emails)
+    assert all(email.next_attempt_on > datetime.utcnow() + timedelta(seconds=290) for email in emails)
+    assert emails[0].payload == b"message"
+
+
+def test_claim_emails_of_expired_lease(session):
+    schedule(session, "leased", status=Email.PROCESSING, due_in=60, attempts=1)
+    schedule(session, "lease expired", status=Email.PROCESSING, due_in=-1, attempts=1)
+
+    emails = asyncio.run(Email.claim(db=session, limit=10, lease=300))
+
+    assert [(email.subject, email.attempts) for email in emails] == [("lease expired", 2)]
+
+
+@pytest.fixture
+def worker():
+    return EmailDeliveryWorker(max_attempts=3, retry_backoff=30, max_retry_backoff=100)
+
+
+def claimed(attempts):
+    return Email(id=1, status=Email.PROCESSING, attempts=attempts)
+
+
+@pytest.mark.parametrize("attempts, delay", [(1, 30), (2, 60)])
+def test_failure_is_retried_with_backoff(worker, attempts, delay):
+    email = claimed(attempts=attempts)
+    worker.on_failure(email=email, e=ConnectionRefusedError("Connection refused"))
+
+    assert email.status == Email.SCHEDULED
+    assert email.smtp_code == 500
+    assert email.smtp_error == "Connection refused"
+    assert abs((email.next_attempt_on - datetime.utcnow()) - timedelta(seconds=delay)) < timedelta(seconds=5)
+
+
+def test_failure_backoff_is_capped():
+    worker = EmailDeliveryWorker(max_attempts=10, retry_backoff=30, max_retry_backoff=100)
+    email = claimed(attempts=4)
+    worker.on_failure(email=email, e=OSError())
+
+    assert email.smtp_error == "OSError"
+    assert abs((email.next_attempt_on - datetime.utcnow()) - timedelta(seconds=100)) < timedelta(seconds=5)
+
+
+def test_failure_after_max_attempts_is_not_sent(worker):
+    email = claimed(attempts=3)
+    worker.on_failure(email=email, e=OSError("Connection reset"))
+
+    assert email.status == Email.NOT_SENT
+    assert email.date is not None
+
+
+@pytest.mark.parametrize("e, status, smtp_code", [
+    (SMTPResponseException(550, b"Mailbox unavailable"), Email.NOT_SENT, 550),
+    (SMTPRecipientsRefused({"to@example.com": (550, b"No such user")}), Email.NOT_SENT, 550),
+    (SMTPResponseException(451, b"Try again later"), Email.SCHEDULED, 451),
+    (SMTPRecipientsRefused({"to@example.com": (450, b"Mailbox busy")}), Email.SCHEDULED, 450),
+    (SMTPAuthenticationError(535, b"Authentication failed"), Email.SCHEDULED, 535)
+])
+def test_permanent_and_transient_failures(worker, e, status, smtp_code):
+    email = claimed(attempts=1)
+    worker.on_failure(email=email, e=e)
+
+    assert (email.status, email.smtp_code) == (status, smtp_code)
+
+
+def test_refused_recipients_error(worker):
+    email = claimed(attempts=1)
+    worker.on_failure(email=email, e=SMTPRecipientsRefused({"to@example.com": (550, b"No such user")}))
+
+    assert email.smtp_error == "to@example.com: 550 No such user"
+
+
+def test_delivery_with_refused_recipients(worker):
+    email = claimed(attempts=1)
+    worker.on_delivery(email=email, refused={"cc@example.com": (550, b"No such user")})
+
+    assert email.status == Email.DELIVERED
+    assert email.smtp_code == 550
+    assert email.smtp_error == "cc@example.com: 550 No such user"
+
+
+def test_pool_applies_send_timeout():
+    pool = create_pool(size=2, timeout=30)
+    server, _ = pool._acquire()
+    pool._release(server, healthy=True)
+
+    pool.sendmail("from@example.com", ["to@example.com"], "message 0", timeout=5)
+    pool.sendmail("from@example.com", ["to@example.com"], "message 1")
+
+    assert server.timeouts == [5, 30]
+    assert server.sock.timeout == 30
+
+
+def test_pool_does_not_resend_timed_out_message():
+    pool = create_pool(size=2)
+    pool.sendmail("from@example.com", ["to@example.com"], "message 0")
+    pool.connections[0].errors.append(create_timed_out_error())
+
+    # the server may have accepted the message before the timeout
+    with pytest.raises(socket.timeout):
+        pool.sendmail("from@example.com", ["to@example.com"], "message 1", timeout=5)
+    assert len(pool.connections) == 1
+    assert pool.connections[0].closed
+    assert pool.opened == 0
+
+
+def test_worker_send_timeout():
+    worker = EmailDeliveryWorker(send_timeout=5)
+    timeouts = []
+
+    def deliver_email(email, timeout):
+        timeouts.append(timeout)
+        raise socket.timeout("The SMTP server did not reply in time")
+
+    async def send():
+        return await worker.send(loop=asyncio.get_running_loop(), email=claimed(attempts=1))
+
+    worker.deliver_email = deliver_email
+    try:
+        with pytest.raises(EmailDeliveryTimeoutException):
+            asyncio.run(send())
+    finally:
+        worker.executor.shutdown()
+    assert timeouts == [5]
@@ -0,0 +1,206 @@
+import asyncio
+import logging
+import socket
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from smtplib import SMTPResponseException, SMTPRecipientsRefused, SMTPAuthenticationError
+
+from core.api.emails.models import Email
+from core.context_managers import session_scope
+
+logger = logging.getLogger(__name__)
+
+
+class EmailDeliveryTimeoutException(Exception):
+
+    def __init__(self, detail):
+        self.detail = detail
+        super(EmailDeliveryTimeoutException, self).__init__(self.detail)
+
+
+class EmailDeliveryWorker(object):
+
+    def __init__(
+            self,
+            batch_size=50,
+            concurrency=4,
+            poll_interval=1,
+            max_attempts=5,
+            retry_backoff=30,
+            max_retry_backoff=3600,
+            lease=300,
+            send_timeout=60
+    ):
+        """ Construct a new :class: `EmailDeliveryWorker`
+
+        Delivers the scheduled emails of `venom_emails` in batches claimed with `SELECT ... FOR UPDATE SKIP LOCKED`,
+        so that any number of workers, in the application processes or in `python -m core.api.emails.worker`
+        processes, deliver distinct emails. The blocking SMTP sessions run on threads of the worker, so a slow SMTP
+        server never stalls the event loop, nor the default executor of the loop shared with e.g. DNS lookups.
+        Failed deliveries are scheduled again with an exponential backoff, unless the SMTP server refused the email
+        permanently.
+
+        :param batch_size: The maximum number of emails claimed at once
+        :param concurrency: The maximum number of emails being sent at once
+        :param poll_interval: The number of seconds to wait for new emails once none is due
+        :param max_attempts: The number of delivery attempts after which an email is not sent
+        :param retry_backoff: The number of seconds before the first retry, doubled for every following retry
+        :param max_retry_backoff: The maximum number of seconds between two retries
+        :param lease: The number of seconds a claimed email is reserved to the worker, after which it is due again
+        :param send_timeout: The socket timeout of the SMTP sessions, after which the thread gives up on the email and
+                             the delivery is retried. Each read or write of a send waits up to `send_timeout`
+                             seconds, so that the lease must be several times longer
+        """
+        # imported on construction, since the smtp module binds the configuration globals on import
+        from core.api.emails.smtp import deliver_email
+
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.max_retry_backoff = max_retry_backoff
+        self.lease = lease
+        self.send_timeout = send_timeout
+        self.deliver_email = deliver_email
+        # one thread per concurrent delivery, each held until its send returns, so that sends never queue for a thread
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="venom-smtp")
+
+    async def run(self):
+        """ Delivers the due emails until cancelled """
+        try:
+            while True:
+                try:
+                    delivered = await self.deliver_due()
+                except Exception as e:
+                    logger.exception(e)
+                    delivered = 0
+
+                # due emails are delivered back to back, otherwise new ones are polled for
+                if not delivered:
+                    await asyncio.sleep(self.poll_interval)
+        finally:
+            # a send still running finishes on its own, bounded by the socket timeout
+            self.executor.shutdown(wait=False)
+
+    async def deliver_due(self):
+        """ Claims a batch of due emails, delivers them and records the outcomes, returns the number of emails """
+        async with session_scope() as db:
+            emails = await Email.claim(db=db, limit=self.batch_size, lease=self.lease)
+
+        if not emails:
+            return 0
+
+        loop = asyncio.get_running_loop()
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def deliver(email):
+            async with semaphore:
+                try:
+                    refused = await self.send(loop=loop, email=email)
+                except Exception as e:
+                    self.on_failure(email=email, e=e)
+                else:
+                    self.on_delivery(email=email, refused=refused)
+
+        await asyncio.gather(*[deliver(email) for email in emails])
+
+        async with session_scope() as db:
+            for email in emails:
+                db.add(email)
+
+        return len(emails)
+
+    async def send(self, loop, email: Email):
+        """ Sends the email on a thread of the worker and returns its refused recipients
+
+        The send is bounded by the socket timeout rather than abandoned by the event loop, since an abandoned send
+        may still be accepted by the SMTP server after the email is scheduled again. Until the thread returns the
+        email stays in the `Processing` status under its lease.
+
+        :raises EmailDeliveryTimeoutException: When the SMTP server does not reply within `send_timeout` seconds
+        """
+        try:
+            return await loop.run_in_executor(self.executor, self.deliver_email, email, self.send_timeout)
+        except socket.timeout:
+            raise EmailDeliveryTimeoutException(
+                f"The SMTP server did not reply within {self.send_timeout} seconds"
+            )
+
+    def on_delivery(self, email: Email, refused: dict):
+        email.status = Email.DELIVERED
+        email.date = datetime.utcnow()
+        email.smtp_code = None
+        email.smtp_error = None
+
+        # accepted for some of the recipients only
+        if refused:
+            email.smtp_code = max(code for code, _ in refused.values())
+            email.smtp_error = get_refused_error(refused)
+
+    def on_failure(self, email: Email, e: Exception):
+        if isinstance(e, SMTPRecipientsRefused):
+            email.smtp_code = max(code for code, _ in e.recipients.values())
+            email.smtp_error = get_refused_error(e.recipients)
+        elif isinstance(e, SMTPResponseException):
+            email.smtp_code = e.smtp_code
+            email.smtp_error = e.smtp_error.decode(errors="replace") if isinstance(e.smtp_error, bytes) \
+                else str(e.smtp_error)
+        else:
+            email.smtp_code = 500
+            email.smtp_error = str(e) or type(e).__name__
+
+        # a 5xx reply refuses the email for good, except for credentials which may be fixed before the next retry
+        permanent = isinstance(e, (SMTPRecipientsRefused, SMTPResponseException)) \
+            and not isinstance(e, SMTPAuthenticationError) and email.smtp_code >= 500
+
+        now = datetime.utcnow()
+        if permanent or email.attempts >= self.max_attempts:
+            logger.warning(f"Email {email.id} not sent after {email.attempts} attempt(s): {email.smtp_error}")
+            email.status = Email.NOT_SENT
+            email.date = now
+        else:
+            delay = min(self.retry_backoff * 2 ** (email.attempts - 1), self.max_retry_backoff)
+            logger.info(f"Email {email.id} delivery attempt {email.attempts} failed, retrying in {delay} seconds")
+            email.status = Email.SCHEDULED
+            email.next_attempt_on = now + timedelta(seconds=delay)
+
+
+def get_refused_error(refused):
+    return "; ".join(f"{addr}: {code} {error.decode(errors='replace')}" for addr, (code, error) in refused.items())
+
+
+def get_worker():
+    """ Returns an email delivery worker configured by `core.api.emails.worker.*` """
+    from core import venom
+
+    return EmailDeliveryWorker(
+        batch_size=venom.cfg["core.api.emails.worker.batch_size"],
+        concurrency=venom.cfg["core.api.emails.worker.concurrency"],
+        poll_interval=venom.cfg["core.api.emails.worker.poll_interval"],
+        max_attempts=venom.cfg["core.api.emails.worker.max_attempts"],
+        retry_backoff=venom.cfg["core.api.emails.worker.retry_backoff"],
+        max_retry_backoff=venom.cfg["core.api.emails.worker.max_retry_backoff"],
+        lease=venom.cfg["core.api.emails.worker.lease"],
+        send_timeout=venom.cfg["core.api.emails.worker.send_timeout"]
+    )
+
+
+def main():
+    """ Runs an email delivery worker process, with the configuration file given as the first argument """
+    from core import venom
+    from core.api.emails import pool
+
+    venom.initialize(filename=sys.argv[1] if len(sys.argv) > 1 else None)
+    logger.info("Delivering scheduled emails...")
+    try:
+        asyncio.run(get_worker().run())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        pool.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,4 @@
-from fastapi import APIRouter, BackgroundTasks, Depends
+from fastapi import APIRouter, Depends
 from sqlalchemy.orm import Session
 
 from core.api.emails.smtp import send_email
@@ -11,15 +11,10 @@ app = APIRouter(prefix="/core/api/inquiries", tags=["Inquiries"])
 
 
 @app.post("/", response_model=InquirySchema)
-async def api_create_inquiry(
-        background_tasks: BackgroundTasks,
-        schema: InquirySchema = Depends(),
-        db: Session = Depends(get_db)
-):
+async def api_create_inquiry(schema: InquirySchema = Depends(), db: Session = Depends(get_db)):
     """
          Creates system inquiry
          - **schema**: inquiry schema for inquiry creation
-         - **background_tasks**: send inquiry email in a background task
          - **db**: current database session object
     """
     inquiry = await Inquiry.create(
@@ -39,8 +34,8 @@ async def api_create_inquiry(
     if schema.send_copy_email:
         to_addrs.append(schema.email)
 
-    background_tasks.add_task(
-        func=send_email,
+    # scheduled along with the inquiry, for the email delivery worker
+    await send_email(
         recipients=to_addrs,
         template="inquiry.html",
         subject=inquiry_subject,
@@ -49,7 +44,8 @@ async def api_create_inquiry(
             inquiry_type=schema.inquiry_type,
             inquiry=schema.subject,
             message=schema.message.replace("\n", "<br />")
-        )
+        ),
+        db=db
     )
 
     return inquiry
@@ -2,6 +2,7 @@
 from sqlalchemy import Column, String, Text, Boolean
 from sqlalchemy.orm import Session
 
+from core.database import resolve
 from core.models import Model
 
 
@@ -39,5 +40,5 @@ class Inquiry(Model):
         )
 
         db.add(inquiry)
-        db.flush()
+        await resolve(db.flush())
         return inquiry
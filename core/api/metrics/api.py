@@ -0,0 +1,54 @@
+import asyncio
+import hmac
+import logging
+
+from fastapi import APIRouter, Depends, HTTPException, status, Request, Response
+from sqlalchemy.orm import Session
+
+from core import metrics
+from core.database import get_db
+from core.venom import cfg
+
+logger = logging.getLogger(__name__)
+app = APIRouter(tags=["Metrics"])
+
+write_snapshots_task = None
+
+
+@app.on_event("startup")
+async def startup_event():
+    if cfg["core.metrics.enabled"] and not cfg["core.metrics.token"] and cfg["core.server.mode"] != "dev":
+        logger.warning(f"Metrics endpoint {cfg['core.metrics.path']} not served, core.metrics.token is not set")
+
+    folder_path = metrics.get_folder_path()
+    if cfg["core.metrics.enabled"] and folder_path:
+        global write_snapshots_task
+        write_snapshots_task = asyncio.create_task(
+            metrics.write_snapshots_periodically(folder_path=folder_path, interval=cfg["core.metrics.sync_interval"])
+        )
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    if write_snapshots_task:
+        write_snapshots_task.cancel()
+        # the counters of a stopped worker are still part of the merged metrics
+        metrics.write_snapshot(metrics.get_folder_path())
+
+
+@app.get(cfg["core.metrics.path"], include_in_schema=False)
+async def api_get_metrics(request: Request, db: Session = Depends(get_db)):
+    """
+        Returns the metrics of the application in the Prometheus text format, merged over the worker processes
+        - **db**: current database session object
+    """
+    token = cfg["core.metrics.token"]
+    # served without a token in the dev mode only
+    if not cfg["core.metrics.enabled"] or (not token and cfg["core.server.mode"] != "dev"):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+
+    if token and not hmac.compare_digest(request.headers.get("authorization", ""), f"Bearer {token}"):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, headers={"WWW-Authenticate": "Bearer"})
+
+    content = await metrics.generate(db=db, folder_path=metrics.get_folder_path())
+    return Response(content=content, media_type=metrics.CONTENT_TYPE)
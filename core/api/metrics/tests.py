@@ -0,0 +1,65 @@
+import os
+
+from core import metrics
+from core.metrics import Counter, Gauge, Histogram, merge, render
+
+
+def get_unused_pid():
+    pid = 4194304
+    while metrics.is_running(pid):
+        pid -= 1
+    return pid
+
+
+def collect(requests, in_flight, durations):
+    counter = Counter("requests_total", "Requests", labels=["route"], registry=None)
+    gauge = Gauge("in_flight", "Requests in flight", registry=None)
+    histogram = Histogram("duration_seconds", "Duration", buckets=(0.1, 1.0), registry=None)
+
+    for route, count in requests.items():
+        counter.labels(route).inc(count)
+    gauge.set(in_flight)
+    for duration in durations:
+        histogram.observe(duration)
+    return {metric.name: metric.collect() for metric in (counter, gauge, histogram)}
+
+
+def get_samples(metric):
+    return {tuple(values): value for values, value in metric["samples"]}
+
+
+def test_merge_sums_counters_and_histograms_of_every_process():
+    merged = merge({
+        os.getpid(): collect(requests={"/a": 2, "/b": 1}, in_flight=1, durations=[0.05, 0.5]),
+        get_unused_pid(): collect(requests={"/a": 3}, in_flight=4, durations=[5.0])
+    })
+
+    assert get_samples(merged["requests_total"]) == {("/a",): 5, ("/b",): 1}
+    assert get_samples(merged["duration_seconds"]) == {(): [[1, 1, 1], 5.55]}
+
+
+def test_merge_sums_gauges_of_running_processes_only():
+    merged = merge({
+        os.getpid(): collect(requests={}, in_flight=1, durations=[]),
+        get_unused_pid(): collect(requests={}, in_flight=4, durations=[])
+    })
+
+    assert get_samples(merged["in_flight"]) == {(): 1}
+
+
+def test_merge_without_running_processes():
+    merged = merge({get_unused_pid(): collect(requests={"/a": 1}, in_flight=2, durations=[])})
+
+    assert "in_flight" not in merged
+    assert get_samples(merged["requests_total"]) == {("/a",): 1}
+
+
+def test_render():
+    lines = render(merge({os.getpid(): collect(requests={"/a": 2}, in_flight=0, durations=[0.05, 0.5])})).splitlines()
+
+    assert "requests_total{route=\"/a\"} 2" in lines
+    assert "in_flight 0" in lines
+    assert "duration_seconds_bucket{le=\"0.1\"} 1" in lines
+    assert "duration_seconds_bucket{le=\"1\"} 2" in lines
+    assert "duration_seconds_bucket{le=\"+Inf\"} 2" in lines
+    assert "duration_seconds_count 2" in lines
@@ -0,0 +1,84 @@
+"""Hash users blacklisted tokens
+
+Revision ID: 006
+Revises: 005
+Create Date: 2026-10-17 10:12:31.402117
+
+"""
+import hashlib
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+from jose import jwt, JWTError
+
+
+# revision identifiers, used by Alembic.
+revision = '006'
+down_revision = '005'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 1000
+
+
+def upgrade():
+    op.add_column("venom_users_blacklisted_tokens", sa.Column("token_hash", sa.String(64)))
+    op.add_column("venom_users_blacklisted_tokens", sa.Column("expires_at", sa.DateTime))
+
+    # backfill the token digests and expiration dates of the existing rows
+    connection = op.get_bind()
+    rows = connection.execute(sa.text("SELECT id, token FROM venom_users_blacklisted_tokens")).fetchall()
+    params = []
+    for row_id, token in rows:
+        try:
+            exp = jwt.get_unverified_claims(token).get("exp")
+        except JWTError:
+            exp = None
+
+        params.append(dict(
+            id=row_id,
+            token_hash=hashlib.sha256(token.encode()).hexdigest(),
+            expires_at=datetime.utcfromtimestamp(exp) if exp is not None else None
+        ))
+
+    update = sa.text(
+        "UPDATE venom_users_blacklisted_tokens SET token_hash = :token_hash, expires_at = :expires_at WHERE id = :id"
+    )
+    for i in range(0, len(params), BATCH_SIZE):
+        connection.execute(update, params[i:i + BATCH_SIZE])
+
+    # the same token may have been blacklisted more than once
+    connection.execute(sa.text(
+        "DELETE FROM venom_users_blacklisted_tokens WHERE id NOT IN ("
+        "SELECT MIN(id) FROM venom_users_blacklisted_tokens GROUP BY token_hash)"
+    ))
+
+    # batch mode recreates the table on sqlite, which cannot alter columns
+    with op.batch_alter_table("venom_users_blacklisted_tokens") as batch_op:
+        batch_op.alter_column("token_hash", existing_type=sa.String(64), nullable=False)
+        batch_op.drop_column("token")
+
+    op.create_index(
+        index_name="i_venom_users_blacklisted_tokens_token_hash",
+        table_name="venom_users_blacklisted_tokens",
+        columns=["token_hash"],
+        unique=True
+    )
+    op.create_index(
+        index_name="i_venom_users_blacklisted_tokens_expires_at",
+        table_name="venom_users_blacklisted_tokens",
+        columns=["expires_at"]
+    )
+
+
+def downgrade():
+    op.drop_index("i_venom_users_blacklisted_tokens_expires_at", table_name="venom_users_blacklisted_tokens")
+    op.drop_index("i_venom_users_blacklisted_tokens_token_hash", table_name="venom_users_blacklisted_tokens")
+
+    # the original tokens cannot be restored from their digests
+    op.execute("DELETE FROM venom_users_blacklisted_tokens")
+    with op.batch_alter_table("venom_users_blacklisted_tokens") as batch_op:
+        batch_op.add_column(sa.Column("token", sa.String(256), nullable=False))
+        batch_op.drop_column("expires_at")
+        batch_op.drop_column("token_hash")
@@ -0,0 +1,58 @@
+"""Add trigram filter indexes
+
+Revision ID: 007
+Revises: 006
+Create Date: 2026-10-17 13:05:48.118204
+
+"""
+import logging
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '007'
+down_revision = '006'
+branch_labels = None
+depends_on = None
+
+logger = logging.getLogger(__name__)
+
+# columns matched by the `contains` filter operator, which is compiled to ILIKE '%...%'
+INDEXES = [
+    ("i_venom_users_username_trgm", "venom_users", "username"),
+    ("i_venom_users_email_trgm", "venom_users", "email"),
+    ("i_venom_user_groups_name_trgm", "venom_user_groups", "name"),
+    ("i_venom_roles_name_trgm", "venom_roles", "name")
+]
+
+
+def upgrade():
+    # only postgresql can serve substring matches from an index
+    connection = op.get_bind()
+    if connection.dialect.name != "postgresql":
+        return
+
+    query = sa.text("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+    if connection.execute(query).first() is None:
+        logger.warning("Extension pg_trgm is not available, `contains` filters will not be served by an index")
+        return
+
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    for index_name, table_name, column_name in INDEXES:
+        op.create_index(
+            index_name=index_name,
+            table_name=table_name,
+            columns=[column_name],
+            postgresql_using="gin",
+            postgresql_ops={column_name: "gin_trgm_ops"}
+        )
+
+
+def downgrade():
+    if op.get_bind().dialect.name != "postgresql":
+        return
+
+    for index_name, table_name, column_name in INDEXES:
+        op.execute(f"DROP INDEX IF EXISTS {index_name}")
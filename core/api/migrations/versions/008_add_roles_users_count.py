@@ -0,0 +1,31 @@
+"""Add roles users count
+
+Revision ID: 008
+Revises: 007
+Create Date: 2026-10-17 15:21:07.583914
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '008'
+down_revision = '007'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("venom_roles", sa.Column("users_count", sa.Integer, nullable=False, server_default="0"))
+
+    # backfill the counts of the existing user roles
+    op.execute(
+        "UPDATE venom_roles SET users_count = "
+        "(SELECT COUNT(*) FROM venom_users_roles WHERE venom_users_roles.role_id = venom_roles.id)"
+    )
+
+
+def downgrade():
+    with op.batch_alter_table("venom_roles") as batch_op:
+        batch_op.drop_column("users_count")
@@ -0,0 +1,41 @@
+"""Add emails delivery attempts
+
+Revision ID: 009
+Revises: 008
+Create Date: 2026-10-17 17:42:19.205361
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '009'
+down_revision = '008'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("venom_emails", sa.Column("attempts", sa.Integer, nullable=False, server_default="0"))
+    op.add_column("venom_emails", sa.Column("next_attempt_on", sa.DateTime))
+
+    # emails left scheduled or in process are due right away
+    op.execute(
+        "UPDATE venom_emails SET next_attempt_on = COALESCE(created_on, CURRENT_TIMESTAMP) "
+        "WHERE status IN ('Scheduled', 'Processing')"
+    )
+
+    op.create_index(
+        index_name="i_venom_emails_status_next_attempt_on",
+        table_name="venom_emails",
+        columns=["status", "next_attempt_on"]
+    )
+
+
+def downgrade():
+    op.drop_index("i_venom_emails_status_next_attempt_on", table_name="venom_emails")
+
+    with op.batch_alter_table("venom_emails") as batch_op:
+        batch_op.drop_column("next_attempt_on")
+        batch_op.drop_column("attempts")
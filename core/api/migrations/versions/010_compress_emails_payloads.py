@@ -0,0 +1,51 @@
+"""Compress emails payloads
+
+Revision ID: 010
+Revises: 009
+Create Date: 2026-10-17 19:02:44.218305
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from core.types import decompress, is_compressed
+
+
+# revision identifiers, used by Alembic.
+revision = '010'
+down_revision = '009'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 500
+
+
+def upgrade():
+    # payloads are compressed by the application from now on, and the stored ones by
+    # `python -m core.api.emails.compress_payloads`, run separately since the table is large.
+    # PostgreSQL no longer tries to compress them a second time
+    if op.get_bind().dialect.name == "postgresql":
+        op.execute("ALTER TABLE venom_emails ALTER COLUMN payload SET STORAGE EXTERNAL")
+
+
+def downgrade():
+    if op.get_bind().dialect.name == "postgresql":
+        op.execute("ALTER TABLE venom_emails ALTER COLUMN payload SET STORAGE EXTENDED")
+
+    # the previous revisions read the payloads as stored
+    connection = op.get_bind()
+    select = sa.text("SELECT id, payload FROM venom_emails WHERE id > :last_id ORDER BY id LIMIT :limit")
+    update = sa.text("UPDATE venom_emails SET payload = :payload WHERE id = :id")
+    last_id = 0
+    while True:
+        rows = connection.execute(select, dict(last_id=last_id, limit=BATCH_SIZE)).fetchall()
+        if not rows:
+            break
+
+        params = [
+            dict(id=row_id, payload=decompress(bytes(payload)))
+            for row_id, payload in rows if payload is not None and is_compressed(bytes(payload))
+        ]
+        if params:
+            connection.execute(update, params)
+        last_id = rows[-1][0]
@@ -20,7 +20,7 @@ async def api_get_access_token(auth: OAuth2PasswordRequestForm = Depends(), db:
     """
     user = await User.get_by_username(username=auth.username, db=db)
 
-    if not user or not user.verify_password(password=auth.password):
+    if not user or not await user.verify_password(password=auth.password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail=messages["core.api.oauth2.authentication_failed"],
@@ -15,13 +15,15 @@ async def oauth2(security_scopes: SecurityScopes, token: str = Depends(oauth2_sc
     payload = decode_token(token=token)
     username: str = payload.get("sub")
 
-    user = db.query(User).outerjoin(User._roles).filter(User.username == username).first()
+    principal = await User.get_principal(username=username, db=db)
 
-    if not user or (Role.SUPER_ADMIN not in user.roles and not set(user.roles).issubset(security_scopes.scopes)):
+    if not principal or (
+            Role.SUPER_ADMIN not in principal.roles and not set(principal.roles).issubset(security_scopes.scopes)
+    ):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Unauthorized request",
             headers={"WWW-Authenticate": "Bearer"}
         )
 
-    return user
+    return principal
@@ -1,13 +1,23 @@
+import hashlib
 from datetime import datetime, timedelta
 
 from fastapi import HTTPException, status
 from jose import jwt, JWTError
 
+from core.caches import TTLCache
 from core.venom import cfg
 
 SECRET_KEY = cfg["core.api.oauth2.secret_key"]
 ALGORITHM = cfg["core.api.oauth2.algorithm"]
 
+# verified token payloads keyed by token digest, kept until the token expires or for at most the ttl since the access
+# tokens are never revoked, the blacklisted reset password tokens being checked before their payload is decoded
+token_cache = TTLCache(
+    max_size=cfg["core.api.oauth2.token_cache.max_size"],
+    ttl=cfg["core.api.oauth2.token_cache.ttl"],
+    name="tokens"
+)
+
 
 def create_access_token(data: dict, expires_in_minutes: int):
     to_encode = data.copy()
@@ -21,12 +31,33 @@ def create_access_token(data: dict, expires_in_minutes: int):
 
 
 def decode_token(token: str):
+    digest = get_token_digest(token=token)
+    payload = token_cache.get(digest)
+    if payload is not None:
+        return payload
+
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        return payload
     except (Exception, JWTError):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Unauthorized request",
             headers={"WWW-Authenticate": "Bearer"},
         )
+
+    token_cache.set(digest, payload, expires_at=payload.get("exp"))
+    return payload
+
+
+def get_token_digest(token: str):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def get_token_expiration(token: str):
+    """ Returns the `exp` claim of the token as an utc datetime without verifying it, None if unavailable """
+    try:
+        exp = jwt.get_unverified_claims(token).get("exp")
+    except JWTError:
+        return None
+
+    return datetime.utcfromtimestamp(exp) if exp is not None else None
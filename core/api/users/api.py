@@ -1,28 +1,34 @@
+import asyncio
 import logging
 from time import sleep
 
-from fastapi import APIRouter, Depends, HTTPException, status, BackgroundTasks, Request, Form, Security
-from sqlalchemy import asc
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, status, Request, Response, Form, Security
+from pydantic import ValidationError
+from sqlalchemy.orm import Session, Query
 from user_agents import parse
 
 from core.api.authorization.roles import Role as R
 from core.api.emails.smtp import send_email
 from core.api.oauth2.schemes import oauth2
-from core.api.oauth2.security import create_access_token, decode_token
+from core.api.oauth2.security import create_access_token, decode_token, get_token_digest
+from core.api.users import passwords
+from core.api.users.blacklist import blacklist, prune_periodically
 from core.api.users.exceptions import UserUsernameAlreadyInUseException, UserEmailAlreadyInUseException, \
     UserNotFoundException, UserOldPasswordCannotBeVerifiedException, UserPasswordsCannotBeConfirmedException, \
-    UserGroupAlreadyInUseException, UserGroupNotFoundException
+    UserGroupAlreadyInUseException, UserGroupNotFoundException, UsersImportInvalidException, \
+    UsersImportTooLargeException
+from core.api.users.imports import read_import_rows
 from core.api.users.models import User, UserBlacklistedToken, Role, UserRole, UserGroup
 from core.api.users.schemas import UserSchema, UserCreateSchema, UserResetPasswordSchema, UserUpdateSchema, RoleSchema, \
-    RolesSchema, UserGroupsSchema, UserGroupSchema
+    RolesSchema, UserGroupsSchema, UserGroupSchema, UserImportSchema, UserImportReportSchema
 from core.context_managers import session_scope
-from core.database import get_db
+from core.database import get_db, run_sync, resolve
 from core.models import QueryExecutor
 from core.venom import cfg, messages
 
 logger = logging.getLogger(__name__)
 app = APIRouter(prefix="/core/api/users", tags=["Users"])
+prune_blacklisted_tokens_task = None
 
 
 @app.post("/", response_model=UserSchema)
@@ -52,10 +58,52 @@ async def api_create_user(schema: UserCreateSchema = Depends(), db: Session = De
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=e.detail)
 
 
+@app.post("/import", response_model=UserImportReportSchema, dependencies=[Security(oauth2, scopes=R.SUPER_ADMIN)])
+async def api_import_users(request: Request, db: Session = Depends(get_db)):
+    """
+         Creates system users in bulk and assigns them to the USER role
+         - **request**: a JSON array of users, or a CSV file with a header row of the user fields
+           (`username`, `email`, `password`, `first_name`, `last_name`) as the body or the `file` form field
+         - **db**: current database session object
+    """
+    try:
+        rows = await read_import_rows(request=request)
+
+        max_rows = cfg["core.api.users.bulk_import.max_rows"]
+        if len(rows) > max_rows:
+            raise UsersImportTooLargeException(max_rows=max_rows)
+    except (UsersImportInvalidException, UsersImportTooLargeException) as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=e.detail)
+
+    results = []
+    users = []
+    for row_number, row in enumerate(rows, start=1):
+        if not isinstance(row, dict):
+            results.append(dict(row=row_number, detail=messages["core.api.users.users_import_invalid_row"]))
+            continue
+
+        result = dict(row=row_number, username=row.get("username"))
+        results.append(result)
+        try:
+            users.append((result, UserImportSchema(**row).dict()))
+        except ValidationError as e:
+            result["detail"] = "; ".join(f"{'.'.join(map(str, error['loc']))}: {error['msg']}" for error in e.errors())
+
+    role = await Role.get_by_name(name=R.USER, db=db)
+    created = await User.create_many(users=[user for _, user in users], role=role, db=db)
+    for (result, _), user_id in zip(users, created):
+        if isinstance(user_id, Exception):
+            result["detail"] = user_id.detail
+        else:
+            result["id"] = user_id
+
+    created_count = sum(1 for result in results if result.get("id") is not None)
+    return dict(created=created_count, failed=len(results) - created_count, results=results)
+
+
 @app.post("/resetpassword/token")
 async def api_get_reset_password_token(
         request: Request,
-        background_tasks: BackgroundTasks,
         schema: UserResetPasswordSchema = Depends(),
         db: Session = Depends(get_db)
 ):
@@ -81,8 +129,7 @@ async def api_get_reset_password_token(
     user_agent = parse(user_agent_string=ua_string)
     referrer = request.headers.get("referer").split("?")[0]
 
-    background_tasks.add_task(
-        func=send_email,
+    await send_email(
         recipients=[support_address],
         template="reset_password.html",
         subject=subject,
@@ -95,7 +142,8 @@ async def api_get_reset_password_token(
             browser_name=user_agent.get_browser(),
             token=token,
             support_address=support_address
-        )
+        ),
+        db=db
     )
     return dict()
 
@@ -109,8 +157,7 @@ async def api_verify_reset_password_token(token: str = Form(...), db: Session =
     """
     try:
         # check if token is not blacklisted
-        blacklisted_token = db.query(UserBlacklistedToken).filter(UserBlacklistedToken.token == token).first()
-        if blacklisted_token:
+        if await blacklist.contains(token_hash=get_token_digest(token=token), db=db):
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST)
 
         payload = decode_token(token=token)
@@ -145,21 +192,23 @@ async def api_get_users_roles(db: Session = Depends(get_db)):
         Gets users roles
         - **db**: current database session object
     """
-    roles = db.query(Role).outerjoin(Role._users).order_by(asc(Role.id)).all()
-
-    for role in roles:
-        role.users_count = len(role.users)
-
-    return roles
+    return await Role.get_all_with_users_count(db=db)
 
 
 @app.get("/groups", response_model=UserGroupsSchema, dependencies=[Security(oauth2, scopes=R.SUPER_ADMIN)])
-async def api_get_users_groups(request: Request, db: Session = Depends(get_db)):
+async def api_get_users_groups(request: Request, response: Response, db: Session = Depends(get_db)):
     """
         Gets users groups
         - **db**: current database session object
     """
-    user_groups = QueryExecutor(request=request, query=db.query(UserGroup)).all()
+    if request.query_params.get("stream"):
+        return QueryExecutor(request=request, query=Query(UserGroup)).stream(db=db, schema=UserGroupSchema)
+
+    user_groups = await run_sync(db, lambda session: QueryExecutor(
+        request=request,
+        query=session.query(UserGroup),
+        response=response
+    ).all())
     return user_groups
 
 
@@ -223,9 +272,10 @@ async def api_delete_user_group(group_id: int, db: Session = Depends(get_db)):
         - **db**: current database session object
     """
     try:
-        user_group = await UserGroup.get_by_id(id=group_id, db=db)
-        db.delete(user_group)
-        db.flush()
+        # the memberships are loaded up front for the delete cascade
+        user_group = await UserGroup.get_by_id(id=group_id, db=db, profile="members")
+        await resolve(db.delete(user_group))
+        await resolve(db.flush())
 
         return user_group
     except UserGroupNotFoundException as e:
@@ -322,8 +372,7 @@ async def api_reset_user_password(
         await user.update_password(new_pwd=new_password, confirm_pwd=confirm_password)
 
         # blacklist token
-        blacklisted_token = UserBlacklistedToken(user_id=user.id, token=token)
-        db.add(blacklisted_token)
+        await UserBlacklistedToken.create(user_id=user.id, token=token, db=db)
 
         return user
     except UserNotFoundException as e:
@@ -334,7 +383,7 @@ async def api_reset_user_password(
 
 @app.on_event("startup")
 async def startup_event():
-    with session_scope() as db:
+    async with session_scope() as db:
         logger.info(f"Setting up built-in {R.SUPER_ADMIN} role...")
         await Role.create(name=R.SUPER_ADMIN, description="Super Administrator of application ecosystem", db=db)
 
@@ -345,3 +394,22 @@ async def startup_event():
         await Role.create(name=R.USER, description="User of application ecosystem", db=db)
 
     logger.info("Built-in roles added!")
+
+    if cfg["core.api.users.roles_users_count"] == "counter":
+        async with session_scope() as db:
+            await Role.count_users(db=db)
+
+    async with session_scope() as db:
+        await blacklist.load(db)
+
+    global prune_blacklisted_tokens_task
+    interval = cfg["core.api.users.blacklisted_tokens.prune_interval"]
+    prune_blacklisted_tokens_task = asyncio.create_task(prune_periodically(interval=interval))
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await passwords.shutdown()
+
+    if prune_blacklisted_tokens_task:
+        prune_blacklisted_tokens_task.cancel()
@@ -0,0 +1,164 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, delete, or_, event
+from sqlalchemy.orm import Session
+
+from core.api.users.models import UserBlacklistedToken
+from core.bloom import BloomFilter
+from core.context_managers import session_scope
+from core.database import resolve
+from core.venom import cfg
+
+logger = logging.getLogger(__name__)
+
+# rows are synced with this overlap, since they become visible in commit order rather than creation order
+SYNC_OVERLAP = timedelta(seconds=60)
+
+
+class TokenBlacklist(object):
+
+    def __init__(self, error_rate=0.01, max_staleness=5):
+        """ Construct a new :class: `TokenBlacklist`
+
+        In-memory membership filter in front of the blacklisted tokens table, so that tokens which were never
+        blacklisted are rejected from the check without a query. Until :meth: `load` is called every check queries.
+
+        The filter only rejects a token while it is fresh, i.e. synced within `max_staleness` seconds, since a token
+        blacklisted by another process since the last sync is missing from it. A stale or full filter is synced, or
+        rebuilt, by a background task, and the checks query the table meanwhile.
+
+        :param error_rate: The false positive probability of the filter, each false positive costs a query
+        :param max_staleness: The number of seconds after a sync during which the filter rejects the tokens on its
+                              own, with 0 every check queries
+        """
+        self.error_rate = error_rate
+        self.max_staleness = max_staleness
+        self.filter = None
+        self.synced_on = None
+        self.synced_at = 0
+        # the tokens blacklisted by this process while the filter is built, added to the built filter
+        self.pending = None
+        self.refresh_task = None
+
+    async def load(self, db: Session):
+        """ Builds the filter from all the not expired blacklisted tokens """
+        synced_on = datetime.utcnow()
+        synced_at = time.monotonic()
+        self.pending = []
+        try:
+            query = select(UserBlacklistedToken.token_hash).filter(
+                or_(UserBlacklistedToken.expires_at.is_(None), UserBlacklistedToken.expires_at > synced_on)
+            )
+            token_hashes = (await resolve(db.execute(query))).scalars().all()
+
+            # built on a thread, the event loop serving the requests meanwhile
+            loop = asyncio.get_running_loop()
+            bloom_filter = await loop.run_in_executor(None, self.build, token_hashes)
+            for token_hash in self.pending:
+                bloom_filter.add(token_hash)
+        finally:
+            self.pending = None
+
+        self.filter = bloom_filter
+        self.synced_on = synced_on
+        self.synced_at = synced_at
+        logger.info(f"Loaded {len(token_hashes)} blacklisted tokens into the blacklist filter")
+        return self
+
+    def build(self, token_hashes):
+        bloom_filter = BloomFilter(capacity=max(len(token_hashes) * 2, 1024), error_rate=self.error_rate)
+        for token_hash in token_hashes:
+            bloom_filter.add(token_hash)
+        return bloom_filter
+
+    async def sync(self, db: Session):
+        """ Adds the tokens blacklisted since the last sync, e.g. by other processes, to the filter """
+        synced_on = datetime.utcnow()
+        synced_at = time.monotonic()
+        query = select(UserBlacklistedToken.token_hash)\
+            .filter(UserBlacklistedToken.created_on >= self.synced_on - SYNC_OVERLAP)
+        for token_hash in (await resolve(db.execute(query))).scalars():
+            self.add(token_hash=token_hash)
+
+        self.synced_on = synced_on
+        self.synced_at = synced_at
+
+    def refresh(self, rebuild=False):
+        """ Syncs the filter, or rebuilds it, in a background task unless a refresh is already running
+
+        :param rebuild: Whether the filter is rebuilt from all the blacklisted tokens rather than synced
+        """
+        if self.refresh_task is None or self.refresh_task.done():
+            self.refresh_task = asyncio.create_task(self.run_refresh(rebuild=rebuild))
+        return self.refresh_task
+
+    async def run_refresh(self, rebuild):
+        try:
+            async with session_scope() as db:
+                if rebuild:
+                    await self.load(db)
+                else:
+                    await self.sync(db)
+        except Exception as e:
+            logger.exception(e)
+
+    async def rebuild(self):
+        """ Rebuilds the filter, once the refresh in progress, if any, is done """
+        while self.refresh_task is not None and not self.refresh_task.done():
+            await self.refresh_task
+        await self.refresh(rebuild=True)
+
+    def is_stale(self):
+        return time.monotonic() - self.synced_at >= self.max_staleness
+
+    async def contains(self, token_hash: str, db: Session):
+        # with no staleness allowed the filter never rejects a token on its own, nor is it refreshed
+        if self.filter is not None and self.max_staleness > 0:
+            if self.filter.is_full or self.is_stale():
+                self.refresh(rebuild=self.filter.is_full)
+            elif token_hash not in self.filter:
+                return False
+
+        return await UserBlacklistedToken.exists(token_hash=token_hash, db=db)
+
+    def add(self, token_hash: str):
+        if self.pending is not None:
+            self.pending.append(token_hash)
+        if self.filter is not None and token_hash not in self.filter:
+            self.filter.add(token_hash)
+
+    async def prune(self, db: Session):
+        """ Deletes the expired blacklisted tokens, the filter is rebuilt without them by :meth: `rebuild` """
+        query = delete(UserBlacklistedToken)\
+            .filter(UserBlacklistedToken.expires_at < datetime.utcnow())\
+            .execution_options(synchronize_session=False)
+        result = await resolve(db.execute(query))
+        logger.info(f"Pruned {result.rowcount} expired blacklisted tokens")
+        return result.rowcount
+
+
+blacklist = TokenBlacklist(
+    error_rate=cfg["core.api.users.blacklisted_tokens.filter_error_rate"],
+    max_staleness=cfg["core.api.users.blacklisted_tokens.filter_max_staleness"]
+)
+
+
+@event.listens_for(UserBlacklistedToken, "after_insert")
+def on_blacklisted_token_insert(mapper, connection, target):
+    blacklist.add(token_hash=target.token_hash)
+
+
+async def prune_periodically(interval):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            async with session_scope() as db:
+                await blacklist.prune(db)
+            # rebuilt without the pruned tokens once their deletion is committed
+            if blacklist.filter is not None:
+                await blacklist.rebuild()
+        except Exception as e:
+            logger.exception(e)
@@ -62,3 +62,17 @@ class UserAlreadyAssignedWithRoleException(Exception):
     def __init__(self, username, role_name):
         self.detail = messages["core.api.users.user_already_assigned_with_role"] % (username, role_name)
         super(UserAlreadyAssignedWithRoleException, self).__init__(self.detail)
+
+
+class UsersImportInvalidException(Exception):
+
+    def __init__(self):
+        self.detail = messages["core.api.users.users_import_invalid"]
+        super(UsersImportInvalidException, self).__init__(self.detail)
+
+
+class UsersImportTooLargeException(Exception):
+
+    def __init__(self, max_rows):
+        self.detail = messages["core.api.users.users_import_too_large"] % max_rows
+        super(UsersImportTooLargeException, self).__init__(self.detail)
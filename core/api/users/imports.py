@@ -0,0 +1,44 @@
+import csv
+import io
+import json
+
+from fastapi import Request
+
+from core.api.users.exceptions import UsersImportInvalidException
+
+
+async def read_import_rows(request: Request):
+    """ Reads the rows of a users import from the request body
+
+    Either a JSON array of objects, or a CSV file with a header row of the user fields,
+    sent as the body with a `text/csv` content type or uploaded as the `file` field of a multipart form.
+    """
+    content_type = request.headers.get("content-type", "")
+
+    if content_type.startswith("multipart/form-data"):
+        form = await request.form()
+        upload = form.get("file")
+        if upload is None or isinstance(upload, str):
+            raise UsersImportInvalidException()
+        return parse_csv(await upload.read())
+
+    if content_type.startswith("text/csv"):
+        return parse_csv(await request.body())
+
+    try:
+        rows = json.loads(await request.body())
+    except ValueError:
+        raise UsersImportInvalidException()
+
+    if not isinstance(rows, list):
+        raise UsersImportInvalidException()
+    return rows
+
+
+def parse_csv(content: bytes):
+    try:
+        reader = csv.DictReader(io.StringIO(content.decode("utf-8-sig")))
+        # empty cells are missing values rather than empty strings
+        return [{k: v for k, v in row.items() if k and v != ""} for row in reader]
+    except (UnicodeDecodeError, csv.Error):
+        raise UsersImportInvalidException()
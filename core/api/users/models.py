@@ -1,40 +1,49 @@
 import logging
+from datetime import datetime
 
-from passlib.context import CryptContext
-from sqlalchemy import Column, String, Integer, ForeignKey, Text
-from sqlalchemy.orm import relationship, Session
+from sqlalchemy import Column, String, Integer, ForeignKey, Text, DateTime, select, event, inspect, insert, or_, \
+    update, func
+from sqlalchemy.orm import relationship, Session, object_session
 
+from core.api.oauth2.security import get_token_digest, get_token_expiration
+from core.api.users import passwords
 from core.api.users.exceptions import UserUsernameAlreadyInUseException, UserEmailAlreadyInUseException, \
     UserNotFoundException, UserOldPasswordCannotBeVerifiedException, UserPasswordsCannotBeConfirmedException, \
     UserGroupAlreadyAssignedWithRoleException, UserAlreadyAssignedWithRoleException, UserGroupAlreadyInUseException, \
     UserGroupNotFoundException
+from core.api.users.principals import Principal, principal_cache
+from core.database import resolve
 from core.models import Model
-
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+from core.venom import cfg
 
 logger = logging.getLogger(__name__)
 
+# rows per multi-row insert, well below the bind parameters limits of the supported databases
+INSERT_BATCH_SIZE = 1000
+
 
 class User(Model):
     __tablename__ = "venom_users"
+    __loading_profiles__ = {
+        "roles": {"_roles": "selectin", "_roles.role": "joined"}
+    }
 
     first_name = Column(String(50))
     last_name = Column(String(50))
     username = Column(String(50), nullable=False, unique=True)
     email = Column(String(256), unique=True)
     password = Column(String(256))
-    _roles = relationship("UserRole", back_populates="user")
+    # user roles are deleted along with the user, through the session so that their events are emitted
+    _roles = relationship("UserRole", back_populates="user", cascade="all, delete")
 
     def __init__(self, **kwargs):
         super(User, self).__init__(**kwargs)
 
-        self.set_password(password=self.password)
-
-    def verify_password(self, password):
-        return pwd_context.verify(password, self.password)
+    async def verify_password(self, password):
+        return await passwords.verify_password(password, self.password)
 
-    def set_password(self, password):
-        self.password = self.hash_password(password=password)
+    async def set_password(self, password):
+        self.password = await self.hash_password(password=password)
         return self
 
     @property
@@ -64,13 +73,13 @@ class User(Model):
         return self
 
     async def update_password(self, new_pwd: str, confirm_pwd: str, old_pwd: str = None):
-        if old_pwd and not self.verify_password(old_pwd):
+        if old_pwd and not await self.verify_password(old_pwd):
             raise UserOldPasswordCannotBeVerifiedException()
 
         if new_pwd != confirm_pwd:
             raise UserPasswordsCannotBeConfirmedException()
 
-        self.set_password(password=new_pwd)
+        await self.set_password(password=new_pwd)
         return self
 
     async def has_role(self, role_name: str, db: Session):
@@ -78,22 +87,49 @@ class User(Model):
         if not role:
             return False
 
-        user_role = db.query(UserRole).filter(UserRole.user_id == self.id).filter(UserRole.role_id == role.id).first()
+        query = select(UserRole).filter(UserRole.user_id == self.id).filter(UserRole.role_id == role.id)
+        user_role = (await resolve(db.execute(query))).scalars().first()
         return user_role is not None
 
     @classmethod
     async def get_by_username(cls, username: str, db: Session):
-        user = db.query(cls).filter(cls.username == username).first()
+        # roles are loaded eagerly since lazy loads cannot be awaited on an async session
+        query = select(cls).filter(cls.username == username).options(*cls.get_loading_options("roles"))
+        user = (await resolve(db.execute(query))).scalars().first()
         return user
 
+    @classmethod
+    async def get_principal(cls, username: str, db: Session):
+        principal = principal_cache.get(username)
+        if principal is not None:
+            return principal
+
+        # single query for the user and its role names, one row per role, read from the primary so that the roles
+        # cached are not those of a lagging replica
+        query = select(cls.id, cls.username, Role.name)\
+            .outerjoin(UserRole, UserRole.user_id == cls.id)\
+            .outerjoin(Role, Role.id == UserRole.role_id)\
+            .filter(cls.username == username)\
+            .execution_options(primary=True)
+        rows = (await resolve(db.execute(query))).all()
+        if not rows:
+            return None
+
+        user_id, username, _ = rows[0]
+        principal = Principal(id=user_id, username=username, roles=tuple(name for _, _, name in rows if name))
+        principal_cache.set(username, principal)
+        return principal
+
     @classmethod
     async def get_by_email(cls, email: str, db: Session):
-        user = db.query(cls).filter(cls.email == email).first()
+        query = select(cls).filter(cls.email == email)
+        user = (await resolve(db.execute(query))).scalars().first()
         return user
 
     @classmethod
-    async def get_by_id(cls, id: int, db: Session):
-        user = db.query(User).filter(User.id == id).first()
+    async def get_by_id(cls, id: int, db: Session, profile: str = None):
+        query = select(User).filter(User.id == id).options(*cls.get_loading_options(profile))
+        user = (await resolve(db.execute(query))).scalars().first()
 
         if not user:
             raise UserNotFoundException(user_id=id)
@@ -118,32 +154,109 @@ class User(Model):
             raise UserEmailAlreadyInUseException(email=email)
 
         # add new user
-        user = cls(first_name=first_name, last_name=last_name, username=username, email=email, password=password)
+        user = cls(first_name=first_name, last_name=last_name, username=username, email=email)
+        await user.set_password(password=password)
 
         db.add(user)
-        db.flush()
+        await resolve(db.flush())
         return user
 
+    @classmethod
+    async def create_many(cls, users: list, db: Session, role=None):
+        """ Creates the users with multi-row inserts, skipping those whose username or email is already in use
+
+        :param users: The fields of each user, as dicts with a plain text `password`
+        :param db: The database session
+        :param role: The role to assign to the created users
+        :return: For each of the given users in order, either the id of the created user or the exception
+                 for which it was skipped
+        """
+        results = [None] * len(users)
+        if not users:
+            return results
+
+        # verify usernames and emails already in use with a single query
+        usernames = {user["username"] for user in users}
+        emails = {user["email"] for user in users}
+        query = select(cls.username, cls.email).filter(or_(cls.username.in_(usernames), cls.email.in_(emails)))
+        rows = (await resolve(db.execute(query))).all()
+        usernames_in_use = {username for username, email in rows}
+        emails_in_use = {email for username, email in rows if email}
+
+        accepted = []
+        for i, user in enumerate(users):
+            if user["username"] in usernames_in_use:
+                results[i] = UserUsernameAlreadyInUseException(username=user["username"])
+            elif user["email"] in emails_in_use:
+                results[i] = UserEmailAlreadyInUseException(email=user["email"])
+            else:
+                # the same username or email later in the list is in use by this user
+                usernames_in_use.add(user["username"])
+                emails_in_use.add(user["email"])
+                accepted.append(i)
+
+        hashed_passwords = await passwords.hash_passwords([users[i]["password"] for i in accepted])
+
+        now = datetime.utcnow()
+        values = [
+            dict(
+                first_name=users[i].get("first_name"),
+                last_name=users[i].get("last_name"),
+                username=users[i]["username"],
+                email=users[i]["email"],
+                password=hashed_password,
+                created_on=now,
+                updated_on=now
+            )
+            for i, hashed_password in zip(accepted, hashed_passwords)
+        ]
+        ids = {}
+        for start in range(0, len(values), INSERT_BATCH_SIZE):
+            batch = values[start:start + INSERT_BATCH_SIZE]
+            await resolve(db.execute(insert(cls.__table__).values(batch)))
+
+            query = select(cls.username, cls.id).filter(cls.username.in_([value["username"] for value in batch]))
+            ids.update((await resolve(db.execute(query))).all())
+
+        if role and ids:
+            values = [
+                dict(user_id=user_id, role_id=role.id, created_on=now, updated_on=now)
+                for user_id in ids.values()
+            ]
+            for start in range(0, len(values), INSERT_BATCH_SIZE):
+                await resolve(db.execute(insert(UserRole.__table__).values(values[start:start + INSERT_BATCH_SIZE])))
+
+            # the inserts above bypass the user role events
+            if cfg["core.api.users.roles_users_count"] == "counter":
+                await resolve(db.execute(Role.increment_users_count(role_id=role.id, count=len(values))))
+
+        for i in accepted:
+            results[i] = ids[users[i]["username"]]
+        return results
+
     @classmethod
     async def delete(cls, id: int, db: Session):
         try:
-            user = await cls.get_by_id(id=id, db=db)
+            # the user roles are loaded up front for the delete cascade
+            user = await cls.get_by_id(id=id, db=db, profile="roles")
 
-            db.delete(user)
-            db.flush()
+            await resolve(db.delete(user))
+            await resolve(db.flush())
             return user
         except UserNotFoundException as e:
             logger.warning(str(e))
 
     @staticmethod
-    def hash_password(password):
-        return pwd_context.hash(password)
+    async def hash_password(password):
+        return await passwords.hash_password(password)
 
 
 class UserBlacklistedToken(Model):
     __tablename__ = "venom_users_blacklisted_tokens"
 
-    token = Column(String(128), nullable=False)
+    # tokens are stored as SHA-256 digests
+    token_hash = Column(String(64), nullable=False, unique=True)
+    expires_at = Column(DateTime, index=True)
 
     user_id = Column("user_id", Integer, ForeignKey("venom_users.id"), nullable=False)
     user = relationship(User, primaryjoin=User.id == user_id)
@@ -151,31 +264,82 @@ class UserBlacklistedToken(Model):
     def __init__(self, **kwargs):
         super(UserBlacklistedToken, self).__init__(**kwargs)
 
+    @classmethod
+    async def create(cls, user_id: int, token: str, db: Session):
+        blacklisted_token = cls(
+            user_id=user_id,
+            token_hash=get_token_digest(token=token),
+            expires_at=get_token_expiration(token=token)
+        )
+        db.add(blacklisted_token)
+        await resolve(db.flush())
+        return blacklisted_token
+
+    @classmethod
+    async def exists(cls, token_hash: str, db: Session):
+        query = select(cls.id).filter(cls.token_hash == token_hash)
+        return (await resolve(db.execute(query))).first() is not None
+
 
 class Role(Model):
     __tablename__ = "venom_roles"
+    __loading_profiles__ = {
+        "users": {"_users": "selectin", "_users.user": "joined"}
+    }
 
     name = Column(String(50), nullable=False)
     description = Column(Text)
+    # maintained only when `core.api.users.roles_users_count` is "counter"
+    users_count = Column(Integer, nullable=False, default=0, server_default="0")
     _users = relationship("UserRole", back_populates="role", cascade="all, delete")
 
     @property
     def users(self):
         return [user_role.user for user_role in self._users]
 
+    @classmethod
+    async def get_all_with_users_count(cls, db: Session):
+        """ Returns the id, name, description and number of users of every role, ordered by id """
+        if cfg["core.api.users.roles_users_count"] == "counter":
+            query = select(cls.id, cls.name, cls.description, cls.users_count).order_by(cls.id)
+        else:
+            users_counts = select(UserRole.role_id, func.count(UserRole.id).label("users_count"))\
+                .group_by(UserRole.role_id)\
+                .subquery()
+            users_count = func.coalesce(users_counts.c.users_count, 0).label("users_count")
+            query = select(cls.id, cls.name, cls.description, users_count)\
+                .outerjoin(users_counts, users_counts.c.role_id == cls.id)\
+                .order_by(cls.id)
+
+        return (await resolve(db.execute(query))).mappings().all()
+
+    @classmethod
+    async def count_users(cls, db: Session):
+        """ Sets the users count of every role from the user roles, e.g. when the counter is first enabled """
+        users_count = select(func.count(UserRole.id)).filter(UserRole.role_id == cls.id).scalar_subquery()
+        query = update(cls).values(users_count=users_count).execution_options(synchronize_session=False)
+        await resolve(db.execute(query))
+
+    @classmethod
+    def increment_users_count(cls, role_id: int, count: int):
+        """ Returns the statement that increments the users count of the role atomically, by a negative count too """
+        table = cls.__table__
+        return update(table).where(table.c.id == role_id).values(users_count=table.c.users_count + count)
+
     @classmethod
     async def create(cls, db: Session, name: str, description: str = None):
         role = await cls.get_by_name(name=name, db=db)
         if not role:
             role = cls(name=name, description=description)
             db.add(role)
-            db.flush()
+            await resolve(db.flush())
 
         return role
 
     @classmethod
-    async def get_by_name(cls, db: Session, name):
-        role = db.query(cls).filter(cls.name == name).first()
+    async def get_by_name(cls, db: Session, name, profile: str = None):
+        query = select(cls).filter(cls.name == name).options(*cls.get_loading_options(profile))
+        role = (await resolve(db.execute(query))).scalars().first()
         return role
 
     def __init__(self, **kwargs):
@@ -198,7 +362,7 @@ class UserRole(Model):
 
         user_role = cls(user=user, role=role)
         db.add(user_role)
-        db.flush()
+        await resolve(db.flush())
         return user_role
 
     def __init__(self, **kwargs):
@@ -207,6 +371,11 @@ class UserRole(Model):
 
 class UserGroup(Model):
     __tablename__ = "venom_user_groups"
+    __loading_profiles__ = {
+        "users": {"_users": "selectin", "_users.user": "joined"},
+        "roles": {"_roles": "selectin", "_roles.role": "joined"},
+        "members": {"_users": "selectin", "_users.user": "joined", "_roles": "selectin", "_roles.role": "joined"}
+    }
 
     name = Column(String(50), nullable=False)
     description = Column(Text)
@@ -226,10 +395,10 @@ class UserGroup(Model):
         if not role:
             return False
 
-        user_group_role = db.query(UserGroupRole)\
+        query = select(UserGroupRole)\
             .filter(UserGroupRole.user_group_id == self.id)\
-            .filter(UserGroupRole.role_id == role.id)\
-            .first()
+            .filter(UserGroupRole.role_id == role.id)
+        user_group_role = (await resolve(db.execute(query))).scalars().first()
         return user_group_role is not None
 
     @classmethod
@@ -241,17 +410,19 @@ class UserGroup(Model):
 
         user_group = cls(name=name, description=description)
         db.add(user_group)
-        db.flush()
+        await resolve(db.flush())
         return user_group
 
     @classmethod
     async def get_by_name(cls, db: Session, name):
-        user_group = db.query(cls).filter(cls.name == name).first()
+        query = select(cls).filter(cls.name == name)
+        user_group = (await resolve(db.execute(query))).scalars().first()
         return user_group
 
     @classmethod
-    async def get_by_id(cls, db: Session, id):
-        user_group = db.query(cls).filter(cls.id == id).first()
+    async def get_by_id(cls, db: Session, id, profile: str = None):
+        query = select(cls).filter(cls.id == id).options(*cls.get_loading_options(profile))
+        user_group = (await resolve(db.execute(query))).scalars().first()
 
         if not user_group:
             raise UserGroupNotFoundException(user_group_id=id)
@@ -278,7 +449,7 @@ class UserGroupRole(Model):
 
         user_group_role = cls(user_group=user_group, role=role)
         db.add(user_group_role)
-        db.flush()
+        await resolve(db.flush())
         return user_group_role
 
     def __init__(self, **kwargs):
@@ -296,3 +467,71 @@ class UserGroupUser(Model):
 
     def __init__(self, **kwargs):
         super(UserGroupUser, self).__init__(**kwargs)
+
+
+def invalidate_principal(target, username=None):
+    """ Invalidates the cached principal of `username`, or every cached principal when None, once the session of
+    the flushed `target` commits. Invalidated at flush, a principal could be cached again by a concurrent request from
+    the rows still committed until then
+    """
+    session = object_session(target)
+    if session is None:
+        principal_cache.clear()
+        return
+    session.info.setdefault("invalidated_principals", set()).add(username)
+
+
+@event.listens_for(Session, "after_commit")
+def on_session_commit(session):
+    usernames = session.info.pop("invalidated_principals", None)
+    if not usernames:
+        return
+
+    if None in usernames:
+        principal_cache.clear()
+    else:
+        for username in usernames:
+            principal_cache.invalidate(username)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def on_session_rollback(session, previous_transaction):
+    if previous_transaction.parent is None:
+        session.info.pop("invalidated_principals", None)
+
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def on_user_change(mapper, connection, target):
+    invalidate_principal(target, username=target.username)
+
+
+@event.listens_for(UserRole, "after_insert")
+@event.listens_for(UserRole, "after_delete")
+def on_user_role_change(mapper, connection, target):
+    user = inspect(target).attrs.user.loaded_value
+    invalidate_principal(target, username=user.username if isinstance(user, User) else None)
+
+
+@event.listens_for(UserRole, "after_insert")
+def on_user_role_insert(mapper, connection, target):
+    if cfg["core.api.users.roles_users_count"] == "counter":
+        connection.execute(Role.increment_users_count(role_id=target.role_id, count=1))
+
+
+@event.listens_for(UserRole, "after_delete")
+def on_user_role_delete(mapper, connection, target):
+    if cfg["core.api.users.roles_users_count"] == "counter":
+        connection.execute(Role.increment_users_count(role_id=target.role_id, count=-1))
+
+
+@event.listens_for(Role, "after_insert")
+@event.listens_for(Role, "after_update")
+@event.listens_for(Role, "after_delete")
+@event.listens_for(UserGroup, "after_delete")
+@event.listens_for(UserGroupRole, "after_insert")
+@event.listens_for(UserGroupRole, "after_delete")
+@event.listens_for(UserGroupUser, "after_insert")
+@event.listens_for(UserGroupUser, "after_delete")
+def on_roles_change(mapper, connection, target):
+    invalidate_principal(target)
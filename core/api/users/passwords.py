@@ -0,0 +1,79 @@
+import asyncio
+import os
+
+from passlib.context import CryptContext
+
+from core.executors import BoundedProcessPoolExecutor
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+# passwords hashed by a single task of a bulk hash, small enough for a task to complete well within the timeout
+HASH_BATCH_SIZE = 8
+
+executor = None
+
+
+def get_executor():
+    """ Returns the password hashing executor of the current process, created on first use """
+    global executor
+    if executor is None:
+        # imported lazily, since the pool processes import this module and must not load the whole application
+        from core import venom
+
+        pool_size = venom.cfg["core.api.users.password_hashing.pool_size"]
+        if pool_size is None:
+            # the worker processes of the server share the CPUs, rather than each starting a hashing process per CPU
+            pool_size = max((os.cpu_count() or 1) // venom.get_workers(), 1)
+
+        executor = BoundedProcessPoolExecutor(
+            max_workers=pool_size,
+            max_pending=venom.cfg["core.api.users.password_hashing.max_pending"],
+            timeout=venom.cfg["core.api.users.password_hashing.timeout"]
+        )
+    return executor
+
+
+async def shutdown():
+    global executor
+    if executor is not None:
+        pool, executor = executor, None
+        # waits for the pool processes to exit, left to the interpreter exit they may never receive the sentinel, on
+        # a thread so that the in-flight hashes do not block the event loop and the other shutdown handlers
+        await asyncio.get_running_loop().run_in_executor(None, pool.shutdown, True)
+
+
+async def hash_password(password):
+    return await get_executor().run(_hash_password, password)
+
+
+async def hash_passwords(passwords):
+    """ Hashes the passwords in parallel across the pool processes, returning the hashes in the same order
+
+    At most one task per pool process is in flight, so that single password tasks are still accepted meanwhile.
+    """
+    pool = get_executor()
+    semaphore = asyncio.Semaphore(max(pool.max_workers, 1))
+
+    async def hash_batch(batch):
+        async with semaphore:
+            return await pool.run(_hash_passwords, batch)
+
+    batches = [passwords[i:i + HASH_BATCH_SIZE] for i in range(0, len(passwords), HASH_BATCH_SIZE)]
+    results = await asyncio.gather(*[hash_batch(batch) for batch in batches])
+    return [hashed_password for batch in results for hashed_password in batch]
+
+
+async def verify_password(password, hashed_password):
+    return await get_executor().run(_verify_password, password, hashed_password)
+
+
+def _hash_password(password):
+    return pwd_context.hash(password)
+
+
+def _hash_passwords(passwords):
+    return [pwd_context.hash(password) for password in passwords]
+
+
+def _verify_password(password, hashed_password):
+    return pwd_context.verify(password, hashed_password)
@@ -0,0 +1,25 @@
+from core.caches import TTLCache
+from core.venom import cfg
+
+
+class Principal(object):
+    """
+    Compact, immutable record of an authenticated user and the names of its roles
+    """
+    __slots__ = ("id", "username", "roles")
+
+    def __init__(self, id, username, roles):
+        self.id = id
+        self.username = username
+        self.roles = roles
+
+    def __repr__(self):
+        return f"Principal(id={self.id!r}, username={self.username!r}, roles={self.roles!r})"
+
+
+# principals keyed by username, invalidated by the users models on role and group changes
+principal_cache = TTLCache(
+    max_size=cfg["core.api.users.principal_cache.max_size"],
+    ttl=cfg["core.api.users.principal_cache.ttl"],
+    name="principals"
+)
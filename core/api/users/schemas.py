@@ -1,7 +1,7 @@
 from typing import Optional, List
 
 from fastapi import Form
-from pydantic import BaseModel, validator
+from pydantic import BaseModel, validator, constr
 
 from core.schemas import email_validator
 
@@ -42,6 +42,32 @@ class UserCreateSchema(BaseModel):
         orm_mode = True
 
 
+class UserImportSchema(BaseModel):
+
+    first_name: Optional[constr(max_length=50)] = None
+    last_name: Optional[constr(max_length=50)] = None
+    username: constr(min_length=1, max_length=50)
+    email: constr(max_length=256)
+    password: constr(min_length=1)
+
+    _normalized_email = validator("email", allow_reuse=True)(email_validator)
+
+
+class UserImportResultSchema(BaseModel):
+
+    row: int
+    username: Optional[str] = None
+    id: Optional[int] = None
+    detail: Optional[str] = None
+
+
+class UserImportReportSchema(BaseModel):
+
+    created: int
+    failed: int
+    results: List[UserImportResultSchema]
+
+
 class UserResetPasswordSchema(BaseModel):
 
     email: str
@@ -0,0 +1,248 @@
+import asyncio
+import json
+from datetime import datetime
+from urllib.parse import urlencode
+
+import pytest
+from fastapi import Request
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from core.api.users import models, passwords
+from core.api.users.blacklist import TokenBlacklist
+from core.api.users.exceptions import UserUsernameAlreadyInUseException, UserEmailAlreadyInUseException, \
+    UsersImportInvalidException
+from core.api.users.imports import parse_csv
+from core.api.users.models import User, UserBlacklistedToken, Role, UserRole
+from core.models import QueryExecutor
+
+# first names with duplicates and nulls, so that the sort keys tie and the nullable sort key holds nulls
+FIRST_NAMES = ["beta", None, "alpha", "beta", None, "gamma", "alpha", "beta", None]
+
+
+@pytest.fixture
+def session():
+    engine = create_engine("sqlite://")
+    User.__table__.create(bind=engine)
+    with Session(bind=engine) as session:
+        for index, first_name in enumerate(FIRST_NAMES):
+            session.add(User(id=index + 1, username=f"user{index}", first_name=first_name))
+        session.commit()
+        yield session
+
+
+def create_request(**params):
+    return Request({"type": "http", "query_string": urlencode(params).encode(), "headers": []})
+
+
+def create_executor(session, sort, **params):
+    request = create_request(sort=json.dumps(sort), **params)
+    return QueryExecutor(request=request, query=session.query(User))
+
+
+def get_pages(session, sort, limit):
+    """ Returns the ids of every page, fetched with the cursor of the previous page """
+    pages = []
+    cursor = ""
+    while cursor is not None:
+        executor = create_executor(session, sort, cursor=cursor, limit=limit)
+        pages.append([user.id for user in executor.all()])
+        cursor = executor.next_cursor
+    return pages
+
+
+def get_sorted_ids(session, sort):
+    """ Returns the ids sorted in python, nulls as the greatest values and the id breaking the ties """
+    users = session.query(User).all()
+    for obj in reversed(sort + [dict(field="id", dir=sort[-1]["dir"])]):
+        users.sort(
+            key=lambda user: (getattr(user, obj["field"]) is None, getattr(user, obj["field"]) or ""),
+            reverse=obj["dir"] == "desc"
+        )
+    return [user.id for user in users]
+
+
+@pytest.mark.parametrize("sort", [
+    [dict(field="username", dir="asc")],
+    [dict(field="username", dir="desc")],
+    [dict(field="first_name", dir="asc")],
+    [dict(field="first_name", dir="desc")],
+    [dict(field="first_name", dir="asc"), dict(field="username", dir="desc")],
+    [dict(field="first_name", dir="desc"), dict(field="id", dir="asc")]
+])
+@pytest.mark.parametrize("limit", [1, 2, 4, 20])
+def test_cursor_pages(session, sort, limit):
+    pages = get_pages(session, sort, limit)
+
+    assert [user_id for page in pages for user_id in page] == get_sorted_ids(session, sort)
+    assert all(len(page) == limit for page in pages[:-1])
+
+
+def test_cursor_values_are_coerced(session):
+    executor = create_executor(session, [dict(field="created_on", dir="asc")], cursor="", limit=1)
+    cursor = executor._encode_cursor(User(id=3, created_on=datetime(2021, 7, 1, 12, 30)))
+
+    assert executor._decode_cursor(cursor) == [datetime(2021, 7, 1, 12, 30), 3]
+
+
+def test_cursor_datetimes_are_converted_to_naive_utc(session):
+    executor = create_executor(session, [dict(field="created_on", dir="asc")], cursor="", limit=1)
+
+    assert executor._coerce_value(User.created_on, "2021-07-01T14:30:00+02:00", field="created_on") == \
+        datetime(2021, 7, 1, 12, 30)
+    assert executor._coerce_value(User.created_on, "2021-07-01T12:30:00Z", field="created_on") == \
+        datetime(2021, 7, 1, 12, 30)
+
+
+@pytest.mark.parametrize("cursor", ["not a cursor", "W10", "WyJhIl0", "WyJhIiwgImIiXQ"])
+def test_invalid_cursor(session, cursor):
+    executor = create_executor(session, [dict(field="first_name", dir="asc")], cursor="", limit=1)
+
+    with pytest.raises(ValueError):
+        executor._decode_cursor(cursor)
+
+
+@pytest.fixture
+def tokens_session():
+    engine = create_engine("sqlite://")
+    User.__table__.create(bind=engine)
+    UserBlacklistedToken.__table__.create(bind=engine)
+    with Session(bind=engine) as session:
+        session.add(User(id=1, username="user"))
+        session.add(UserBlacklistedToken(user_id=1, token_hash="loaded"))
+        session.commit()
+        yield session
+
+
+def create_blacklist(session, monkeypatch, max_staleness=5):
+    """ Returns a loaded blacklist, its background refreshes recorded rather than run """
+    blacklist = TokenBlacklist(max_staleness=max_staleness)
+    asyncio.run(blacklist.load(session))
+    blacklist.refreshes = []
+    monkeypatch.setattr(blacklist, "refresh", lambda rebuild=False: blacklist.refreshes.append(rebuild))
+    return blacklist
+
+
+def blacklist_elsewhere(session, token_hash):
+    """ Inserts a blacklisted token as another process would, without adding it to the filter """
+    session.execute(UserBlacklistedToken.__table__.insert().values(user_id=1, token_hash=token_hash))
+    session.commit()
+
+
+def test_blacklist_contains(tokens_session, monkeypatch):
+    blacklist = create_blacklist(tokens_session, monkeypatch)
+
+    assert asyncio.run(blacklist.contains("loaded", db=tokens_session))
+    assert not asyncio.run(blacklist.contains("other", db=tokens_session))
+    assert blacklist.refreshes == []
+
+
+def test_stale_blacklist_queries_and_syncs(tokens_session, monkeypatch):
+    blacklist = create_blacklist(tokens_session, monkeypatch)
+    blacklist_elsewhere(tokens_session, token_hash="elsewhere")
+    blacklist.synced_at -= blacklist.max_staleness
+
+    assert asyncio.run(blacklist.contains("elsewhere", db=tokens_session))
+    assert blacklist.refreshes == [False]
+
+
+def test_full_blacklist_queries_and_rebuilds(tokens_session, monkeypatch):
+    blacklist = create_blacklist(tokens_session, monkeypatch)
+    blacklist_elsewhere(tokens_session, token_hash="elsewhere")
+    blacklist.filter.count = blacklist.filter.capacity
+
+    assert asyncio.run(blacklist.contains("elsewhere", db=tokens_session))
+    assert blacklist.refreshes == [True]
+
+
+def test_blacklist_without_staleness_always_queries(tokens_session, monkeypatch):
+    blacklist = create_blacklist(tokens_session, monkeypatch, max_staleness=0)
+    blacklist_elsewhere(tokens_session, token_hash="elsewhere")
+
+    assert asyncio.run(blacklist.contains("elsewhere", db=tokens_session))
+    assert blacklist.refreshes == []
+
+
+def test_blacklist_sync(tokens_session, monkeypatch):
+    blacklist = create_blacklist(tokens_session, monkeypatch)
+    blacklist_elsewhere(tokens_session, token_hash="elsewhere")
+    asyncio.run(blacklist.sync(tokens_session))
+
+    assert "elsewhere" in blacklist.filter
+    assert not blacklist.is_stale()
+
+
+def test_tokens_blacklisted_while_loading_are_kept(tokens_session):
+    blacklist = TokenBlacklist()
+    build = blacklist.build
+
+    def build_and_blacklist(token_hashes):
+        blacklist.add("while loading")
+        return build(token_hashes)
+
+    blacklist.build = build_and_blacklist
+    asyncio.run(blacklist.load(tokens_session))
+
+    assert "while loading" in blacklist.filter
+    assert blacklist.pending is None
+
+
+@pytest.fixture
+def import_session(monkeypatch):
+    engine = create_engine("sqlite://")
+    for model in (User, Role, UserRole):
+        model.__table__.create(bind=engine)
+
+    async def hash_passwords(values):
+        return [f"hashed {value}" for value in values]
+
+    # the rows are inserted in batches of two, and the passwords are not hashed by the pool processes
+    monkeypatch.setattr(models, "INSERT_BATCH_SIZE", 2)
+    monkeypatch.setattr(passwords, "hash_passwords", hash_passwords)
+    with Session(bind=engine) as session:
+        session.add(User(username="taken", email="taken@example.com"))
+        session.add(Role(id=1, name="USER"))
+        session.commit()
+        yield session
+
+
+def create_import_user(username, email=None):
+    return dict(username=username, email=email or f"{username}@example.com", password="secret", first_name=username)
+
+
+def test_create_many_report(import_session):
+    users = [
+        create_import_user("first"),
+        create_import_user("taken"),
+        create_import_user("second", email="taken@example.com"),
+        create_import_user("third"),
+        create_import_user("first", email="other@example.com"),
+        create_import_user("fourth", email="third@example.com"),
+        create_import_user("fifth")
+    ]
+    role = import_session.get(Role, 1)
+    results = asyncio.run(User.create_many(users=users, db=import_session, role=role))
+
+    assert [type(result) for result in results] == [
+        int, UserUsernameAlreadyInUseException, UserEmailAlreadyInUseException, int,
+        UserUsernameAlreadyInUseException, UserEmailAlreadyInUseException, int
+    ]
+    created = {user.username: user for user in import_session.query(User).filter(User.id.in_(results[::3]))}
+    assert [created[username].id for username in ("first", "third", "fifth")] == results[::3]
+    assert created["first"].password == "hashed secret"
+    assert import_session.query(UserRole).filter(UserRole.role_id == 1).count() == 3
+
+
+def test_create_many_without_users(import_session):
+    assert asyncio.run(User.create_many(users=[], db=import_session)) == []
+
+
+def test_parse_import_csv():
+    content = "\ufeffusername,email,password,first_name\nuser,user@example.com,secret,\n".encode("utf-8")
+
+    assert parse_csv(content) == [dict(username="user", email="user@example.com", password="secret")]
+
+
+def test_parse_invalid_import_csv():
+    with pytest.raises(UsersImportInvalidException):
+        parse_csv(b"\xff\xfe")
@@ -0,0 +1,44 @@
+import hashlib
+import math
+
+
+class BloomFilter(object):
+
+    def __init__(self, capacity, error_rate=0.01):
+        """ Construct a new :class: `BloomFilter`
+
+        Probabilistic set membership: `key in bloom_filter` is never False for an added key, and True for
+        a key that was never added with about `error_rate` probability while the filter holds at most `capacity` keys.
+
+        :param capacity: The expected number of keys
+        :param error_rate: The false positive probability at full capacity
+        """
+        self.capacity = max(int(capacity), 1)
+        self.error_rate = error_rate
+        self.size = max(int(-self.capacity * math.log(error_rate) / math.log(2) ** 2), 8)
+        self.hash_count = max(int(round(self.size / self.capacity * math.log(2))), 1)
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def add(self, key):
+        for index in self._indexes(key):
+            self._bits[index >> 3] |= 1 << (index & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        bits = self._bits
+        return all(bits[index >> 3] & (1 << (index & 7)) for index in self._indexes(key))
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def is_full(self):
+        return self.count >= self.capacity
+
+    def _indexes(self, key):
+        # double hashing, h1 + i * h2, over the two halves of a single 128 bits digest
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hash_count)]
@@ -0,0 +1,75 @@
+import threading
+import time
+from collections import OrderedDict
+
+# the named caches of the process, e.g. for their metrics
+caches = dict()
+
+
+class TTLCache(object):
+
+    def __init__(self, max_size=1024, ttl=None, name=None):
+        """ Construct a new :class: `TTLCache`
+
+        In-process cache with least recently used eviction, where every entry also expires after its own deadline.
+
+        :param max_size: The maximum number of entries, 0 disables the cache
+        :param ttl: The maximum number of seconds an entry is kept, unlimited when None
+        :param name: The name the cache is registered with in :data: `caches`, unregistered when None
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if name is not None:
+            caches[name] = self
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.time():
+                del self._entries[key]
+                self.misses += 1
+                return default
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, expires_at=None):
+        """ Stores the value until the given unix timestamp, capped by the cache ttl """
+        if not self.max_size:
+            return
+
+        if self.ttl is not None:
+            ttl_expires_at = time.time() + self.ttl
+            expires_at = ttl_expires_at if expires_at is None else min(expires_at, ttl_expires_at)
+
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def __len__(self):
+        return len(self._entries)
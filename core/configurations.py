@@ -2,23 +2,26 @@ import os
 
 import yaml
 
+from core.discovery import Discovery
+
 
 class Configuration(object):
 
-    def __init__(self, filename=None):
+    def __init__(self, filename=None, paths=None):
+        """ Construct a new :class: `Configuration`
+
+        :param filename: The configuration file of `./conf` overriding the packages configurations
+        :param paths: The `configs.yml` paths of the packages, discovered when None
+        """
         self.filename = filename
         self.cfg = dict()
         self.default_cfg = dict()
         self.external_cfg = dict()
         self.external_cfg_path = os.path.join("./conf", filename) if filename else None
 
-        for root, dirs, files in os.walk("."):
-            for filename in files:
-                if filename != "configs.yml":
-                    continue
-
-                with open(os.path.join(root, filename)) as f:
-                    self.default_cfg.update(**yaml.load(f, Loader=yaml.SafeLoader))
+        for path in paths if paths is not None else Discovery().find("configs.yml"):
+            with open(path) as f:
+                self.default_cfg.update(**yaml.load(f, Loader=yaml.SafeLoader))
 
         if self.filename and os.path.exists(self.external_cfg_path):
             with open(self.external_cfg_path) as f:
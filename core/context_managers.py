@@ -1,18 +1,23 @@
-from contextlib import contextmanager
+from contextlib import asynccontextmanager
 
 from core import venom
+from core.database import resolve
 
 
-@contextmanager
-def session_scope():
-    """ Creates a new database session scope """
+@asynccontextmanager
+async def session_scope(read_only=False):
+    """ Creates a new database session scope
+
+    :param read_only: Whether the reads of the session may be sent to the read replicas, see `RoutingSession`
+    """
     session = venom.database.Session()
+    session.info["read_only"] = read_only
     try:
         yield session
-        session.commit()
+        await resolve(session.commit())
     except Exception as e:
-        session.rollback()
+        await resolve(session.rollback())
         raise e
     finally:
-        session.close()
-        venom.database.Session.remove()
+        await resolve(session.close())
+        await resolve(venom.database.Session.remove())
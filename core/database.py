@@ -1,74 +1,232 @@
+import asyncio
+import inspect
+import itertools
 import logging
 import os
+import time
+from collections import Counter
+from contextvars import ContextVar
 
 from alembic.config import Config
 from alembic.runtime import migration
 from alembic.runtime.environment import EnvironmentContext
 from alembic.runtime.migration import MigrationContext
 from alembic.script import ScriptDirectory
-from sqlalchemy import create_engine, exc, MetaData
-from sqlalchemy.orm import scoped_session, sessionmaker
+from sqlalchemy import create_engine, event, exc, MetaData, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_scoped_session
+from sqlalchemy.orm import scoped_session, sessionmaker, Session
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
 
 from fastapi import Request
 
+from core import metrics
+
 logger = logging.getLogger(__name__)
 logging.getLogger("alembic").setLevel(logging.ERROR)
 # logging.getLogger("sqlalchemy.engine").setLevel(logging.INFO)
 
 ALEMBIC_TABLE_PREFIX = "alembic_"
 
+# the statements statistics of the current request, set by `HTTPMiddleware`
+query_stats = ContextVar("query_stats", default=None)
+
 
 class Database(object):
 
-    def __init__(self, url, pool_size=5, max_overflow=10):
+    def __init__(
+            self,
+            url,
+            pool_size=5,
+            max_overflow=10,
+            slow_query_threshold=None,
+            replicas=None,
+            replicas_balancing="round_robin",
+            replicas_retry_interval=10
+    ):
         """ Construct a new :class: `Database`
 
+        The engine flavour is selected from the url driver, e.g. `postgresql+asyncpg://` or
+        `sqlite+aiosqlite://` build an asyncio engine whose sessions are :class: `AsyncSession` objects.
+        Every statement is timed and recorded in the :class: `QueryStats` of the current request, if any.
+        With replicas, the sessions are :class: `RoutingSession` objects sending the reads of read-only sessions to
+        the replicas.
+
         :param url: The database url to create the database engine
         :param pool_size: The number of connections to keep open inside the connection pool
         :param max_overflow: The number of connections to allow in connection pool "overflow",
                              that is connections that can be opened above and beyond the pool_size setting
+        :param slow_query_threshold: The number of seconds after which a statement is logged, with its parameters
+                                     redacted, statements are never logged when None
+        :param replicas: The read replicas urls, of the same driver as the url
+        :param replicas_balancing: Either "round_robin" or "least_connections"
+        :param replicas_retry_interval: The number of seconds a failed replica is left out before it is used again
         """
         self.url = url
         self.pool_size = pool_size
         self.max_overflow = max_overflow
+        self.slow_query_threshold = slow_query_threshold
+        self.is_async = make_url(self.url).get_dialect().is_async
 
-        logger.info("Initializing database engine...")
-        try:
-            self.engine = create_engine(self.url, pool_size=pool_size, max_overflow=max_overflow)
-        except TypeError:
-            self.engine = create_engine(self.url)
+        logger.info(f"Initializing {'asyncio ' if self.is_async else ''}database engine...")
+        self.engine = self.create_engine(url=self.url)
 
-        self.Session = scoped_session(sessionmaker(
-            bind=self.engine,
+        self.replicas = None
+        if replicas:
+            if any(make_url(replica).get_dialect().is_async != self.is_async for replica in replicas):
+                raise SystemExit("Database replicas urls must be of the asyncio flavour of the database url")
+
+            logger.info(f"Initializing {len(replicas)} database replica engines...")
+            self.replicas = Replicas(
+                engines=[self.create_engine(url=replica) for replica in replicas],
+                balancing=replicas_balancing,
+                retry_interval=replicas_retry_interval
+            )
+
+        session_options = dict(
             autoflush=False,
             autocommit=False,
             expire_on_commit=False,
             enable_baked_queries=False
-        ))
+        )
+        if self.replicas:
+            session_factory = sessionmaker(
+                bind=self.engine,
+                class_=RoutingAsyncSession if self.is_async else RoutingSession,
+                replicas=self.replicas,
+                **session_options
+            )
+        else:
+            session_factory = sessionmaker(
+                bind=self.engine,
+                class_=AsyncSession if self.is_async else Session,
+                **session_options
+            )
+        if self.is_async:
+            self.Session = async_scoped_session(session_factory, scopefunc=asyncio.current_task)
+        else:
+            self.Session = scoped_session(session_factory)
 
         try:
             logger.info("Initializing database connection...")
-            self.engine.execute("SELECT 1")
+            self.run_sync(lambda connection: connection.execute(text("SELECT 1")))
         except (exc.OperationalError, exc.ProgrammingError) as e:
             raise SystemExit(e)
 
-    def apply_migrations(self):
+        if self.replicas:
+            # connected once here, the first connection of an asyncio engine must not be raced by concurrent ones
+            for engine in self.replicas.engines:
+                try:
+                    self.run_sync(lambda connection: connection.execute(text("SELECT 1")), engine=engine)
+                except CONNECT_ERRORS as e:
+                    self.replicas.mark_down(engine=engine, e=e)
+
+    def create_engine(self, url):
+        url = make_url(url)
+        engine_factory = create_async_engine if self.is_async else create_engine
+        # the default pool of the dialect, timing its checkouts when it is a queue pool
+        pool_class = TIMED_POOL_CLASSES.get(url.get_dialect().get_pool_class(url))
+        pool_options = dict(poolclass=pool_class) if pool_class else dict()
+        try:
+            engine = engine_factory(url, pool_size=self.pool_size, max_overflow=self.max_overflow, **pool_options)
+        except TypeError:
+            engine = engine_factory(url)
+
+        sync_engine = getattr(engine, "sync_engine", engine)
+        event.listen(sync_engine, "before_cursor_execute", self.on_before_cursor_execute)
+        event.listen(sync_engine, "after_cursor_execute", self.on_after_cursor_execute)
+        return engine
+
+    def on_before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        context.query_start = time.perf_counter()
+
+    def on_after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        duration = time.perf_counter() - context.query_start
+
+        stats = query_stats.get()
+        if stats is not None:
+            stats.record(statement=statement, duration=duration)
+
+        if self.slow_query_threshold is not None and duration >= self.slow_query_threshold:
+            logger.warning("Slow query (%s ms): %s; parameters %s", round(duration * 1000), " ".join(statement.split()),
+                           redact(parameters[0] if executemany and parameters else parameters))
+
+    def run_sync(self, fn, engine=None):
+        """ Runs `fn` with a synchronous connection, regardless of the engine flavour
+
+        Asyncio engines are driven through a private event loop, so this must not be called from a running loop.
+        The engine is disposed afterwards since pooled asyncio connections are bound to the loop that opened them.
+
+        :param engine: The engine to connect with, defaults to the primary engine
+        """
+        engine = engine or self.engine
+        if not self.is_async:
+            with engine.connect() as connection:
+                return fn(connection)
+
+        async def run():
+            try:
+                async with engine.begin() as connection:
+                    return await connection.run_sync(fn)
+            finally:
+                await engine.dispose()
+
+        return asyncio.run(run())
+
+    def dispose(self):
+        """ Closes the pooled connections, e.g. before processes are started that must open connections of their own """
+        engines = [self.engine] + (self.replicas.engines if self.replicas else [])
+        if self.is_async:
+            async def dispose():
+                for engine in engines:
+                    await engine.dispose()
+
+            asyncio.run(dispose())
+        else:
+            for engine in engines:
+                engine.dispose()
+
+    async def check_replicas_periodically(self, interval):
+        """ Checks the replicas every `interval` seconds, so that a failed replica is used again once it is back """
+        if not self.replicas:
+            return
+
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(interval)
+            for engine in self.replicas.engines:
+                if self.is_async:
+                    await self.replicas.check_async(engine)
+                else:
+                    await loop.run_in_executor(None, self.replicas.check, engine)
+
+    def apply_migrations(self, migrations_folders=None):
+        """ Applies the migrations of `core.api` and of the `api` packages
+
+        :param migrations_folders: The migrations folders of the `api` packages, found by walking `api` when None
+        """
         migrations_folder = os.path.join("core", "api", "migrations")
         if os.path.exists(migrations_folder):
             self.migrate(repository=migrations_folder, version_table=ALEMBIC_TABLE_PREFIX + "venom")
 
-        for root_package, dirs, files in os.walk("api"):
-            for dir_name in dirs:
-                migrations_folder = root_package + os.path.sep + dir_name + os.path.sep + "migrations"
-                if os.path.exists(migrations_folder):
-                    self.migrate(repository=migrations_folder, version_table=ALEMBIC_TABLE_PREFIX + dir_name)
+        if migrations_folders is None:
+            migrations_folders = []
+            for root_package, dirs, files in os.walk("api"):
+                for dir_name in dirs:
+                    migrations_folder = root_package + os.path.sep + dir_name + os.path.sep + "migrations"
+                    if os.path.exists(migrations_folder):
+                        migrations_folders.append(migrations_folder)
+
+        for migrations_folder in migrations_folders:
+            dir_name = os.path.basename(os.path.dirname(migrations_folder))
+            self.migrate(repository=migrations_folder, version_table=ALEMBIC_TABLE_PREFIX + dir_name)
 
     def migrate(self, repository, version_table):
         config = Config()
         config.set_main_option("script_location", repository)
         config.set_main_option("url", self.url)
 
-        with self.engine.connect() as connection:
+        def run_migrations(connection):
             migration_context = MigrationContext.configure(connection, opts=dict(version_table=version_table))
             current_revision = migration_context.get_current_revision()
             script = ScriptDirectory.from_config(config)
@@ -109,25 +267,32 @@ class Database(object):
             else:
                 logger.info(f"Repository \"{repository}\" migrations on version {current_head}")
 
+        self.run_sync(run_migrations)
+
     def truncate_tables(self):
-        with self.engine.connect() as session:
-            sorted_tables = self.get_sorted_tables()
+        def truncate(connection):
+            sorted_tables = self.get_sorted_tables(connection=connection)
             for table in reversed(sorted_tables):
                 table_name = table.name
                 # disable table foreign key checks
-                session.execute(f"ALTER TABLE {table_name} DISABLE TRIGGER ALL")
+                connection.execute(text(f"ALTER TABLE {table_name} DISABLE TRIGGER ALL"))
                 # process table data deletion
-                session.execute(table.delete())
+                connection.execute(table.delete())
                 # reset table id counter to 1
-                session.execute(f"ALTER SEQUENCE {table_name}_id_seq RESTART WITH 1;")
+                connection.execute(text(f"ALTER SEQUENCE {table_name}_id_seq RESTART WITH 1;"))
                 # enable table triggers e.g. foreign key checks
-                session.execute(f"ALTER TABLE {table_name} ENABLE TRIGGER ALL;")
+                connection.execute(text(f"ALTER TABLE {table_name} ENABLE TRIGGER ALL;"))
+
+        self.run_sync(truncate)
         return self
 
-    def get_sorted_tables(self):
+    def get_sorted_tables(self, connection=None):
+        if connection is None:
+            return self.run_sync(lambda c: self.get_sorted_tables(connection=c))
+
         sorted_tables = []
-        meta = MetaData(bind=self.engine)
-        meta.reflect(self.engine)
+        meta = MetaData()
+        meta.reflect(bind=connection)
         for table in meta.sorted_tables:
             if table.name.startswith(ALEMBIC_TABLE_PREFIX):
                 continue
@@ -135,6 +300,362 @@ class Database(object):
         return sorted_tables
 
 
-def get_db(request: Request):
-    """ Returns current session database object per request """
-    return request.state.session
+# the errors of a failed connection, asyncpg raises the errors of the socket as they are
+CONNECT_ERRORS = (exc.DBAPIError, OSError)
+
+
+def is_connection_error(e):
+    """ Whether an error is a failure to connect, or a lost connection, rather than e.g. a failed statement """
+    if isinstance(e, exc.DBAPIError):
+        # the errors raised when connecting have no statement
+        return e.connection_invalidated or e.statement is None
+    return isinstance(e, OSError)
+
+
+class Replicas(object):
+
+    def __init__(self, engines, balancing="round_robin", retry_interval=10):
+        """ Construct a new :class: `Replicas`
+
+        Balances the reads over the read replicas engines. A replica failing to connect, or disconnected, is left
+        out for `retry_interval` seconds, or until a health check connects to it again, and the reads fail over to
+        the other replicas, or to the primary once every replica is left out.
+
+        :param engines: The replicas engines
+        :param balancing: Either "round_robin" or "least_connections", the replica with the fewest checked out
+                          connections
+        :param retry_interval: The number of seconds a failed replica is left out
+        """
+        if balancing not in ["round_robin", "least_connections"]:
+            raise ValueError(f"Replicas balancing must be round_robin or least_connections, not `{balancing}`")
+
+        self.engines = engines
+        self.balancing = balancing
+        self.retry_interval = retry_interval
+        # monotonic time until which a failed replica is left out, by engine
+        self.down_until = {engine: 0.0 for engine in engines}
+        self._counter = itertools.count()
+
+        for engine in engines:
+            event.listen(getattr(engine, "sync_engine", engine), "handle_error", self.create_error_listener(engine))
+
+    def choose(self):
+        """ Returns the replica engine of the next reads, None when every replica is left out """
+        now = time.monotonic()
+        engines = [engine for engine in self.engines if self.down_until[engine] <= now]
+        if not engines:
+            return None
+
+        if self.balancing == "least_connections":
+            return min(engines, key=get_checked_out)
+        return engines[next(self._counter) % len(engines)]
+
+    def mark_down(self, engine, e=None):
+        # logged once until the replica is back, rather than on every failed retry
+        if not self.down_until[engine]:
+            logger.warning(f"Database replica {engine.url!r} left out until it is back: {e}")
+        self.down_until[engine] = time.monotonic() + self.retry_interval
+
+    def mark_up(self, engine):
+        if self.down_until[engine]:
+            logger.info(f"Database replica {engine.url!r} is back")
+        self.down_until[engine] = 0.0
+
+    def create_error_listener(self, engine):
+        def on_error(context):
+            # failed to connect, or lost the connection, rather than e.g. a failed statement
+            if context.connection is None or context.is_disconnect:
+                self.mark_down(engine=engine, e=context.original_exception)
+
+        return on_error
+
+    def check(self, engine):
+        """ Connects to a synchronous replica engine, leaving it out when it fails """
+        try:
+            with engine.connect() as connection:
+                connection.execute(text("SELECT 1"))
+        except CONNECT_ERRORS as e:
+            self.mark_down(engine=engine, e=e)
+        else:
+            self.mark_up(engine=engine)
+
+    async def check_async(self, engine):
+        """ Connects to an asyncio replica engine, leaving it out when it fails """
+        try:
+            async with engine.connect() as connection:
+                await connection.execute(text("SELECT 1"))
+        except CONNECT_ERRORS as e:
+            self.mark_down(engine=engine, e=e)
+        else:
+            self.mark_up(engine=engine)
+
+
+def get_checked_out(engine):
+    pool = getattr(engine, "sync_engine", engine).pool
+    return pool.checkedout() if hasattr(pool, "checkedout") else 0
+
+
+class RoutingSession(Session):
+
+    def __init__(self, replicas=None, **kwargs):
+        """ Construct a new :class: `RoutingSession`
+
+        Sends the plain SELECT statements of a read-only session, e.g. of a GET request, to a replica, the same for
+        the whole session. Writes, and every statement after the first write of the session, so that the session
+        reads what it wrote, go to the primary, as do the sessions that are not read-only and the statements with
+        the `primary` execution option, e.g. `select(User).execution_options(primary=True)`. A read failing on its
+        replica is retried on the primary, see :meth: `execute_with_failover`.
+
+        :param replicas: The :class: `Replicas` of the session
+        """
+        super(RoutingSession, self).__init__(**kwargs)
+        self.replicas = replicas
+        self.replica = None
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        replica = self.get_replica(clause) if bind is None else None
+        if replica is not None:
+            return getattr(replica, "sync_engine", replica)
+        return super(RoutingSession, self).get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    def get_replica(self, clause):
+        """ Returns the replica engine of a statement, None for the primary """
+        if not self.replicas or not self.info.get("read_only") or self.info.get("primary") or not is_read(clause):
+            return None
+        if clause.get_execution_options().get("primary"):
+            return None
+
+        if self.replica is None:
+            self.replica = self.replicas.choose()
+        return self.replica
+
+    def execute_with_failover(self, orm_execute_state):
+        """ Executes a statement sent to a replica, retried on the primary when the replica fails, e.g. to connect
+
+        :param orm_execute_state: The :class: `ORMExecuteState` of the statement
+        :return: The result of the statement, None when the statement is not sent to a replica
+        """
+        if orm_execute_state.bind_arguments.get("bind") is not None:
+            return None
+        replica = self.get_replica(orm_execute_state.statement)
+        if replica is None:
+            return None
+
+        try:
+            return orm_execute_state.invoke_statement()
+        except CONNECT_ERRORS as e:
+            # a failed statement, e.g. invalid or timed out, would fail or be as slow on the primary
+            if not is_connection_error(e):
+                raise
+            # the errors of the DBAPI leave the replica out from the error listener, unlike those of the socket
+            if not isinstance(e, exc.DBAPIError):
+                self.replicas.mark_down(engine=replica, e=e)
+            logger.warning(f"Read of database replica {replica.url!r} retried on the primary")
+            # the next reads of the session go to another replica
+            self.replica = None
+            return orm_execute_state.invoke_statement(bind_arguments={"bind": super(RoutingSession, self).get_bind()})
+
+
+class RoutingAsyncSession(AsyncSession):
+
+    def __init__(self, bind=None, replicas=None, **kwargs):
+        """ Construct a new :class: `RoutingAsyncSession`
+
+        :class: `AsyncSession` proxying a :class: `RoutingSession`.
+
+        :param bind: The primary asyncio engine
+        :param replicas: The :class: `Replicas` of the session
+        """
+        super(RoutingAsyncSession, self).__init__(bind=bind, **kwargs)
+        # the proxied session is replaced, the installed SQLAlchemy having no `sync_session_class` argument
+        self.sync_session = self._proxied = self._assign_proxied(
+            RoutingSession(bind=self.sync_session.bind, replicas=replicas, future=True, **kwargs)
+        )
+
+
+def is_read(clause):
+    """ Whether a statement only reads, that is a SELECT statement without a `FOR UPDATE` clause """
+    return getattr(clause, "is_select", False) and getattr(clause, "_for_update_arg", None) is None
+
+
+class QueryStats(object):
+
+    def __init__(self):
+        """ Construct a new :class: `QueryStats`
+
+        The number and the cumulative duration of the statements of a request, and the number of executions of every
+        SELECT statement, where a statement executed once per row of a previous result is likely an N+1 query, e.g.
+        a relationship lazy load.
+        """
+        self.count = 0
+        self.duration = 0.0
+        self.selects = Counter()
+
+    def record(self, statement, duration):
+        self.count += 1
+        self.duration += duration
+        if statement.startswith("SELECT"):
+            self.selects[statement] += 1
+
+    def get_repeated_selects(self, threshold):
+        """ Returns the SELECT statements executed at least `threshold` times, with their number of executions """
+        return [(statement, count) for statement, count in self.selects.most_common() if count >= threshold]
+
+
+def redact(parameters):
+    """ Returns the statement parameters with every value replaced by its type, e.g. `{"username_1": "<str>"}` """
+    if isinstance(parameters, dict):
+        return {key: redact(value) for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [redact(value) for value in parameters]
+    return f"<{type(parameters).__name__}>"
+
+
+class TimedQueuePool(QueuePool):
+    """ Queue pool recording how long every checkout took in `venom_database_pool_checkout_seconds` """
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            return super(TimedQueuePool, self).connect()
+        finally:
+            metrics.database_pool_checkout_seconds.observe(time.perf_counter() - start)
+
+
+class TimedAsyncAdaptedQueuePool(AsyncAdaptedQueuePool):
+    """ Asyncio queue pool recording how long every checkout took in `venom_database_pool_checkout_seconds` """
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            return super(TimedAsyncAdaptedQueuePool, self).connect()
+        finally:
+            metrics.database_pool_checkout_seconds.observe(time.perf_counter() - start)
+
+
+TIMED_POOL_CLASSES = {
+    QueuePool: TimedQueuePool,
+    AsyncAdaptedQueuePool: TimedAsyncAdaptedQueuePool
+}
+
+
+class LazySession(object):
+
+    def __init__(self, factory, count_lazy_loads=False, read_only=False):
+        """ Construct a new :class: `LazySession`
+
+        Holds the database session of a single request, which is only created (and checks out a pool connection)
+        on first use through :func: `get_db`.
+
+        :param factory: The session factory used to create the session on first use
+        :param count_lazy_loads: Whether the relationship lazy loads of the session are counted in :attr: `lazy_loads`
+        :param read_only: Whether the reads of the session may be sent to the read replicas, see `RoutingSession`
+        """
+        self.factory = factory
+        self.session = None
+        self.count_lazy_loads = count_lazy_loads
+        self.read_only = read_only
+        self.lazy_loads = Counter()
+
+    def get(self):
+        """ Returns the session, created on first use """
+        if self.session is None:
+            self.session = self.factory()
+            self.session.info["read_only"] = self.read_only
+            if self.count_lazy_loads:
+                self.session.info["lazy_loads"] = self.lazy_loads
+        return self.session
+
+    async def commit(self):
+        """ Commits the session if it was ever opened and holds any changes, rolling back on database errors """
+        if self.session is None or not has_changes(self.session):
+            return
+
+        try:
+            await resolve(self.session.commit())
+        except exc.DatabaseError as e:
+            logger.exception(e)
+            await resolve(self.session.rollback())
+
+    async def close(self, commit=True):
+        """ Commits the session if it holds any changes and closes it, when it was ever opened
+
+        :param commit: Whether changes should be committed, otherwise they are discarded by closing the session
+        """
+        if self.session is None:
+            return
+
+        try:
+            if commit:
+                await self.commit()
+        finally:
+            await resolve(self.session.close())
+            self.session = None
+
+
+def has_changes(session):
+    """ Checks whether the session holds pending or flushed, but not yet committed, changes """
+    session = getattr(session, "sync_session", session)
+    return bool(session.new or session.dirty or session.deleted or session.info.get("has_writes"))
+
+
+@event.listens_for(Session, "after_flush")
+def on_session_flush(session, flush_context):
+    session.info["has_writes"] = True
+    # read from the primary from then on, see `RoutingSession`
+    session.info["primary"] = True
+
+
+@event.listens_for(Session, "do_orm_execute")
+def on_session_execute(orm_execute_state):
+    if not orm_execute_state.is_select:
+        orm_execute_state.session.info["has_writes"] = True
+        orm_execute_state.session.info["primary"] = True
+
+    # a lazy load, rather than an eager load, of a relationship, which is emitted once per parent object
+    lazy_loads = orm_execute_state.session.info.get("lazy_loads")
+    if lazy_loads is not None and orm_execute_state.lazy_loaded_from is not None:
+        lazy_loads[str(orm_execute_state.loader_strategy_path[-1])] += 1
+
+    if isinstance(orm_execute_state.session, RoutingSession):
+        return orm_execute_state.session.execute_with_failover(orm_execute_state)
+
+
+@event.listens_for(Session, "after_transaction_end")
+def on_session_transaction_end(session, transaction):
+    if transaction.parent is None:
+        session.info.pop("has_writes", None)
+
+
+async def get_db(request: Request):
+    """ Returns current session database object per request, created on first use """
+    return request.state.lazy_session.get()
+
+
+async def run_sync(db, fn):
+    """ Runs `fn(session)` against the given session object
+
+    Legacy `Query` usage and relationship lazy loads only work with a synchronous session. When `db` is an
+    :class: `AsyncSession` the callable runs through `AsyncSession.run_sync`, so the statements it emits are
+    awaited on the asyncio driver instead of blocking the event loop.
+    """
+    if isinstance(db, AsyncSession):
+        return await db.run_sync(fn)
+    return fn(db)
+
+
+async def resolve(result):
+    """ Awaits the result of a session call when the session is an :class: `AsyncSession` """
+    if inspect.isawaitable(result):
+        return await result
+    return result
+
+
+async def iterate(iterable):
+    """ Iterates the result of a session call, asynchronously when the session is an :class: `AsyncSession` """
+    if hasattr(iterable, "__aiter__"):
+        async for item in iterable:
+            yield item
+    else:
+        for item in iterable:
+            yield item
@@ -0,0 +1,114 @@
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# the folders holding the application files, rather than the whole working directory with its logs, virtualenvs etc.
+ROOTS = ["core", "api", "conf"]
+FILENAMES = ["configs.yml", "messages.ini", "pytest.ini", "api.py", "tests.py"]
+# folders that are discovered but never walked into
+FOLDERS = ["templates", "migrations"]
+MANIFEST_VERSION = 1
+
+
+class Discovery(object):
+
+    def __init__(self, roots=None, manifest_path=None):
+        """ Construct a new :class: `Discovery`
+
+        Finds the configurations, messages, API routers, templates, migrations and tests of the application in a
+        single walk of the roots. With a manifest the result of the walk is saved to the manifest file and reused
+        by the following startups, as long as none of the walked folders has been modified since, i.e. had files
+        or folders added, removed or renamed in it.
+
+        :param roots: The folders to walk, defaults to :data: `ROOTS`
+        :param manifest_path: The manifest file path, the roots are walked on every startup when None
+        """
+        self.roots = roots if roots is not None else ROOTS
+        self.manifest_path = manifest_path
+        # discovered paths per file and folder name, in walk order
+        self.paths = dict()
+        # modification times of the walked folders, in nanoseconds
+        self.mtimes = dict()
+        self.from_manifest = False
+
+        if self.manifest_path and self.load_manifest():
+            self.from_manifest = True
+            return
+
+        self.walk()
+        if self.manifest_path:
+            self.save_manifest()
+
+    def find(self, name, packages=None):
+        """ Returns the discovered paths of the files or folders with the name
+
+        :param name: The file or folder name, one of :data: `FILENAMES` or :data: `FOLDERS`
+        :param packages: The packages the paths must be within, all the discovered paths when None
+        """
+        paths = self.paths.get(name, [])
+        if packages is None:
+            return list(paths)
+
+        packages = [os.path.normpath(package) for package in packages]
+        return [path for path in paths if any(path.startswith(package + os.path.sep) for package in packages)]
+
+    def walk(self):
+        self.paths = {name: [] for name in FILENAMES + FOLDERS}
+        self.mtimes = dict()
+
+        for root_folder in self.roots:
+            for root, dirs, files in os.walk(root_folder):
+                self.mtimes[root] = os.stat(root).st_mtime_ns
+
+                # sorted for the same configuration overrides order on every file system
+                dirs.sort()
+                for directory in list(dirs):
+                    if directory in FOLDERS:
+                        self.paths[directory].append(os.path.join(root, directory))
+                        dirs.remove(directory)
+                    elif directory.startswith(".") or directory == "__pycache__":
+                        dirs.remove(directory)
+
+                for filename in sorted(files):
+                    if filename in self.paths:
+                        self.paths[filename].append(os.path.join(root, filename))
+
+    def load_manifest(self):
+        """ Loads the paths of the manifest, returns False when it is missing or out of date """
+        try:
+            with open(self.manifest_path) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return False
+
+        if manifest.get("version") != MANIFEST_VERSION or manifest.get("roots") != self.roots:
+            return False
+
+        for folder, mtime in manifest["mtimes"].items():
+            try:
+                if os.stat(folder).st_mtime_ns != mtime:
+                    return False
+            except OSError:
+                return False
+
+        self.paths = manifest["paths"]
+        self.mtimes = manifest["mtimes"]
+        return True
+
+    def save_manifest(self):
+        manifest = dict(version=MANIFEST_VERSION, roots=self.roots, paths=self.paths, mtimes=self.mtimes)
+        try:
+            # written aside and renamed, so that concurrent startups never read a partial manifest
+            temp_path = f"{self.manifest_path}.{os.getpid()}"
+            with open(temp_path, "w") as f:
+                json.dump(manifest, f)
+            os.replace(temp_path, self.manifest_path)
+        except OSError as e:
+            logger.warning(f"Discovery manifest \"{self.manifest_path}\" not saved: {e}")
+
+
+def to_package(path):
+    """ Returns the package of a path, e.g. `core.api.users` for `core/api/users/api.py` """
+    return os.path.dirname(path).replace(os.path.sep, ".").strip(".")
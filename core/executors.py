@@ -0,0 +1,102 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+
+class ExecutorBusyException(Exception):
+
+    def __init__(self, detail):
+        self.detail = detail
+        super(ExecutorBusyException, self).__init__(self.detail)
+
+
+class BoundedProcessPoolExecutor(object):
+
+    def __init__(self, max_workers=None, max_pending=None, timeout=None):
+        """ Construct a new :class: `BoundedProcessPoolExecutor`
+
+        Runs CPU bound callables in a pool of worker processes and awaits their results, so the event loop is
+        never blocked by them. Worker processes are spawned on first use and import only the module of the callable.
+
+        :param max_workers: The number of worker processes, defaults to the number of CPUs.
+                            With 0 the callables run inline on the calling thread
+        :param max_pending: The maximum number of submitted and not yet finished tasks, unlimited when None
+        :param timeout: The number of seconds to wait for the result of a task, unlimited when None
+        """
+        self.max_workers = os.cpu_count() if max_workers is None else max_workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.pending = 0
+        self._lock = threading.Lock()
+        self._executor = None
+
+    async def run(self, fn, *args):
+        """ Runs `fn(*args)` in a worker process and returns its result
+
+        :raises ExecutorBusyException: When the pending tasks limit is reached, the result is not ready in time or
+                                       a worker process died
+        """
+        if not self.max_workers:
+            return fn(*args)
+
+        with self._lock:
+            if self.max_pending is not None and self.pending >= self.max_pending:
+                raise ExecutorBusyException(f"Executor has reached the limit of {self.max_pending} pending tasks")
+            self.pending += 1
+
+        try:
+            executor, future = self._submit(fn, *args)
+        except BrokenProcessPool:
+            self._on_done(None)
+            raise ExecutorBusyException("Executor worker processes could not be started")
+        except Exception:
+            self._on_done(None)
+            raise
+
+        future.add_done_callback(self._on_done)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            raise ExecutorBusyException(f"Executor task did not complete within {self.timeout} seconds")
+        except BrokenProcessPool:
+            # a worker process died while running the task, the pool is recreated on next use
+            self._discard(executor=executor)
+            raise ExecutorBusyException("Executor worker process died before completing the task")
+
+    def shutdown(self, wait=True):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+            self._executor = None
+
+    def _submit(self, fn, *args):
+        executor = self._get_executor()
+        try:
+            return executor, executor.submit(fn, *args)
+        except BrokenProcessPool:
+            # a worker process died while the pool was idle, e.g. killed by the OOM killer, retried once on a new pool
+            self._discard(executor=executor)
+            executor = self._get_executor()
+            return executor, executor.submit(fn, *args)
+
+    def _discard(self, executor):
+        if executor is None:
+            return
+        executor.shutdown(wait=False)
+        if self._executor is executor:
+            self._executor = None
+
+    def _get_executor(self):
+        if self._executor is None:
+            # spawned processes do not inherit the event loop, threads or database connections of the parent
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._executor
+
+    def _on_done(self, future):
+        with self._lock:
+            self.pending -= 1
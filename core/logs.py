@@ -1,7 +1,12 @@
+import atexit
+import copy
+import json
 import logging
 import logging.handlers
 import os
 import sys
+from datetime import datetime
+from queue import SimpleQueue
 
 from core import venom
 
@@ -9,12 +14,19 @@ from core import venom
 class Logger(object):
 
     def __init__(self):
+        """ Construct a new :class: `Logger`
+
+        Records are put on a queue by the logging threads, e.g. the event loop thread, and formatted and written to
+        stdout and the rotating log file by a listener thread, so that logging never waits for the disk. Configured by
+        `core.logs.*`.
+        """
         self.fmt = "%(asctime)s - %(levelname)s - %(message)s"
         self.level = logging.INFO
         self.date_fmt = "%Y-%m-%d %H:%M:%S"
         self.max_bytes = 10485760
         self.backup_count = 20
-        self.log_filename = "venom.log"
+        self.log_filename = venom.cfg["core.logs.filename"]
+        self.listeners = []
 
         # create logs directory
         logs_folder_path = venom.cfg["core.logs.folder_path"]
@@ -30,7 +42,90 @@ class Logger(object):
         )
         self.handlers = [self.stream_handler, self.rotating_file_handler]
 
-    def configure(self):
-        config = dict(level=self.level, format=self.fmt, datefmt=self.date_fmt, handlers=self.handlers)
-        logging.basicConfig(**config)
+        if venom.cfg["core.logs.format"] == "json":
+            formatter = JSONFormatter()
+        else:
+            formatter = logging.Formatter(fmt=self.fmt, datefmt=self.date_fmt)
+        for handler in self.handlers:
+            handler.setFormatter(formatter)
+
+    def configure(self, queue=None):
+        """ Routes the records of the process through a queue
+
+        :param queue: The multiprocessing queue the records are sent to, to be written by the process listening to it,
+                      e.g. by the main process for its workers. The records are written by this process when None
+        """
+        if queue is None:
+            queue = self.listen(queue=SimpleQueue())
+            handler = QueueHandler(queue)
+        else:
+            handler = QueueHandler(queue, serialize=True)
+
+        root = logging.getLogger()
+        for previous_handler in list(root.handlers):
+            root.removeHandler(previous_handler)
+        root.addHandler(handler)
+        root.setLevel(self.level)
         return self
+
+    def listen(self, queue):
+        """ Writes the records of the queue, e.g. sent by other processes, until the process exits """
+        if not self.listeners:
+            # the records still queued are written before the interpreter exits
+            atexit.register(self.stop)
+
+        listener = logging.handlers.QueueListener(queue, *self.handlers, respect_handler_level=True)
+        listener.start()
+        self.listeners.append(listener)
+        return queue
+
+    def stop(self):
+        """ Writes the records still queued and stops the listener threads """
+        while self.listeners:
+            self.listeners.pop().stop()
+
+
+class QueueHandler(logging.handlers.QueueHandler):
+
+    def __init__(self, queue, serialize=False):
+        """ Construct a new :class: `QueueHandler`
+
+        :param queue: The queue the records are put on
+        :param serialize: Whether the records are sent to another process, which requires their traceback to be
+                          formatted by this process since it is not picklable
+        """
+        super(QueueHandler, self).__init__(queue)
+        self.serialize = serialize
+
+    def prepare(self, record):
+        # the message is merged with its arguments on the logging thread, while they still have the state they were
+        # logged with, only the formatter and the I/O are left to the listener thread
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if self.serialize and record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class JSONFormatter(logging.Formatter):
+    """ Formats the records as JSON lines, with the fields of the access log records, see `HTTPMiddleware` """
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+
+        access = getattr(record, "access", None)
+        if access:
+            entry.update(access)
+
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
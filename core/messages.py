@@ -1,29 +1,29 @@
-import os
 from configparser import ConfigParser
 
+from core.discovery import Discovery, to_package
+
 
 class Messages(object):
 
-    def __init__(self):
+    def __init__(self, paths=None):
+        """ Construct a new :class: `Messages`
+
+        :param paths: The `messages.ini` paths of the packages, discovered when None
+        """
         self.section = "default"
         self.messages = dict()
         config = ConfigParser()
 
-        for root, dirs, files in os.walk("."):
-            for filename in files:
-                if filename != "messages.ini":
-                    continue
-
-                filepath = os.path.join(root, filename)
-                config.read(filepath)
+        for path in paths if paths is not None else Discovery().find("messages.ini"):
+            config.read(path)
 
-                if not config.has_section(section=self.section):
-                    continue
+            if not config.has_section(section=self.section):
+                continue
 
-                package = root.replace(os.path.sep, ".").strip(".")
-                configs = config._sections[self.section]
-                for k, v in configs.items():
-                    self.messages[f"{package}.{k}"] = v
+            package = to_package(path)
+            configs = config._sections[self.section]
+            for k, v in configs.items():
+                self.messages[f"{package}.{k}"] = v
 
     def __getitem__(self, key):
         return self.messages[key]
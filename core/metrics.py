@@ -0,0 +1,391 @@
+import asyncio
+import bisect
+import glob
+import json
+import logging
+import os
+
+from core.caches import caches
+
+logger = logging.getLogger(__name__)
+
+# the folder of the metrics snapshots of the worker processes, set by the main process of a multi-worker server
+FOLDER_ENV = "VENOM_METRICS_FOLDER"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# seconds, the default buckets of the Prometheus clients
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0)
+
+
+class Registry(object):
+
+    def __init__(self):
+        """ Construct a new :class: `Registry`
+
+        Holds the metrics of the process. Hooks run before every collection, e.g. to read the pool statistics, and
+        collectors run only when the metrics are exposed, e.g. to count the rows of a table once for all the
+        processes.
+        """
+        self.metrics = dict()
+        self.hooks = []
+        self.collectors = []
+
+    def register(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric `{metric.name}` is already registered")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def add_hook(self, fn):
+        """ Registers `fn()`, called before every collection of the metrics """
+        self.hooks.append(fn)
+        return fn
+
+    def add_collector(self, fn):
+        """ Registers the coroutine function `fn(db)`, returning the metrics to expose along the registered ones """
+        self.collectors.append(fn)
+        return fn
+
+    def collect(self):
+        """ Returns the snapshot of the metrics of the process """
+        for hook in self.hooks:
+            try:
+                hook()
+            except Exception as e:
+                logger.exception(e)
+        return {name: metric.collect() for name, metric in self.metrics.items()}
+
+
+REGISTRY = Registry()
+
+
+class Metric(object):
+    type = None
+
+    def __init__(self, name, documentation, labels=(), registry=REGISTRY):
+        """ Construct a new :class: `Metric`
+
+        Values are recorded without locks, a child per combination of label values is created on first use and
+        only holds plain numbers, so that recording is cheap enough for every request.
+
+        :param name: The metric name
+        :param documentation: The metric help text
+        :param labels: The label names, given their values in order by :func: `labels`
+        :param registry: The registry of the metric, unregistered when None, e.g. for the metrics of a collector
+        """
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self.children = dict()
+        if registry is not None:
+            registry.register(self)
+
+    def labels(self, *values):
+        child = self.children.get(values)
+        if child is None:
+            if len(values) != len(self.label_names):
+                raise ValueError(f"Metric `{self.name}` expects the labels {', '.join(self.label_names)}")
+            child = self.children.setdefault(values, self.create_child())
+        return child
+
+    def create_child(self):
+        raise NotImplementedError
+
+    def collect(self):
+        return dict(
+            type=self.type,
+            help=self.documentation,
+            labels=list(self.label_names),
+            samples=[[list(values), child.get()] for values, child in list(self.children.items())]
+        )
+
+
+class Value(object):
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def set(self, value):
+        self.value = value
+
+    def get(self):
+        return self.value
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def create_child(self):
+        return Value()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def create_child(self):
+        return Value()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def dec(self, amount=1):
+        self.labels().dec(amount)
+
+    def set(self, value):
+        self.labels().set(value)
+
+
+class HistogramValue(object):
+    __slots__ = ("buckets", "counts", "sum")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # one count per bucket and one for the values above the last bucket, cumulated when exposed
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def get(self):
+        return [list(self.counts), self.sum]
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS, registry=REGISTRY):
+        """ Construct a new :class: `Histogram`
+
+        :param buckets: The sorted upper bounds of the buckets, the +Inf bucket is implicit
+        """
+        self.buckets = tuple(sorted(buckets))
+        super(Histogram, self).__init__(name, documentation, labels=labels, registry=registry)
+
+    def create_child(self):
+        return HistogramValue(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def collect(self):
+        collected = super(Histogram, self).collect()
+        collected["buckets"] = list(self.buckets)
+        return collected
+
+
+http_requests_in_flight = Gauge(
+    "venom_http_requests_in_flight", "HTTP requests being handled"
+)
+http_request_duration_seconds = Histogram(
+    "venom_http_request_duration_seconds", "HTTP requests duration by route and status",
+    labels=["method", "route", "status"]
+)
+database_pool_checkout_seconds = Histogram(
+    "venom_database_pool_checkout_seconds", "Time waiting for a pooled database connection, or for opening a new one"
+)
+database_pool_size = Gauge(
+    "venom_database_pool_size", "Connections kept open by the database pool"
+)
+database_pool_checked_out = Gauge(
+    "venom_database_pool_checked_out", "Database connections in use"
+)
+database_pool_overflow = Gauge(
+    "venom_database_pool_overflow", "Database connections opened above the pool size"
+)
+cache_hits = Counter(
+    "venom_cache_hits_total", "Cache lookups served from the cache", labels=["cache"]
+)
+cache_misses = Counter(
+    "venom_cache_misses_total", "Cache lookups missing from the cache", labels=["cache"]
+)
+cache_entries = Gauge(
+    "venom_cache_entries", "Entries held by the cache", labels=["cache"]
+)
+
+
+@REGISTRY.add_hook
+def collect_database_pool():
+    from core import venom
+
+    if venom.database is None:
+        return
+
+    pool = getattr(venom.database.engine, "sync_engine", venom.database.engine).pool
+    # only queue pools keep connections, e.g. not the NullPool of file SQLite databases
+    if not hasattr(pool, "checkedout"):
+        return
+
+    database_pool_size.set(pool.size())
+    database_pool_checked_out.set(pool.checkedout())
+    database_pool_overflow.set(max(pool.overflow(), 0))
+
+
+@REGISTRY.add_hook
+def collect_caches():
+    for name, cache in list(caches.items()):
+        cache_hits.labels(name).set(cache.hits)
+        cache_misses.labels(name).set(cache.misses)
+        cache_entries.labels(name).set(len(cache))
+
+
+def get_folder_path():
+    return os.environ.get(FOLDER_ENV)
+
+
+def reset_folder(folder_path):
+    """ Creates the snapshots folder, or removes the snapshots of a previous run from it """
+    os.makedirs(folder_path, exist_ok=True)
+    for path in glob.glob(os.path.join(folder_path, "*.json")):
+        os.remove(path)
+
+
+def write_snapshot(folder_path, snapshot=None):
+    """ Writes the snapshot of the metrics of the process to the folder, replacing its previous snapshot """
+    snapshot = REGISTRY.collect() if snapshot is None else snapshot
+    path = os.path.join(folder_path, f"{os.getpid()}.json")
+    # written aside and renamed, so that the other processes never read a partial snapshot
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w") as f:
+        json.dump(snapshot, f)
+    os.replace(temp_path, path)
+
+
+async def write_snapshots_periodically(folder_path, interval):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            write_snapshot(folder_path)
+        except Exception as e:
+            logger.exception(e)
+
+
+def read_snapshots(folder_path):
+    """ Returns the snapshots of the folder by process id """
+    snapshots = dict()
+    for path in glob.glob(os.path.join(folder_path, "*.json")):
+        try:
+            with open(path) as f:
+                snapshots[int(os.path.basename(path)[:-len(".json")])] = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Metrics snapshot \"{path}\" skipped: {e}")
+    return snapshots
+
+
+def merge(snapshots):
+    """ Merges the snapshots of the processes by process id into a single snapshot
+
+    Counters and histograms are summed over all the processes, those that exited included, so that they never
+    decrease. Gauges are summed over the running processes only, e.g. the requests in flight of every worker.
+    """
+    merged = dict()
+    for pid, snapshot in snapshots.items():
+        running = None
+        for name, metric in snapshot.items():
+            if metric["type"] == "gauge":
+                running = is_running(pid) if running is None else running
+                if not running:
+                    continue
+
+            merged_metric = merged.setdefault(name, dict(metric, samples=dict()))
+            samples = merged_metric["samples"]
+            for values, value in metric["samples"]:
+                key = tuple(values)
+                if key not in samples:
+                    samples[key] = value
+                elif metric["type"] == "histogram":
+                    counts, total = samples[key]
+                    samples[key] = [[a + b for a, b in zip(counts, value[0])], total + value[1]]
+                else:
+                    samples[key] += value
+
+    for metric in merged.values():
+        metric["samples"] = [[list(key), value] for key, value in metric["samples"].items()]
+    return merged
+
+
+def is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+async def generate(db=None, folder_path=None):
+    """ Returns the metrics in the Prometheus text format
+
+    :param db: The session of the collectors, the collectors are skipped when None
+    :param folder_path: The snapshots folder of the worker processes, merged with the metrics of the process,
+                        only the metrics of the process are exposed when None
+    """
+    snapshot = REGISTRY.collect()
+    if folder_path:
+        # the live metrics of the process rather than its last snapshot
+        snapshots = read_snapshots(folder_path)
+        snapshots[os.getpid()] = snapshot
+        snapshot = merge(snapshots)
+
+    if db is not None:
+        for collector in REGISTRY.collectors:
+            try:
+                for metric in await collector(db):
+                    snapshot[metric.name] = metric.collect()
+            except Exception as e:
+                logger.exception(e)
+
+    return render(snapshot)
+
+
+def render(snapshot):
+    lines = []
+    for name, metric in sorted(snapshot.items()):
+        if not metric["samples"]:
+            continue
+
+        lines.append(f"# HELP {name} {escape(metric['help'], quote=False)}")
+        lines.append(f"# TYPE {name} {metric['type']}")
+
+        for values, value in sorted(metric["samples"]):
+            labels = list(zip(metric["labels"], values))
+            if metric["type"] != "histogram":
+                lines.append(f"{name}{format_labels(labels)} {format_value(value)}")
+                continue
+
+            counts, total = value
+            cumulative = 0
+            for bound, count in zip(metric["buckets"] + ["+Inf"], counts):
+                cumulative += count
+                le = bound if bound == "+Inf" else format_value(bound)
+                lines.append(f"{name}_bucket{format_labels(labels + [('le', le)])} {cumulative}")
+            lines.append(f"{name}_sum{format_labels(labels)} {format_value(total)}")
+            lines.append(f"{name}_count{format_labels(labels)} {cumulative}")
+    return "\n".join(lines) + "\n"
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f"{name}=\"{escape(value)}\"" for name, value in labels) + "}"
+
+
+def format_value(value):
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+def escape(value, quote=True):
+    value = str(value).replace("\\", "\\\\").replace("\n", "\\n")
+    return value.replace("\"", "\\\"") if quote else value
@@ -1,50 +1,177 @@
+import base64
+import binascii
 import json
-from datetime import datetime
-from operator import and_
+from collections import namedtuple
+from datetime import datetime, date, timezone
+from decimal import Decimal
 
-from fastapi import Request
-from sqlalchemy import Column, Integer, DateTime, text, or_, cast, String
+from fastapi import Request, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy import Column, Integer, DateTime, or_, and_, cast, String, tuple_, false, func, text
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import Session, selectinload, joinedload, subqueryload, lazyload, raiseload, noload
+
+from core.caches import TTLCache
+from core.database import iterate
 
 
 class Model(object):
     __tablename__ = None
+    # named loader strategies of relationship paths, e.g. {"roles": {"_roles": "selectin", "_roles.role": "joined"}}
+    __loading_profiles__ = {}
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     created_on = Column(DateTime, default=datetime.utcnow)
     updated_on = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    loader_strategies = {
+        "selectin": selectinload,
+        "joined": joinedload,
+        "subquery": subqueryload,
+        "lazy": lazyload,
+        "raise": raiseload,
+        "noload": noload
+    }
+
     @classmethod
     def get_table_name(cls):
         return cls.__tablename__
 
+    @classmethod
+    def get_loading_options(cls, profile: str = None):
+        """ Returns the loader options of a loading profile of the model, to pass to `Query.options`
+
+        Every relationship path of the profile is loaded with its strategy, and so is every path it goes through,
+        e.g. `_roles.role` needs `_roles` in the same profile. Collections streamed with `yield_per` must be loaded
+        with the `selectin` strategy.
+
+        :param profile: The name of the loading profile, none keeps the loader strategies of the relationships
+        """
+        if profile is None:
+            return []
+
+        strategies = cls.__loading_profiles__[profile]
+        options = []
+        for path, strategy in strategies.items():
+            option, entity, keys = None, cls, path.split(".")
+            for i, key in enumerate(keys):
+                attribute = getattr(entity, key)
+                loader = cls.loader_strategies[strategies[".".join(keys[:i + 1])]]
+                option = getattr(option, loader.__name__)(attribute) if option else loader(attribute)
+                entity = attribute.property.mapper.class_
+            options.append(option)
+        return options
+
 
 Model = declarative_base(cls=Model)
 
 
+QueryPlan = namedtuple("QueryPlan", ["filters", "sort", "expressions", "sort_keys"])
+
+
+def escape_like(value, escape="\\"):
+    """ Escapes the wildcards of a value matched with LIKE """
+    return value.replace(escape, escape * 2).replace("%", escape + "%").replace("_", escape + "_")
+
+
 class QueryExecutor(object):
+    _operators = {
+        # case insensitive substring match, served by a trigram index on postgresql
+        "contains": lambda c, v: c.ilike(f"%{escape_like(v)}%", escape="\\"),
+        # prefix match, served by a btree index
+        "startswith": lambda c, v: c.like(f"{escape_like(v)}%", escape="\\"),
+        "eq": lambda c, v: c == v,
+        "neq": lambda c, v: c != v,
+        "gt": lambda c, v: c > v,
+        "ge": lambda c, v: c >= v,
+        "lt": lambda c, v: c < v,
+        "le": lambda c, v: c <= v
+    }
+    _text_operators = {"contains", "startswith"}
+    filters_logic_map = {"or": or_, "and": and_}
+
+    # compiled filters and sort keys of the most recently used query parameters
+    plan_cache = TTLCache(max_size=256, name="query_plans")
+
+    # the minimum number of rows of a table for its planner estimate to be used instead of an exact count
+    estimated_count_threshold = 100000
+
+    stream_batch_size = 1000
+    _stream_media_types = {"ndjson": "application/x-ndjson", "json": "application/json"}
+
+    def __init__(self, request: Request, query, mapper=None, response: Response = None, profile: str = None):
+        """ Construct a new :class: `QueryExecutor`
 
-    def __init__(self, request: Request, query, mapper=None):
+        Applies the `filters`, `sort`, `limit` and `offset` query parameters of the request to the query.
+        With a `cursor` query parameter, empty for the first page, pages are fetched by seeking past the sort key
+        values of the previous page instead of an offset, and the cursor of the next page is set to
+        :attr: `next_cursor` and the `X-Next-Cursor` header of the response, when given.
+        With a `count` query parameter of `exact` or `estimate` the total number of filtered rows is set to
+        :attr: `total_count` and the `X-Total-Count` header of the response, when given.
+
+        :param request: The current request
+        :param query: The query to execute
+        :param mapper: The mapped class the query parameters refer to, defaults to the first entity of the query
+        :param response: The response to set the `X-Next-Cursor` and `X-Total-Count` headers to
+        :param profile: The loading profile of the mapped class to load the relationships of the rows with
+        """
         self.request = request
         self.query = query
+        self.response = response
         self.mapper = mapper if mapper else self._get_cls_mapper()
+
+        if profile:
+            self.query = self.query.options(*self.mapper.get_loading_options(profile))
         self.limit = self._process_limit()
         self.offset = self._process_offset()
-        self.sort = self._process_sort()
-        self.filters = self._process_filters()
-        self._operators = {
-            "contains": lambda c, v: c.ilike(f"%%{v}%%"),
-            "eq": lambda c, v: c == v,
-            "neq": lambda c, v: c != v,
-            "gt": lambda c, v: c > v,
-            "ge": lambda c, v: c >= v,
-            "lt": lambda c, v: c < v,
-            "le": lambda c, v: c <= v
-        }
-        self.filters_logic_map = {"or": or_, "and": and_}
-
-        if self.filters:
-            for obj in self.filters:
+        self.cursor = self._process_cursor()
+        self.next_cursor = None
+        self.count = self._process_count()
+        self.total_count = None
+
+        plan = self._get_plan()
+        self.filters = plan.filters
+        self.sort = plan.sort
+        self.sort_keys = list(plan.sort_keys)
+        self.is_filtered = bool(plan.expressions) or self.query.whereclause is not None
+
+        for expression in plan.expressions:
+            self.query = self.query.filter(expression)
+
+        # the filtered rows, before they are ordered and paged
+        self.count_query = self.query
+
+        if self.cursor is None:
+            for field, column, direction in self.sort_keys:
+                self.query = self.query.order_by(column.asc() if direction == "asc" else column.desc())
+
+            if self.limit:
+                self.query = self.query.limit(self.limit)
+
+            if self.offset:
+                self.query = self.query.offset(self.offset)
+        else:
+            self._apply_cursor()
+
+    def _get_plan(self):
+        filters = self.request.query_params.get("filters")
+        sort = self.request.query_params.get("sort")
+
+        key = (self.mapper, filters, sort)
+        plan = self.plan_cache.get(key)
+        if plan is None:
+            plan = self._compile_plan(filters=filters, sort=sort)
+            self.plan_cache.set(key, plan)
+        return plan
+
+    def _compile_plan(self, filters, sort):
+        filters = json.loads(filters) if filters else None
+        sort = json.loads(sort) if sort else None
+        plan = QueryPlan(filters=filters, sort=sort, expressions=[], sort_keys=[])
+
+        if filters:
+            for obj in filters:
                 logic = obj.get("logic")
                 expressions = []
 
@@ -53,45 +180,118 @@ class QueryExecutor(object):
                     value = f.get("value")
                     operator = f.get("operator")
 
-                    if not value:
+                    if value is None or value == "":
                         continue
 
                     if operator not in self._operators:
                         raise KeyError(f"Expression `{attr_name}` has incorrect operator `{operator}`")
 
-                    if not hasattr(self.mapper, attr_name):
-                        raise KeyError(f"Expression `{attr_name}` does not exist in class mapper `{repr(self.mapper)}`")
+                    column = self._get_column(attr_name)
+                    if operator in self._text_operators:
+                        if self._get_python_type(column) is not str:
+                            column = cast(column, String)
+                        value = str(value)
+                    else:
+                        value = self._coerce_value(column, value, field=attr_name)
 
-                    column = cast(getattr(self.mapper, attr_name), String)
-                    filter_query = self._operators[operator](column, value)
-                    expressions.append(filter_query)
+                    expressions.append(self._operators[operator](column, value))
 
                 if expressions and logic:
                     logic_func = self.filters_logic_map[logic]
-                    self.query = self.query.filter(logic_func(*expressions))
+                    plan.expressions.append(logic_func(*expressions))
 
-        if self.sort:
-            for sort in self.sort:
-                direction = sort.get("dir")
-                field = sort.get("field")
+        if sort:
+            for obj in sort:
+                direction = obj.get("dir")
+                field = obj.get("field")
 
                 if not direction or not field:
                     continue
 
-                self.query = self.query.order_by(text(f"{field} {direction}"))
+                if direction not in ("asc", "desc"):
+                    raise KeyError(f"Sort `{field}` has incorrect direction `{direction}`")
 
-        if self.limit:
-            self.query = self.query.limit(self.limit)
+                plan.sort_keys.append((field, self._get_column(field), direction))
 
-        if self.limit:
-            self.query = self.query.offset(self.offset)
+        return plan
 
     def all(self):
-        return self.query.all()
+        total_count = None
+        if self.count == "exact" and self.cursor is None:
+            # the total is counted along with the page, over the filtered rows before the limit applies
+            is_single_entity = self._is_single_entity()
+            results = self.query.add_columns(func.count().over().label("total_count")).all()
+            rows = [result[0] if is_single_entity else tuple(result[:-1]) for result in results]
+            total_count = results[0][-1] if results else None
+        else:
+            rows = self.query.all()
+
+        if self.cursor is not None and self.limit and len(rows) > self.limit:
+            rows = rows[:self.limit]
+            self.next_cursor = self._encode_cursor(rows[-1])
+            if self.response is not None:
+                self.response.headers["X-Next-Cursor"] = self.next_cursor
+
+        if self.count != "none":
+            # pages of a cursor, or past the last row, are counted with a separate query
+            self.total_count = total_count if total_count is not None else self._get_total_count()
+            if self.response is not None:
+                self.response.headers["X-Total-Count"] = str(self.total_count)
+
+        return rows
 
     def first(self):
         return self.query.first()
 
+    def stream(self, db: Session, schema, batch_size=None):
+        """ Returns a response which streams the rows, serialized with the given pydantic schema, as they are fetched
+
+        Selected by the `stream` query parameter, either `ndjson` for newline delimited JSON objects or `json`
+        for a JSON array. Rows are fetched in batches through a server side cursor where the database supports it,
+        so the memory used does not grow with the number of rows. The query is executed with the given session,
+        so it may be built without one, e.g. `Query(UserGroup)`.
+
+        :param db: The database session of the request, synchronous or asyncio
+        :param schema: The pydantic schema of a row
+        :param batch_size: The number of rows fetched and sent at a time
+        """
+        stream = self.request.query_params.get("stream")
+        if stream not in self._stream_media_types:
+            raise KeyError(f"Stream `{stream}` is not one of `ndjson` or `json`")
+
+        if self.cursor is not None or self.count != "none":
+            raise KeyError("Streamed responses cannot be combined with a `cursor` or a `count`")
+
+        batch_size = batch_size or self.stream_batch_size
+        content = self._iterate_stream(db=db, schema=schema, stream=stream, batch_size=batch_size)
+        return StreamingResponse(content=content, media_type=self._stream_media_types[stream])
+
+    async def _iterate_stream(self, db, schema, stream, batch_size):
+        statement = self.query.statement.execution_options(yield_per=batch_size)
+        if isinstance(db, AsyncSession):
+            result = await db.stream(statement)
+        else:
+            result = db.execute(statement)
+
+        rows = result.scalars() if self._is_single_entity() else result
+
+        separator = "\n" if stream == "ndjson" else ","
+        is_first_chunk = True
+        if stream == "json":
+            yield "["
+
+        # a cursor left open by a disconnected client is released along with the session of the request
+        async for partition in iterate(rows.partitions(batch_size)):
+            chunk = separator.join(schema.from_orm(row).json() for row in partition)
+            if stream == "ndjson":
+                yield chunk + separator
+            else:
+                yield chunk if is_first_chunk else separator + chunk
+            is_first_chunk = False
+
+        if stream == "json":
+            yield "]"
+
     def _process_limit(self):
         limit = self.request.query_params.get("limit")
         return int(limit) if limit else None
@@ -100,13 +300,153 @@ class QueryExecutor(object):
         offset = self.request.query_params.get("offset")
         return int(offset) if offset else None
 
-    def _process_sort(self):
-        sort = self.request.query_params.get("sort")
-        return json.loads(sort) if sort else None
+    def _process_cursor(self):
+        return self.request.query_params.get("cursor")
 
-    def _process_filters(self):
-        filters = self.request.query_params.get("filters")
-        return json.loads(filters) if filters else None
+    def _process_count(self):
+        count = self.request.query_params.get("count") or "none"
+        if count not in ("exact", "estimate", "none"):
+            raise KeyError(f"Count `{count}` is not one of `exact`, `estimate` or `none`")
+
+        return count
+
+    def _get_total_count(self):
+        if self.count == "estimate" and not self.is_filtered:
+            estimated_count = self._get_estimated_count()
+            if estimated_count is not None:
+                return estimated_count
+
+        return self.count_query.order_by(None).count()
+
+    def _get_estimated_count(self):
+        """ Returns the planner estimate of the number of rows of the mapped table, None if not available """
+        table = getattr(self.mapper, "__table__", None)
+        session = self.query.session
+        if table is None or session.get_bind().dialect.name != "postgresql":
+            return None
+
+        query = text("SELECT reltuples FROM pg_class WHERE oid = to_regclass(:table_name)")
+        reltuples = session.execute(query, dict(table_name=table.fullname)).scalar()
+
+        # tables that were never analyzed have no estimate, and small tables are cheap to count exactly
+        if reltuples is None or reltuples < self.estimated_count_threshold:
+            return None
+        return int(reltuples)
+
+    def _get_column(self, field):
+        if not hasattr(self.mapper, field):
+            raise KeyError(f"Expression `{field}` does not exist in class mapper `{repr(self.mapper)}`")
+
+        return getattr(self.mapper, field)
+
+    def _apply_cursor(self):
+        # the primary key breaks the ties of the sort keys, so that every row has a distinct position
+        if "id" not in [field for field, column, direction in self.sort_keys]:
+            direction = self.sort_keys[-1][2] if self.sort_keys else "asc"
+            self.sort_keys.append(("id", self._get_column("id"), direction))
+
+        for field, column, direction in self.sort_keys:
+            order_by = column.asc() if direction == "asc" else column.desc()
+            if self._is_nullable(column):
+                # nulls are sorted as the greatest values, like postgresql does by default
+                order_by = order_by.nulls_last() if direction == "asc" else order_by.nulls_first()
+            self.query = self.query.order_by(order_by)
+
+        if self.cursor:
+            values = self._decode_cursor(self.cursor)
+            self.query = self.query.filter(self._get_seek_predicate(values))
+
+        if self.limit:
+            # one more row tells whether there is a next page
+            self.query = self.query.limit(self.limit + 1)
+
+    def _get_seek_predicate(self, values):
+        """ Returns the predicate of the rows positioned after the given sort key values """
+        columns = [column for field, column, direction in self.sort_keys]
+        directions = {direction for field, column, direction in self.sort_keys}
+
+        if len(directions) == 1 and not any(self._is_nullable(column) for column in columns):
+            # a row value comparison can be resolved with a single index range scan
+            if directions == {"asc"}:
+                return tuple_(*columns) > tuple_(*values)
+            return tuple_(*columns) < tuple_(*values)
+
+        expressions = []
+        equals = []
+        for (field, column, direction), value in zip(self.sort_keys, values):
+            if value is None:
+                after = column.isnot(None) if direction == "desc" else false()
+                equal = column.is_(None)
+            else:
+                after = column > value if direction == "asc" else column < value
+                if self._is_nullable(column) and direction == "asc":
+                    after = or_(after, column.is_(None))
+                equal = column == value
+
+            expressions.append(and_(*equals, after))
+            equals.append(equal)
+
+        return or_(*expressions)
+
+    def _encode_cursor(self, row):
+        values = [getattr(row, field) for field, column, direction in self.sort_keys]
+        payload = json.dumps(values, default=lambda v: v.isoformat() if hasattr(v, "isoformat") else str(v))
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+    def _decode_cursor(self, cursor):
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+            if not isinstance(values, list) or len(values) != len(self.sort_keys):
+                raise ValueError()
+
+            return [
+                self._coerce_value(column, value, field=field) if value is not None else None
+                for (field, column, direction), value in zip(self.sort_keys, values)
+            ]
+        except (ValueError, TypeError, binascii.Error):
+            raise ValueError(f"Cursor `{cursor}` is not valid for the requested sort")
+
+    def _coerce_value(self, column, value, field):
+        """ Converts a JSON value to the python type of the column, so that it is compared as such """
+        python_type = self._get_python_type(column)
+
+        try:
+            if python_type is bool:
+                if isinstance(value, str) and value.lower() in ("true", "false"):
+                    return value.lower() == "true"
+                if value in (0, 1):
+                    return bool(value)
+                raise ValueError()
+            if python_type in (datetime, date):
+                value = python_type.fromisoformat(value[:-1] + "+00:00" if value.endswith("Z") else value)
+                if isinstance(value, datetime) and value.tzinfo is not None:
+                    # datetimes are stored as naive utc
+                    value = value.astimezone(timezone.utc).replace(tzinfo=None)
+                return value
+            if python_type is int and isinstance(value, float) and not value.is_integer():
+                raise ValueError()
+            if python_type in (int, float, Decimal, str):
+                return python_type(value)
+        except (ValueError, TypeError, AttributeError):
+            raise ValueError(f"Expression `{field}` has incorrect value `{value}`")
+
+        return value
+
+    @staticmethod
+    def _get_python_type(column):
+        try:
+            return column.type.python_type
+        except (AttributeError, NotImplementedError):
+            return None
+
+    def _is_single_entity(self):
+        """ Whether the query returns entities rather than rows of columns """
+        column_descriptions = self.query.column_descriptions
+        return len(column_descriptions) == 1 and isinstance(column_descriptions[0]["type"], type)
+
+    @staticmethod
+    def _is_nullable(column):
+        return getattr(column, "nullable", True) and not getattr(column, "primary_key", False)
 
     def _get_cls_mapper(self):
         if not self.query.column_descriptions:
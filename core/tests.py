@@ -0,0 +1,353 @@
+import asyncio
+import os
+import time
+import zlib
+
+import pytest
+from sqlalchemy import Column, create_engine, exc, insert, Integer, select, String
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.orm import declarative_base
+from sqlalchemy.pool import QueuePool
+
+from core import types, venom
+from core.bloom import BloomFilter
+from core.database import Replicas, RoutingSession, RoutingAsyncSession
+from core.discovery import Discovery
+from core.executors import BoundedProcessPoolExecutor, ExecutorBusyException
+from core.types import compress, decompress, is_compressed, MARKER
+
+MESSAGE = b"Content-Type: text/html\r\n\r\n" + b"<p>Reset your password</p>" * 100
+
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom_filter = BloomFilter(capacity=1000, error_rate=0.01)
+    keys = [f"token{index}" for index in range(1000)]
+    for key in keys:
+        bloom_filter.add(key)
+
+    assert all(key in bloom_filter for key in keys)
+    assert len(bloom_filter) == 1000
+    assert bloom_filter.is_full
+
+
+def test_bloom_filter_error_rate():
+    bloom_filter = BloomFilter(capacity=1000, error_rate=0.01)
+    for index in range(1000):
+        bloom_filter.add(f"token{index}")
+
+    false_positives = sum(f"other{index}" in bloom_filter for index in range(10000))
+    # about 100 expected at full capacity
+    assert false_positives < 200
+
+
+def test_empty_bloom_filter():
+    bloom_filter = BloomFilter(capacity=0)
+
+    assert "token" not in bloom_filter
+    assert not bloom_filter.is_full
+
+
+@pytest.mark.parametrize("compression", ["zlib", "zstd"])
+def test_compress_round_trip(compression):
+    if compression == "zstd" and types.zstandard is None:
+        pytest.skip("requires the `zstandard` package")
+
+    value = compress(MESSAGE, compression=compression)
+
+    assert is_compressed(value)
+    assert len(value) < len(MESSAGE)
+    assert decompress(value) == MESSAGE
+
+
+def test_compress_none():
+    assert compress(MESSAGE, compression="none") == MESSAGE
+
+
+def test_decompress_uncompressed_values():
+    # values stored before the column was compressed have no marker
+    assert decompress(MESSAGE) == MESSAGE
+    assert decompress(b"") == b""
+
+
+def test_compress_empty_value():
+    assert decompress(compress(b"")) == b""
+
+
+def test_unknown_compression():
+    with pytest.raises(ValueError):
+        compress(MESSAGE, compression="lz4")
+
+    with pytest.raises(ValueError):
+        decompress(MARKER + b"x" + zlib.compress(MESSAGE))
+
+
+def test_zstd_requires_zstandard(monkeypatch):
+    monkeypatch.setattr(types, "zstandard", None)
+
+    with pytest.raises(ValueError):
+        compress(MESSAGE, compression="zstd")
+
+    with pytest.raises(ValueError):
+        decompress(MARKER + types.COMPRESSIONS["zstd"] + b"data")
+
+
+def test_executor_runs_inline_without_workers():
+    executor = BoundedProcessPoolExecutor(max_workers=0)
+
+    assert asyncio.run(executor.run(os.getpid)) == os.getpid()
+
+
+def test_executor_runs_in_worker_process():
+    executor = BoundedProcessPoolExecutor(max_workers=1)
+    try:
+        assert asyncio.run(executor.run(os.getpid)) != os.getpid()
+        assert executor.pending == 0
+    finally:
+        executor.shutdown()
+
+
+def test_executor_rejects_tasks_over_max_pending():
+    executor = BoundedProcessPoolExecutor(max_workers=1, max_pending=1)
+    executor.pending = 1
+
+    with pytest.raises(ExecutorBusyException):
+        asyncio.run(executor.run(pow, 2, 10))
+    assert executor.pending == 1
+
+
+def test_executor_task_timeout():
+    executor = BoundedProcessPoolExecutor(max_workers=1, timeout=0.5)
+    try:
+        with pytest.raises(ExecutorBusyException):
+            asyncio.run(executor.run(time.sleep, 5))
+    finally:
+        executor.shutdown(wait=False)
+
+
+def test_executor_recovers_from_dead_worker_process():
+    executor = BoundedProcessPoolExecutor(max_workers=1)
+    try:
+        with pytest.raises(ExecutorBusyException):
+            asyncio.run(executor.run(os._exit, 1))
+
+        assert asyncio.run(executor.run(pow, 2, 10)) == 1024
+        assert executor.pending == 0
+    finally:
+        executor.shutdown()
+
+
+def test_executor_busy_is_service_unavailable():
+    handler = venom.app.exception_handlers[ExecutorBusyException]
+    response = asyncio.run(handler(None, ExecutorBusyException("Executor has reached the limit of 1 pending tasks")))
+
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "1"
+
+
+@pytest.fixture
+def application(tmp_path):
+    """ Returns the root folder of an application with a package, its templates folder and a hidden folder """
+    for path in ["app/package/api.py", "app/package/configs.yml", "app/package/templates/api.py", "app/.hidden/api.py"]:
+        (tmp_path / path).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / path).write_text("")
+    return tmp_path / "app"
+
+
+def test_discovery(application):
+    discovery = Discovery(roots=[str(application)])
+
+    assert discovery.find("api.py") == [str(application / "package" / "api.py")]
+    assert discovery.find("templates", packages=[str(application / "package")]) == \
+        [str(application / "package" / "templates")]
+    assert discovery.find("api.py", packages=[str(application / "other")]) == []
+
+
+def test_discovery_manifest_is_reused(application, tmp_path):
+    manifest_path = str(tmp_path / "manifest.json")
+    discovery = Discovery(roots=[str(application)], manifest_path=manifest_path)
+    reused = Discovery(roots=[str(application)], manifest_path=manifest_path)
+
+    assert not discovery.from_manifest
+    assert reused.from_manifest
+    assert reused.paths == discovery.paths
+
+
+def test_discovery_manifest_is_invalidated_by_new_file(application, tmp_path):
+    manifest_path = str(tmp_path / "manifest.json")
+    Discovery(roots=[str(application)], manifest_path=manifest_path)
+    (application / "package" / "tests.py").write_text("")
+    discovery = Discovery(roots=[str(application)], manifest_path=manifest_path)
+
+    assert not discovery.from_manifest
+    assert discovery.find("tests.py") == [str(application / "package" / "tests.py")]
+    assert Discovery(roots=[str(application)], manifest_path=manifest_path).from_manifest
+
+
+def test_discovery_manifest_is_invalidated_by_removed_folder(application, tmp_path):
+    manifest_path = str(tmp_path / "manifest.json")
+    Discovery(roots=[str(application)], manifest_path=manifest_path)
+    os.remove(application / ".hidden" / "api.py")
+    os.rmdir(application / ".hidden")
+
+    assert not Discovery(roots=[str(application)], manifest_path=manifest_path).from_manifest
+
+
+@pytest.mark.parametrize("manifest", ["{", '{"version": 0}'])
+def test_discovery_manifest_is_invalidated_when_unreadable(application, tmp_path, manifest):
+    manifest_path = tmp_path / "manifest.json"
+    manifest_path.write_text(manifest)
+    discovery = Discovery(roots=[str(application)], manifest_path=str(manifest_path))
+
+    assert not discovery.from_manifest
+    assert discovery.find("api.py") == [str(application / "package" / "api.py")]
+
+
+def test_discovery_manifest_of_other_roots(application, tmp_path):
+    manifest_path = str(tmp_path / "manifest.json")
+    Discovery(roots=[str(application)], manifest_path=manifest_path)
+
+    assert not Discovery(roots=[str(application / "package")], manifest_path=manifest_path).from_manifest
+
+
+Base = declarative_base()
+
+
+class Item(Base):
+    __tablename__ = "items"
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String)
+
+
+def create_database(path, name, engine_factory=create_engine, driver="sqlite"):
+    """ Returns the engine of an SQLite database holding a single item named after the database """
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as connection:
+        connection.execute(insert(Item).values(name=name))
+    engine.dispose()
+    return engine_factory(f"{driver}:///{path}")
+
+
+@pytest.fixture
+def primary(tmp_path):
+    return create_database(tmp_path / "primary.db", "primary")
+
+
+@pytest.fixture
+def replicas(tmp_path):
+    return Replicas([create_database(tmp_path / f"replica{index}.db", f"replica{index}") for index in range(2)])
+
+
+def create_session(primary, replicas, read_only=True):
+    session = RoutingSession(bind=primary, replicas=replicas, future=True)
+    session.info["read_only"] = read_only
+    return session
+
+
+def read(session, statement=None):
+    return session.execute(statement if statement is not None else select(Item.name)).scalars().all()
+
+
+def test_read_only_session_reads_replica(primary, replicas):
+    with create_session(primary, replicas) as session:
+        assert read(session) == ["replica0"]
+
+
+def test_session_reads_primary(primary, replicas):
+    with create_session(primary, replicas, read_only=False) as session:
+        assert read(session) == ["primary"]
+    with create_session(primary, replicas=None) as session:
+        assert read(session) == ["primary"]
+
+
+def test_session_sticks_to_replica(primary, replicas):
+    with create_session(primary, replicas) as session, create_session(primary, replicas) as other_session:
+        assert read(session) == ["replica0"]
+        assert read(other_session) == ["replica1"]
+        assert read(session) == ["replica0"]
+
+
+def test_session_reads_primary_after_flush(primary, replicas):
+    with create_session(primary, replicas) as session:
+        assert read(session) == ["replica0"]
+        session.add(Item(name="new"))
+        session.flush()
+
+        assert read(session) == ["primary", "new"]
+
+
+def test_session_reads_primary_after_write_statement(primary, replicas):
+    with create_session(primary, replicas) as session:
+        session.execute(insert(Item).values(name="new"))
+
+        assert read(session) == ["primary", "new"]
+
+
+def test_locking_and_primary_reads(primary, replicas):
+    with create_session(primary, replicas) as session:
+        assert read(session, select(Item.name).with_for_update()) == ["primary"]
+        assert read(session, select(Item.name).execution_options(primary=True)) == ["primary"]
+        # a read from the primary does not send the next reads to the primary
+        assert read(session) == ["replica0"]
+
+
+def test_replicas_round_robin(replicas):
+    engines = replicas.engines
+
+    assert [replicas.choose() for _ in range(3)] == [engines[0], engines[1], engines[0]]
+    replicas.mark_down(engines[1])
+    assert [replicas.choose() for _ in range(2)] == [engines[0], engines[0]]
+    replicas.mark_down(engines[0])
+    assert replicas.choose() is None
+    replicas.mark_up(engines[1])
+    assert replicas.choose() is engines[1]
+
+
+def test_replicas_least_connections(tmp_path):
+    # the SQLite file engines do not pool their connections by default
+    engines = [create_engine(f"sqlite:///{tmp_path}/replica{index}.db", poolclass=QueuePool) for index in range(2)]
+    replicas = Replicas(engines, balancing="least_connections")
+
+    with engines[0].connect():
+        assert replicas.choose() is engines[1]
+    with engines[1].connect():
+        assert replicas.choose() is engines[0]
+
+
+def test_read_fails_over_to_primary(primary, tmp_path):
+    replicas = Replicas([create_engine(f"sqlite:///{tmp_path}/missing/replica.db")])
+    with create_session(primary, replicas) as session:
+        assert read(session) == ["primary"]
+
+    assert replicas.choose() is None
+
+
+def test_failed_read_is_not_retried_on_primary(primary, tmp_path):
+    # a replica without the items table
+    replicas = Replicas([create_engine(f"sqlite:///{tmp_path}/replica.db")])
+    with create_session(primary, replicas) as session:
+        with pytest.raises(exc.OperationalError, match="no such table"):
+            read(session)
+
+    assert replicas.choose() is replicas.engines[0]
+
+
+def test_async_read_only_session_reads_replica(tmp_path):
+    primary = create_database(tmp_path / "primary.db", "primary", create_async_engine, "sqlite+aiosqlite")
+    replica = create_database(tmp_path / "replica.db", "replica", create_async_engine, "sqlite+aiosqlite")
+
+    async def read_async(read_only):
+        async with RoutingAsyncSession(bind=primary, replicas=Replicas([replica])) as session:
+            session.sync_session.info["read_only"] = read_only
+            return (await session.execute(select(Item.name))).scalars().all()
+
+    async def run():
+        try:
+            return await read_async(read_only=True), await read_async(read_only=False)
+        finally:
+            await primary.dispose()
+            await replica.dispose()
+
+    assert isinstance(RoutingAsyncSession(bind=primary).sync_session, RoutingSession)
+    assert asyncio.run(run()) == (["replica"], ["primary"])
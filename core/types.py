@@ -0,0 +1,78 @@
+import zlib
+
+from sqlalchemy import LargeBinary
+from sqlalchemy.types import TypeDecorator
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# leading bytes of a compressed value, a NUL byte never starts the stored text formats, e.g. MIME messages
+MARKER = b"\x00"
+COMPRESSIONS = {
+    "zlib": b"z",
+    "zstd": b"s"
+}
+
+
+class CompressedBinary(TypeDecorator):
+    impl = LargeBinary
+    cache_ok = True
+
+    def __init__(self, compression="zlib", *args, **kwargs):
+        """ Construct a new :class: `CompressedBinary`
+
+        Binary column whose values are stored compressed behind a marker of their compression, so that values of
+        any compression, and the uncompressed values stored before the column was compressed, are all read back.
+
+        :param compression: Either "zlib", "zstd" (requires the `zstandard` package) or "none" to store the values
+                            as given. May be a callable returning one of them, e.g. to read it from the configuration
+        """
+        super(CompressedBinary, self).__init__(*args, **kwargs)
+        self.compression = compression
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return value
+
+        compression = self.compression() if callable(self.compression) else self.compression
+        return compress(value, compression=compression)
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return value
+
+        return decompress(bytes(value))
+
+
+def compress(value: bytes, compression="zlib"):
+    """ Compresses the value and prefixes it with the marker of its compression, returns it as is for "none" """
+    if compression == "none":
+        return value
+    if compression == "zlib":
+        return MARKER + COMPRESSIONS["zlib"] + zlib.compress(value)
+    if compression == "zstd":
+        if zstandard is None:
+            raise ValueError("The zstd compression requires the `zstandard` package")
+        return MARKER + COMPRESSIONS["zstd"] + zstandard.ZstdCompressor().compress(value)
+    raise ValueError(f"Compression must be one of {', '.join(COMPRESSIONS)} or none, not `{compression}`")
+
+
+def decompress(value: bytes):
+    """ Decompresses a value compressed by :func: `compress`, values without a marker are returned as is """
+    if not is_compressed(value):
+        return value
+
+    compression, data = value[len(MARKER):len(MARKER) + 1], value[len(MARKER) + 1:]
+    if compression == COMPRESSIONS["zlib"]:
+        return zlib.decompress(data)
+    if compression == COMPRESSIONS["zstd"]:
+        if zstandard is None:
+            raise ValueError("Decompressing zstd values requires the `zstandard` package")
+        return zstandard.ZstdDecompressor().decompress(data)
+    raise ValueError(f"Unknown compression marker `{compression}`")
+
+
+def is_compressed(value: bytes):
+    return value[:len(MARKER)] == MARKER
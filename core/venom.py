@@ -1,21 +1,31 @@
+import asyncio
+import functools
 import importlib
 import logging
+import multiprocessing
 import os
+import random
+import shutil
 import sys
-from datetime import datetime
+import tempfile
+import time
+from contextlib import contextmanager
 
 import uvicorn
 from fastapi import FastAPI, APIRouter, Request, status
 from fastapi.encoders import jsonable_encoder
 from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
-from jinja2 import PackageLoader, Environment, ChoiceLoader
+from jinja2 import PackageLoader, Environment, ChoiceLoader, FileSystemBytecodeCache
 from pydantic import ValidationError
-from sqlalchemy.exc import DatabaseError
+from uvicorn.supervisors import Multiprocess
 
+from core import metrics
 from core.api.tests.unittests import TestRunner
 from core.configurations import Configuration
-from core.database import Database
+from core.database import Database, LazySession, QueryStats, query_stats
+from core.discovery import Discovery, to_package
+from core.executors import ExecutorBusyException
 from core.logs import Logger
 from core.messages import Messages
 
@@ -28,41 +38,15 @@ database = None
 templates = None
 messages = None
 server_mode = None
+discovery = None
+logs = None
+# the queue of the main process the records of a worker process are sent to
+worker_log_queue = None
 
 
 def run():
-    # load application configuration
-    global cfg
-    cfg = Configuration(filename=sys.argv[1] if len(sys.argv) > 1 else None)
-
-    global server_mode
-    server_mode = cfg["core.server.mode"]
-    if server_mode not in ["dev", "tests", "prod"]:
-        raise SystemExit(f"Invalid server mode {server_mode}. Supported modes: [dev, tests, prod]")
-
-    # load application messages
-    global messages
-    messages = Messages()
-
-    # configure global logger
-    Logger().configure()
-
-    # load templates
-    global templates
-    loaders = get_templates_packages_loaders(packages=API_PACKAGES)
-    templates = Environment(loader=ChoiceLoader(loaders), keep_trailing_newline=True)
-
-    # initialize database connection
-    global database
-    database = Database(
-        url=cfg["core.database.url"],
-        pool_size=cfg["core.database.pool_size"],
-        max_overflow=cfg["core.database.max_overflow"]
-    )
-
-    if cfg["core.database.apply_migrations"]:
-        logger.info("Applying database migrations...")
-        database.apply_migrations()
+    filename = sys.argv[1] if len(sys.argv) > 1 else os.environ.get("VENOM_CONFIG")
+    initialize(filename=filename)
 
     if server_mode.lower() == "tests":
         global app
@@ -85,17 +69,159 @@ def run():
         test_runner.run()
         return
 
+    workers = get_workers()
+    if workers > 1:
+        # the startup seeds the database, e.g. the built-in roles, once before the workers run it concurrently
+        asyncio.run(run_lifespan(asgi_app=create_app()))
+
+        # the worker processes are spawned, they initialize from the same configuration file and open their own
+        # database connections, none is inherited from this process
+        if filename:
+            os.environ["VENOM_CONFIG"] = filename
+        database.dispose()
+
+        # every worker writes its metrics to the folder, the worker handling `/metrics` merges them
+        metrics_folder_path = cfg["core.metrics.folder_path"] or tempfile.mkdtemp(prefix="venom-metrics-")
+        metrics.reset_folder(metrics_folder_path)
+        os.environ[metrics.FOLDER_ENV] = metrics_folder_path
+        logger.info(f"Starting {workers} worker processes...")
+
     # run application via uvicorn server
-    uvicorn.run(
-        app="core.venom:create_app",
+    config = uvicorn.Config(
+        app="core.venom:create_worker_app",
         host=cfg["core.server.host"],
         port=cfg["core.server.port"],
         factory=True,
-        log_level=logging.WARNING
+        log_level=logging.WARNING,
+        workers=workers,
+        loop=cfg["core.server.loop"],
+        http=cfg["core.server.http"],
+        backlog=cfg["core.server.backlog"],
+        limit_concurrency=cfg["core.server.limit_concurrency"],
+        timeout_keep_alive=cfg["core.server.timeout_keep_alive"]
     )
+    server = uvicorn.Server(config=config)
+    if workers > 1:
+        # this process writes the records of the workers, rather than every worker rotating the same log file
+        log_queue = multiprocessing.get_context("spawn").Queue()
+        logs.listen(queue=log_queue)
+        target = functools.partial(run_worker, server=server, log_queue=log_queue)
+        try:
+            WorkersSupervisor(config=config, target=target, sockets=[config.bind_socket()]).run()
+        finally:
+            if not cfg["core.metrics.folder_path"]:
+                shutil.rmtree(os.environ[metrics.FOLDER_ENV], ignore_errors=True)
+    else:
+        server.run()
+
+
+def run_worker(server, log_queue, sockets):
+    """ Runs the server in a worker process, whose records are sent to the main process through the log queue """
+    global worker_log_queue
+    worker_log_queue = log_queue
+    # the application is created before the server event loop runs, since initializing an asyncio database engine
+    # runs its own event loop
+    server.config.load()
+    server.run(sockets=sockets)
+
+
+def get_workers():
+    """ Returns the number of worker processes
+
+    That is `core.server.workers` or, when unset, the number of CPUs in the prod server mode and 1 otherwise.
+    """
+    workers = cfg["core.server.workers"]
+    if workers is None:
+        workers = (os.cpu_count() or 1) if server_mode == "prod" else 1
+    return workers
+
+
+async def run_lifespan(asgi_app):
+    """ Runs the startup and then the shutdown event handlers of the application """
+    await asgi_app.router.startup()
+    await asgi_app.router.shutdown()
+
+    # pooled asyncio connections are bound to the event loop
+    if database.is_async:
+        await database.engine.dispose()
+
+
+def initialize(filename=None, apply_migrations=True):
+    """ Loads the configuration, messages, logging, templates and database globals of the process
+
+    The files of the application are discovered once, from the manifest of the `VENOM_DISCOVERY_MANIFEST` path
+    when it is set and up to date. The time of every phase is logged once the startup is over.
+
+    :param filename: The configuration file, defaults to the configuration discovered by :class: `Configuration`
+    :param apply_migrations: Whether the migrations are applied, when enabled by `core.database.apply_migrations`
+    """
+    timer = StartupTimer()
+
+    # discover the application files
+    global discovery
+    with timer.phase("discovery"):
+        discovery = Discovery(manifest_path=os.environ.get("VENOM_DISCOVERY_MANIFEST"))
+
+    # load application configuration
+    global cfg
+    with timer.phase("configuration"):
+        cfg = Configuration(filename=filename, paths=discovery.find("configs.yml"))
+
+    global server_mode
+    server_mode = cfg["core.server.mode"]
+    if server_mode not in ["dev", "tests", "prod"]:
+        raise SystemExit(f"Invalid server mode {server_mode}. Supported modes: [dev, tests, prod]")
+
+    # load application messages
+    global messages
+    with timer.phase("messages"):
+        messages = Messages(paths=discovery.find("messages.ini"))
+
+    # configure global logger
+    global logs
+    with timer.phase("logging"):
+        logs = Logger().configure(queue=worker_log_queue)
+
+    # load templates
+    global templates
+    with timer.phase("templates"):
+        templates = create_templates(packages=API_PACKAGES)
+
+    # initialize database connection
+    global database
+    with timer.phase("database"):
+        database = Database(
+            url=cfg["core.database.url"],
+            pool_size=cfg["core.database.pool_size"],
+            max_overflow=cfg["core.database.max_overflow"],
+            slow_query_threshold=cfg["core.database.slow_query_threshold"],
+            replicas=cfg["core.database.replicas.urls"],
+            replicas_balancing=cfg["core.database.replicas.balancing"],
+            replicas_retry_interval=cfg["core.database.replicas.health_check_interval"]
+        )
+
+    if apply_migrations and cfg["core.database.apply_migrations"]:
+        logger.info("Applying database migrations...")
+        with timer.phase("migrations"):
+            database.apply_migrations(migrations_folders=discovery.find("migrations", packages=["api"]))
+
+    timer.log(f"Initialized{' from the discovery manifest' if discovery.from_manifest else ''}")
+
+
+def create_worker_app():
+    """ Returns the application of a server process
+
+    A spawned worker process starts without the globals of the main process, it initializes them from the
+    `VENOM_CONFIG` configuration file, leaving the migrations to the main process.
+    """
+    if cfg is None:
+        initialize(filename=os.environ.get("VENOM_CONFIG"), apply_migrations=False)
+    return create_app()
 
 
 def create_app(disable_logging=False):
+    timer = StartupTimer()
+
     # initialize FastAPI application
     global app
     app = FastAPI()
@@ -104,33 +230,59 @@ def create_app(disable_logging=False):
     logger.disabled = disable_logging
 
     # mount APIRouters
-    mount_api_routers(asgi_app=app, packages=API_PACKAGES)
+    with timer.phase("routers"):
+        mount_api_routers(asgi_app=app, packages=API_PACKAGES)
 
     allow_origins = getattr(cfg, "core.server.cors.origins")
     allow_credentials = getattr(cfg, "core.server.cors.allow_credentials")
     allow_methods = getattr(cfg, "core.server.cors.allow_methods")
     allow_headers = getattr(cfg, "core.server.cors.allow_headers")
+    expose_headers = getattr(cfg, "core.server.cors.expose_headers")
 
     app.add_middleware(
         CORSMiddleware,
         allow_origins=allow_origins,
         allow_credentials=allow_credentials,
         allow_methods=allow_methods,
-        allow_headers=allow_headers
+        allow_headers=allow_headers,
+        expose_headers=expose_headers
     )
 
-    @app.middleware("http")
-    async def handle_request(request: Request, call_next):
-        return await handle_http_middleware(request=request, call_next=call_next)
+    app.add_middleware(HTTPMiddleware)
+
+    check_replicas_task = None
+
+    @app.on_event("startup")
+    async def startup_event():
+        if database is not None and database.replicas:
+            nonlocal check_replicas_task
+            check_replicas_task = asyncio.create_task(
+                database.check_replicas_periodically(interval=cfg["core.database.replicas.health_check_interval"])
+            )
+
+    @app.on_event("shutdown")
+    async def shutdown_event():
+        if check_replicas_task:
+            check_replicas_task.cancel()
 
     @app.exception_handler(ValidationError)
     async def handle_validation_exception(request: Request, exc: ValidationError):
         return JSONResponse(status_code=status.HTTP_400_BAD_REQUEST, content=jsonable_encoder(exc.errors()))
 
+    @app.exception_handler(ExecutorBusyException)
+    async def handle_executor_busy_exception(request: Request, exc: ExecutorBusyException):
+        return JSONResponse(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            content={"detail": exc.detail},
+            headers={"Retry-After": "1"}
+        )
+
     @app.exception_handler(Exception)
     async def handle_exception(request: Request, exc: Exception):
         return JSONResponse(status_code=status.HTTP_400_BAD_REQUEST, content={"detail": str(exc)})
 
+    timer.log("Application created")
+
     host = getattr(cfg, "core.server.host")
     port = getattr(cfg, "core.server.port")
     logger.info(f"Server listening on http://{host}:{port}")
@@ -138,66 +290,264 @@ def create_app(disable_logging=False):
 
 
 def mount_api_routers(asgi_app, packages):
-    for package in packages:
-        for root, dirs, files in os.walk(package):
-            for filename in files:
-                if filename != "api.py":
-                    continue
-
-                api_package = root.replace(os.path.sep, ".").strip(".")
-                api_file = api_package + "." + filename.rstrip(".py")
-
-                # import api router module
-                module = importlib.import_module(name=api_file, package=api_package)
-                router = getattr(module, "app", None)
-
-                if isinstance(router, APIRouter):
-                    logger.info(f"Mounting API router package \"{api_package}\"...")
-                    asgi_app.include_router(router)
+    for path in get_discovery().find("api.py", packages=packages):
+        api_package = to_package(path)
+        api_file = api_package + ".api"
+
+        # import api router module
+        module = importlib.import_module(name=api_file, package=api_package)
+        router = getattr(module, "app", None)
+
+        if isinstance(router, APIRouter):
+            logger.info(f"Mounting API router package \"{api_package}\"...")
+            asgi_app.include_router(router)
     return asgi_app
 
 
 def get_templates_packages_loaders(packages):
     loaders = []
-    for package in packages:
-        for root, dirs, files in os.walk(package):
-            for directory in dirs:
-                if directory == "templates" and directory in dirs:
-                    loader = PackageLoader(root.replace(os.path.sep, ".").strip("."), "templates")
-                    loaders.append(loader)
+    for path in get_discovery().find("templates", packages=packages):
+        loader = PackageLoader(to_package(path), "templates")
+        loaders.append(loader)
     return loaders
 
 
-async def handle_http_middleware(request, call_next):
-    start_request_on = datetime.now()
+def get_discovery():
+    """ Returns the discovered application files, discovered on first use outside of :func: `initialize` """
+    global discovery
+    if discovery is None:
+        discovery = Discovery()
+    return discovery
 
-    if hasattr(database, "Session"):
-        request.state.session = database.Session()
 
-    response = await call_next(request)
+class WorkersSupervisor(Multiprocess):
+    """ Runs the worker processes of the server and stops them along with the main process
+
+    Signals sent to the main process alone, e.g. by a process manager or a container runtime, are forwarded to the
+    workers, which otherwise only stop on the signals sent to the whole process group, e.g. by Ctrl+C.
+    """
+
+    def shutdown(self):
+        for process in self.processes:
+            process.terminate()
+        super(WorkersSupervisor, self).shutdown()
+
+
+class StartupTimer(object):
+
+    def __init__(self):
+        """ Construct a new :class: `StartupTimer`
+
+        Measures the phases of a startup, to log how long each of them took.
+        """
+        self.start = time.perf_counter()
+        self.phases = []
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - start))
+
+    def log(self, message):
+        elapsed = round((time.perf_counter() - self.start) * 1000)
+        phases = ", ".join(f"{name} {round(duration * 1000)} ms" for name, duration in self.phases)
+        logger.info(f"{message} in {elapsed} ms ({phases})")
+
+
+def create_templates(packages):
+    """ Creates the templates environment of the packages, configured by `core.templates.*`
+
+    Without `core.templates.auto_reload` a loaded template is never checked for changes again, with
+    `core.templates.precompile` every template is loaded at startup rather than by its first render, and with
+    `core.templates.bytecode_cache_folder_path` the processes share the compiled templates on disk, so that only
+    the first of them compiles a template.
+
+    :param packages: The packages whose `templates` folders are loaded
+    """
+    precompile = cfg["core.templates.precompile"]
+    enable_async = cfg["core.templates.enable_async"]
+    bytecode_cache_folder_path = cfg["core.templates.bytecode_cache_folder_path"]
+
+    bytecode_cache = None
+    if bytecode_cache_folder_path:
+        # templates compile differently for async rendering, while the cache keys only consist of the template names
+        bytecode_cache_folder_path = os.path.join(bytecode_cache_folder_path, "async" if enable_async else "sync")
+        os.makedirs(bytecode_cache_folder_path, exist_ok=True)
+        bytecode_cache = FileSystemBytecodeCache(directory=bytecode_cache_folder_path)
+
+    environment = Environment(
+        loader=ChoiceLoader(get_templates_packages_loaders(packages=packages)),
+        keep_trailing_newline=True,
+        auto_reload=cfg["core.templates.auto_reload"],
+        bytecode_cache=bytecode_cache,
+        enable_async=enable_async,
+        # precompiled templates are never evicted
+        cache_size=-1 if precompile else 400
+    )
+
+    if precompile:
+        start = time.perf_counter()
+        names = environment.list_templates()
+        for name in names:
+            environment.get_template(name=name)
+        logger.info(f"Precompiled {len(names)} templates in {round((time.perf_counter() - start) * 1000)} ms")
+
+    return environment
+
+
+class HTTPMiddleware(object):
+
+    def __init__(self, app):
+        """ Construct a new :class: `HTTPMiddleware`
+
+        Pure ASGI middleware handling the request database session lifecycle, the request statements statistics,
+        the request metrics and the access logging.
+
+        :param app: The ASGI application to wrap
+        """
+        self.app = app
+        self.record_metrics = cfg["core.metrics.enabled"]
+        # route paths by endpoint, the route of a request is only known by its endpoint once it was handled
+        self.route_paths = None
+        self.access_sample_rate = cfg["core.logs.access.sample_rate"]
+        # access log protocols by scheme and http version, e.g. "HTTP/1.1"
+        self.protocols = dict()
+        self.repeated_selects_threshold = cfg["core.database.repeated_selects_threshold"]
+        self.server_timing = server_mode == "dev"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start_request_on = time.perf_counter()
+        status_code = None
+        if self.record_metrics:
+            metrics.http_requests_in_flight.inc()
+
+        # a plain (non scoped) session, concurrent requests of the event loop thread must not share it
+        lazy_session = LazySession(
+            factory=database.Session.session_factory if hasattr(database, "Session") else None,
+            count_lazy_loads=getattr(cfg, "core.database.debug_lazy_loads"),
+            # the reads of safe requests may be sent to the read replicas, unless they follow a write
+            read_only=scope["method"] in ("GET", "HEAD")
+        )
+        scope.setdefault("state", {})["lazy_session"] = lazy_session
+
+        # the statements executed for the request, on any session or connection
+        stats = QueryStats()
+        scope["state"]["query_stats"] = stats
+        query_stats_token = query_stats.set(stats)
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                # commit before the response reaches the client, unless the session holds no changes
+                await lazy_session.commit()
+                if self.server_timing:
+                    message["headers"] = list(message.get("headers", [])) + [
+                        (b"server-timing", get_server_timing(stats=stats, start_request_on=start_request_on))
+                    ]
+            await send(message)
 
-    try:
         try:
-            # at the end always commit
-            request.state.session.commit()
-        except DatabaseError as e:
-            logger.exception(e)
-            request.state.session.rollback()
-    finally:
-        request.state.session.close()
-        if hasattr(database, "Session"):
-            database.Session.remove()
-
-    end_request_on = datetime.now()
-    request_time = round((end_request_on - start_request_on).total_seconds() * 1000)
-    remote_addr = request.url.hostname
-    method = request.method
-    path = request.url.path
-    http_version = request.scope.get("http_version")
-    server_protocol = f"{request.url.scheme.upper()}/{http_version}"
-    status_code = response.status_code
-
-    # log request duration
-    logger.info(f"{remote_addr} [{server_protocol}] \"{method} {path}\" {status_code} ({request_time} ms)")
-
-    return response
+            await self.app(scope, receive, send_wrapper)
+        except Exception as exc:
+            await lazy_session.close(commit=False)
+            handler = self.get_exception_handler(scope)
+            if handler is not None and status_code is None:
+                # the response of the handler of the outermost middleware, sent here so that its status is recorded,
+                # the exception is still raised for the server to log it
+                response = await handler(Request(scope, receive), exc)
+                await response(scope, receive, send_wrapper)
+            raise
+        finally:
+            query_stats.reset(query_stats_token)
+            if self.record_metrics:
+                metrics.http_requests_in_flight.dec()
+                metrics.http_request_duration_seconds.labels(
+                    scope["method"], self.get_route_path(scope), str(status_code or 500)
+                ).observe(time.perf_counter() - start_request_on)
+
+        await lazy_session.close()
+
+        if lazy_session.lazy_loads:
+            # relationships loaded one query per parent object, which a loading profile would load eagerly
+            lazy_loads = ", ".join(f"{key} x{count}" for key, count in lazy_session.lazy_loads.most_common())
+            logger.warning("\"%s %s\" lazily loaded %s, consider a loading profile", scope["method"], scope["path"],
+                           lazy_loads)
+
+        if self.repeated_selects_threshold and stats.count >= self.repeated_selects_threshold:
+            for statement, count in stats.get_repeated_selects(threshold=self.repeated_selects_threshold):
+                logger.warning("\"%s %s\" executed the same statement %s times, likely N+1 queries: %s",
+                               scope["method"], scope["path"], count, " ".join(statement.split()))
+
+        if logger.isEnabledFor(logging.INFO) and self.is_access_logged(status_code):
+            request_time = round((time.perf_counter() - start_request_on) * 1000)
+            access = dict(
+                host=get_hostname(scope),
+                protocol=self.get_protocol(scope),
+                method=scope["method"],
+                path=scope["path"],
+                status=status_code,
+                duration_ms=request_time,
+                client=scope["client"][0] if scope.get("client") else None,
+                queries=stats.count,
+                queries_duration_ms=round(stats.duration * 1000, 1)
+            )
+
+            # log request duration, the fields are also those of the json format
+            logger.info("%s [%s] \"%s %s\" %s (%s ms)", access["host"], access["protocol"], access["method"],
+                        access["path"], status_code, request_time, extra=dict(access=access))
+
+    def is_access_logged(self, status_code):
+        """ Whether the access of a request is logged, failed requests always are """
+        if self.access_sample_rate >= 1 or status_code is None or status_code >= 400:
+            return True
+        return random.random() < self.access_sample_rate
+
+    def get_protocol(self, scope):
+        key = (scope["scheme"], scope.get("http_version"))
+        protocol = self.protocols.get(key)
+        if protocol is None:
+            protocol = self.protocols[key] = f"{scope['scheme'].upper()}/{scope.get('http_version')}"
+        return protocol
+
+    @staticmethod
+    def get_exception_handler(scope):
+        """ Returns the handler of the unhandled exceptions of the application, if any """
+        exception_handlers = getattr(scope.get("app"), "exception_handlers", {})
+        return exception_handlers.get(Exception) or exception_handlers.get(500)
+
+    def get_route_path(self, scope):
+        """ Returns the path of the route of a handled request, e.g. `/core/api/users/{id}`, or "unmatched" """
+        if self.route_paths is None:
+            # the first of the routes sharing an endpoint, as matched by the router
+            self.route_paths = {
+                route.endpoint: route.path for route in reversed(scope["app"].routes) if hasattr(route, "endpoint")
+            }
+        return self.route_paths.get(scope.get("endpoint"), "unmatched")
+
+
+def get_server_timing(stats, start_request_on):
+    """ Returns the `Server-Timing` header value of the statements of a request and of the request so far """
+    app_duration = (time.perf_counter() - start_request_on) * 1000
+    return f"db;dur={stats.duration * 1000:.1f};desc=\"{stats.count} queries\", app;dur={app_duration:.1f}".encode()
+
+
+def get_hostname(scope):
+    """ Returns the hostname of the request url, from the `Host` header or else the server address """
+    for name, value in scope["headers"]:
+        if name == b"host":
+            host = value.decode("latin-1")
+            # an IPv6 address, e.g. "[::1]:8000"
+            if host.startswith("["):
+                return host[1:host.find("]")]
+            return host.partition(":")[0]
+
+    server = scope.get("server")
+    return server[0] if server else None